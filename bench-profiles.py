@@ -0,0 +1,80 @@
+'''
+Compare terminal profiles (see gym_crawl/term_profiles.py): output volume and parse time per step
+when crawl is run with each TERM, over pipes or a pseudo-terminal. Needs crawl (CRAWLDIR).
+Output is counted in decoded characters, which are bytes except for non-ASCII glyphs.
+
+Usage: python3 bench-profiles.py [-steps N] [-seed N] [-pty] [-profiles NAME,NAME,...]
+'''
+import logging
+import random
+import sys
+
+from gym_crawl.envs.crawl_env import CrawlEnv
+import gym_crawl.metrics as metrics
+import gym_crawl.term_profiles as term_profiles
+
+# phases which count as parsing
+PARSE_PHASES = [metrics.PHASE_CAPTURE, metrics.PHASE_STATS, metrics.PHASE_MAP, metrics.PHASE_MESSAGES]
+
+# movement and waiting, so every profile sees similar screens
+BENCH_ACTIONS = ['h', 'j', 'k', 'l', 'y', 'u', 'b', 'n', '.', 'o']
+
+
+def bench_profile(profile, use_pty, num_steps, seed):
+    env = CrawlEnv()
+    env.set_character_name('Bench')
+    env.set_action_keys(BENCH_ACTIONS)
+    env.set_terminal(use_pty, profile)
+    rand = random.Random(seed)
+    steps = 0
+    try:
+        env.reset()
+        env.reset_metrics()
+        done = False
+        while steps < num_steps:
+            if done:
+                env.reset()
+            _, _, done, _ = env.step(rand.randrange(len(BENCH_ACTIONS)))
+            steps += 1
+        result = env.get_metrics()
+    finally:
+        env.close()
+
+    phases = result['phases']
+    chars = result['counters'].get('chars', 0)
+    parse_time = sum(phases[phase]['total'] for phase in PARSE_PHASES if phase in phases)
+    step_time = phases[metrics.PHASE_STEP]['total'] if metrics.PHASE_STEP in phases else 0.0
+    return chars / steps, parse_time / steps, step_time / steps
+
+
+num_steps = 500
+seed = 0
+use_pty = False
+profiles = list(term_profiles.TERM_PROFILES)
+arguments = sys.argv[1:]
+i = 0
+while i < len(arguments):
+    arg = arguments[i]
+    if arg == '-steps':
+        i += 1
+        num_steps = int(arguments[i])
+    elif arg == '-seed':
+        i += 1
+        seed = int(arguments[i])
+    elif arg == '-pty':
+        use_pty = True
+    elif arg == '-profiles':
+        i += 1
+        profiles = arguments[i].split(',')
+    else:
+        print(__doc__)
+        sys.exit(1)
+    i += 1
+
+logging.basicConfig(filename='bench-profiles.log', filemode='w', level=logging.WARNING)
+
+print('{:12} {:>6} {:>12} {:>15} {:>14}'.format('Profile', 'PTY', 'Chars/step', 'Parse ms/step', 'Step ms/step'))
+for profile in profiles:
+    chars, parse_time, step_time = bench_profile(profile, use_pty, num_steps, seed)
+    print('{:12} {:>6} {:12.0f} {:15.3f} {:14.3f}'.format(profile, 'yes' if use_pty else 'no', chars,
+                                                        parse_time * 1000, step_time * 1000))
@@ -0,0 +1,161 @@
+'''
+Micro-benchmark for terminal capture and parsing, using synthetic DCSS-like output
+
+With -backends, also compares terminal backends (see gym_crawl/terminal_backend.py): throughput, and the
+fraction of frames whose screen matches the capture backend's. -import imports a module which registers backends.
+
+Usage: python3 bench-terminal.py [-frames N] [-seed N] [-worst-case] [-backends NAME,NAME,...] [-import MODULE]
+'''
+import logging
+import sys
+import time
+import tracemalloc
+
+import gym_crawl.terminal_backend as terminal_backend
+import gym_crawl.terminal_capture as tc
+import gym_crawl.terminal_parser as parser
+from gym_crawl.gamestate import GameState
+from gym_crawl.stream_gen import StreamGenerator, WORST_CASE_KINDS
+
+WORST_CASE_SIZES = [10000, 100000, 1000000]
+
+
+def bench_throughput(num_frames, seed):
+    frames = list(StreamGenerator(seed).frames(num_frames))
+    num_chars = sum(len(frame) for frame in frames)
+
+    terminal = tc.TerminalCapture()
+    game_state = GameState()
+    capture_time = 0.0
+    stats_time = 0.0
+    map_time = 0.0
+    for frame in frames:
+        start = time.perf_counter()
+        terminal.handle_output(frame)
+        capture_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        parser.update_stats(terminal.screen, game_state)
+        stats_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        parser.extract_map(terminal.screen)
+        map_time += time.perf_counter() - start
+
+    print('Frames: {}  Chars: {}  Avg chars/frame: {:.0f}'.format(num_frames, num_chars, num_chars / num_frames))
+    print('handle_output: {:12.0f} chars/sec  {:8.1f} us/frame'.format(num_chars / capture_time, 1e6 * capture_time / num_frames))
+    print('update_stats:  {:12.1f} us/frame'.format(1e6 * stats_time / num_frames))
+    print('extract_map:   {:12.1f} us/frame'.format(1e6 * map_time / num_frames))
+    return frames
+
+
+def bench_allocations(frames):
+    """ Report peak traced memory and retained memory blocks per frame.
+        Snapshots only see blocks still alive after the frame, so short-lived allocations show up in the peak
+        rather than the block count.
+    """
+    terminal = tc.TerminalCapture()
+    game_state = GameState()
+    tracemalloc.start()
+    peak_total = 0
+    retained_total = 0
+    for frame in frames:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        terminal.handle_output(frame)
+        parser.update_stats(terminal.screen, game_state)
+        parser.extract_map(terminal.screen)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        peak_total += peak - base
+        retained_total += sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+    tracemalloc.stop()
+    num_frames = len(frames)
+    print('Allocations:   {:12.1f} KiB peak/frame  {:8.1f} retained blocks/frame'.format(
+        peak_total / num_frames / 1024, retained_total / num_frames))
+
+
+def bench_worst_case(seed):
+    """ Check time per char stays flat as the size of a single chunk grows """
+    for kind in WORST_CASE_KINDS:
+        base_rate = None
+        for size in WORST_CASE_SIZES:
+            data = StreamGenerator(seed).worst_case(kind, size)
+            terminal = tc.TerminalCapture()
+            start = time.perf_counter()
+            try:
+                terminal.handle_output(data)
+            except Exception as e:
+                print('{:12} {:8d} chars: FAILED: {}'.format(kind, len(data), e))
+                break
+            elapsed = time.perf_counter() - start
+            rate = 1e9 * elapsed / len(data)
+            if base_rate is None:
+                base_rate = rate
+            ratio = rate / base_rate
+            print('{:12} {:8d} chars: {:10.1f} ns/char  x{:.2f}{}'.format(
+                kind, len(data), rate, ratio, '  NON-LINEAR' if ratio > 2.0 else ''))
+
+
+def bench_backends(frames, backends):
+    """ Compare backends on the same frames against the capture backend """
+    num_chars = sum(len(frame) for frame in frames)
+    reference = terminal_backend.create_backend()
+    expected = []
+    for frame in frames:
+        reference.feed(frame)
+        expected.append((reference.screen.hash(), tuple(reference.cursor())))
+
+    print('{:12} {:>14} {:>12} {:>10}'.format('Backend', 'Chars/sec', 'us/frame', 'Agreement'))
+    for name in backends:
+        backend = terminal_backend.create_backend(name)
+        elapsed = 0.0
+        agreed = 0
+        for frame, (screen_hash, cursor) in zip(frames, expected):
+            start = time.perf_counter()
+            backend.feed(frame)
+            elapsed += time.perf_counter() - start
+            if backend.screen.hash() == screen_hash and tuple(backend.cursor()) == cursor:
+                agreed += 1
+        print('{:12} {:14.0f} {:12.1f} {:9.1f}%'.format(name, num_chars / elapsed, 1e6 * elapsed / len(frames),
+                                                       100.0 * agreed / len(frames)))
+
+
+if __name__ == '__main__':
+    num_frames = 1000
+    seed = 0
+    worst_case = False
+    backends = None
+    arguments = sys.argv[1:]
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        if arg == '-frames':
+            i += 1
+            num_frames = int(arguments[i])
+        elif arg == '-seed':
+            i += 1
+            seed = int(arguments[i])
+        elif arg == '-worst-case':
+            worst_case = True
+        elif arg == '-backends':
+            i += 1
+            backends = arguments[i].split(',')
+        elif arg == '-import':
+            i += 1
+            terminal_backend.import_backends(arguments[i])
+        else:
+            print(__doc__)
+            sys.exit(1)
+        i += 1
+
+    # pathological input triggers warnings, which would swamp the results
+    logging.getLogger('term-capture').setLevel(logging.ERROR)
+
+    frames = bench_throughput(num_frames, seed)
+    bench_allocations(frames[:min(len(frames), 200)])
+    if worst_case:
+        bench_worst_case(seed)
+    if backends is not None:
+        bench_backends(frames, backends)
@@ -0,0 +1,153 @@
+'''
+Check the state side-channel (see gym_crawl/state_channel.py) round-trips records into GameState, using
+fake-state-crawl.py in place of crawl. No crawl needed.
+Then run CrawlEnv with the channel on and fake-state-crawl.py as crawl, and check each step's state agrees with
+what the stats panel parser makes of the screen (-steps 0 to skip).
+
+Usage: python3 check-state-channel.py [-records N] [-seed N] [-steps N]
+'''
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from gym_crawl.envs.crawl_env import CrawlEnv
+from gym_crawl.gamestate import GameState
+import gym_crawl.state_channel as state_channel
+import gym_crawl.terminal_parser as parser
+
+FAKE_CRAWL = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake-state-crawl.py')
+
+# how long to wait for a record to appear
+READ_TIMEOUT = 5.0
+
+# game state attributes shown in the stats panel, so set by both the channel and the parser
+PANEL_ATTRIBUTES = ['hp', 'max_hp', 'mp', 'max_mp', 'str', 'int', 'dex', 'ac', 'ev', 'sh', 'xl', 'pcnt_next_xl',
+                    'time', 'place']
+
+
+def wait_for_record(channel):
+    end_time = time.time() + READ_TIMEOUT
+    while time.time() < end_time:
+        record = channel.read()
+        if record is not None:
+            return record
+        time.sleep(0.001)
+    return None
+
+
+def compare(values, game_state):
+    """ Differences between the values written and the game state, as a list of descriptions """
+    differences = []
+    for key, (attribute, convert) in state_channel.GAME_STATE_FIELDS.items():
+        if getattr(game_state, attribute) != convert(values[key]):
+            differences.append('{}: wrote {!r}, got {!r}'.format(attribute, values[key], getattr(game_state, attribute)))
+    monsters = [tuple(monster) for monster in values['mons']]
+    if game_state.monsters != monsters:
+        differences.append('monsters: wrote {}, got {}'.format(monsters, game_state.monsters))
+    if not game_state.started:
+        differences.append('started not set')
+    return differences
+
+
+def check(num_records, seed):
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory:
+        channel = state_channel.StateChannel(directory)
+        channel.clear()
+        fake_crawl = subprocess.Popen([sys.executable, FAKE_CRAWL, directory, '-records', str(num_records),
+                                       '-seed', str(seed)], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                      universal_newlines=True)
+        try:
+            for line in fake_crawl.stdout:
+                values = json.loads(line)
+                record = wait_for_record(channel)
+                if record is None:
+                    print('Record {}: not read'.format(values['seq']))
+                    failures += 1
+                    break
+                game_state = GameState()
+                state_channel.apply_state_record(record, game_state)
+                differences = compare(values, game_state)
+                if record.get('seq') != str(values['seq']):
+                    differences.append('seq: wrote {}, got {}'.format(values['seq'], record.get('seq')))
+                if channel.read() is not None:
+                    differences.append('read twice')
+                if differences:
+                    failures += 1
+                    print('Record {}: {}'.format(values['seq'], '; '.join(differences)))
+                fake_crawl.stdin.write('\n')
+                fake_crawl.stdin.flush()
+        finally:
+            fake_crawl.stdin.close()
+            fake_crawl.wait()
+    print('{} records, {} failed'.format(num_records, failures))
+    return failures
+
+
+def check_env(num_steps):
+    """ Step CrawlEnv with the channel on, comparing its state with the parsed stats panel """
+    failures = 0
+    with tempfile.TemporaryDirectory() as crawl_dir:
+        os.mkdir(os.path.join(crawl_dir, 'bin'))
+        os.symlink(FAKE_CRAWL, os.path.join(crawl_dir, 'bin', 'crawl'))
+        os.environ['CRAWLDIR'] = crawl_dir
+        env = CrawlEnv()
+        # keep the records and rc file out of the current directory
+        env.set_instance_dir(True)
+        env.set_state_channel(True)
+        env.set_action_keys(['.'])
+        try:
+            game_state, _, _, _ = env.reset()
+            last_turn = None
+            for step in range(num_steps + 1):
+                if step > 0:
+                    game_state, _, _, _ = env.step(0)
+                parsed_state = GameState()
+                parser.update_stats(env.terminal.screen, parsed_state)
+                differences = []
+                for attribute in PANEL_ATTRIBUTES:
+                    if getattr(game_state, attribute) != getattr(parsed_state, attribute):
+                        differences.append('{}: channel {!r}, parsed {!r}'.format(
+                            attribute, getattr(game_state, attribute), getattr(parsed_state, attribute)))
+                # turn isn't in the stats panel, so it only changes if the record was used
+                if game_state.turn == last_turn:
+                    differences.append('no record read')
+                last_turn = game_state.turn
+                if differences:
+                    failures += 1
+                    print('Step {}: {}'.format(step, '; '.join(differences)))
+        finally:
+            env.close()
+    print('{} env steps, {} failed'.format(num_steps, failures))
+    return failures
+
+
+if __name__ == '__main__':
+    num_records = 100
+    seed = 0
+    num_steps = 50
+    arguments = sys.argv[1:]
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        if arg == '-records':
+            i += 1
+            num_records = int(arguments[i])
+        elif arg == '-seed':
+            i += 1
+            seed = int(arguments[i])
+        elif arg == '-steps':
+            i += 1
+            num_steps = int(arguments[i])
+        else:
+            print(__doc__)
+            sys.exit(1)
+        i += 1
+
+    failures = check(num_records, seed)
+    if num_steps > 0:
+        failures += check_env(num_steps)
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,126 @@
+'''
+Check terminal backends (see gym_crawl/terminal_backend.py) against the conformance corpus, or add cases to it.
+Backends from other modules can be checked with -import, which imports a module that registers them.
+Recording from crawl needs CRAWLDIR, and replays the session through the capture backend for the expected screens.
+
+Usage: python3 check-terminal.py [-corpus FILE] [-backends NAME,NAME,...] [-import MODULE] [-verbose]
+       python3 check-terminal.py [-corpus FILE] -record-synthetic FRAMES [-seed N]
+       python3 check-terminal.py [-corpus FILE] -record-crawl STEPS [-seed N]
+'''
+import logging
+import random
+import sys
+
+from gym_crawl.stream_gen import StreamGenerator
+import gym_crawl.terminal_backend as terminal_backend
+import gym_crawl.terminal_conformance as conformance
+
+DEFAULT_CORPUS = 'terminal-corpus.jsonl'
+
+# actions for recording, which move around and open a few menus
+RECORD_ACTIONS = ['h', 'j', 'k', 'l', 'y', 'u', 'b', 'n', '.', 'o', 'i', 'x', '\x1b']
+
+
+def split_chunks(frames, rand):
+    """ Split frames at random points, as reads from a pipe would """
+    chunks = []
+    for frame in frames:
+        start = 0
+        while len(frame) - start > 1 and rand.random() < 0.5:
+            end = rand.randrange(start + 1, len(frame))
+            chunks.append(frame[start:end])
+            start = end
+        chunks.append(frame[start:])
+    return chunks
+
+
+def record_synthetic(num_frames, seed):
+    frames = list(StreamGenerator(seed).frames(num_frames))
+    chunks = split_chunks(frames, random.Random(seed))
+    return conformance.make_case('synthetic-{}-{}'.format(seed, num_frames), 'synthetic', chunks)
+
+
+def record_crawl(num_steps, seed):
+    from gym_crawl.envs.crawl_env import CrawlEnv
+
+    env = CrawlEnv()
+    env.set_character_name('Corpus')
+    env.set_action_keys(RECORD_ACTIONS)
+    env.set_terminal_backend('recording')
+    rand = random.Random(seed)
+    try:
+        env.reset()
+        for _ in range(num_steps):
+            _, _, done, _ = env.step(rand.randrange(len(RECORD_ACTIONS)))
+            if done:
+                break
+        chunks = env.terminal.chunks
+    finally:
+        env.close()
+    return conformance.make_case('crawl-{}-{}'.format(seed, num_steps), 'recorded', chunks)
+
+
+def check_backends(cases, backends, verbose):
+    failed = 0
+    for backend in backends:
+        results = conformance.run_corpus(backend, cases)
+        passed = sum(1 for _, failures in results if not failures)
+        print('{:12} {:4d}/{:d} cases passed'.format(backend, passed, len(results)))
+        for name, failures in results:
+            if failures:
+                failed += 1
+                print('    FAILED {} ({} differences)'.format(name, len(failures)))
+                for failure in failures if verbose else failures[:1]:
+                    print('        ' + failure)
+    return failed
+
+
+if __name__ == '__main__':
+    corpus = DEFAULT_CORPUS
+    backends = None
+    verbose = False
+    record_frames = None
+    record_steps = None
+    seed = 0
+    arguments = sys.argv[1:]
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        if arg == '-corpus':
+            i += 1
+            corpus = arguments[i]
+        elif arg == '-backends':
+            i += 1
+            backends = arguments[i].split(',')
+        elif arg == '-import':
+            i += 1
+            terminal_backend.import_backends(arguments[i])
+        elif arg == '-verbose':
+            verbose = True
+        elif arg == '-record-synthetic':
+            i += 1
+            record_frames = int(arguments[i])
+        elif arg == '-record-crawl':
+            i += 1
+            record_steps = int(arguments[i])
+        elif arg == '-seed':
+            i += 1
+            seed = int(arguments[i])
+        else:
+            print(__doc__)
+            sys.exit(1)
+        i += 1
+
+    logging.basicConfig(filename='check-terminal.log', filemode='w', level=logging.WARNING)
+
+    if record_frames is not None or record_steps is not None:
+        case = record_synthetic(record_frames, seed) if record_frames is not None else record_crawl(record_steps, seed)
+        conformance.append_case(corpus, case)
+        print('Added {} ({} chunks, {} checkpoints) to {}'.format(case['name'], len(case['chunks']),
+                                                                  len(case['checkpoints']), corpus))
+        sys.exit(0)
+
+    if backends is None:
+        backends = sorted(terminal_backend.BACKENDS)
+    cases = conformance.load_corpus(corpus)
+    sys.exit(1 if check_backends(cases, backends, verbose) else 0)
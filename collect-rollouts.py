@@ -0,0 +1,63 @@
+'''
+Collect episodes with a random or scripted policy, run inside the env worker processes so there is
+no round trip per step.
+
+Usage: python3 collect-rollouts.py [-envs N] [-episodes N] [-max-steps N] [-policy random|explore] [-seed N]
+'''
+import sys
+import time
+
+import gym_crawl.policies as policies
+from gym_crawl.vec_env import SharedMemoryVecEnv
+
+num_envs = 4
+num_episodes = 1
+max_steps = None
+policy_name = 'random'
+seed = None
+arguments = sys.argv[1:]
+i = 0
+while i < len(arguments):
+    arg = arguments[i]
+    if arg == '-envs':
+        i += 1
+        num_envs = int(arguments[i])
+    elif arg == '-episodes':
+        i += 1
+        num_episodes = int(arguments[i])
+    elif arg == '-max-steps':
+        i += 1
+        max_steps = int(arguments[i])
+    elif arg == '-policy':
+        i += 1
+        policy_name = arguments[i]
+    elif arg == '-seed':
+        i += 1
+        seed = int(arguments[i])
+    else:
+        print(__doc__)
+        sys.exit(1)
+    i += 1
+
+if policy_name == 'random':
+    policy = policies.RandomPolicy()
+elif policy_name == 'explore':
+    policy = policies.ExplorePolicy()
+else:
+    print('Unknown policy: ' + policy_name)
+    sys.exit(1)
+
+venv = SharedMemoryVecEnv(num_envs, character_name='Rollout')
+try:
+    start_time = time.perf_counter()
+    trajectories = venv.rollout(policy, max_steps, num_episodes, seed)
+    seconds = time.perf_counter() - start_time
+finally:
+    venv.close()
+
+total_steps = 0
+for index, trajectory in enumerate(trajectories):
+    total_steps += trajectory['steps']
+    print('Env {}: Steps: {}  Episode scores: {}  Episode steps: {}  Steps/sec: {:.1f}'.format(
+        index, trajectory['steps'], trajectory['episode_scores'], trajectory['episode_steps'], trajectory['steps_per_second']))
+print('Total: {} steps in {:.1f} seconds ({:.1f} steps/sec)'.format(total_steps, seconds, total_steps / seconds))
@@ -0,0 +1,44 @@
+'''
+Host crawl environments for remote agents.
+
+Usage: python3 crawl-server.py [-tcp HOST:PORT] [-unix PATH] [-debug]
+
+Agents connect with gym_crawl.remote_env.RemoteCrawlEnv, e.g. RemoteCrawlEnv(('localhost', 7654))
+There is no authentication, so -tcp :PORT only listens on the local machine. To accept connections from other
+machines, give the host explicitly (e.g. -tcp 0.0.0.0:7654) on a trusted network only.
+'''
+import logging
+import sys
+
+from gym_crawl.server import create_server
+
+address = ('localhost', 7654)
+log_level = logging.INFO
+arguments = sys.argv[1:]
+i = 0
+while i < len(arguments):
+    arg = arguments[i]
+    if arg == '-tcp':
+        i += 1
+        host, _, port = arguments[i].rpartition(':')
+        address = (host or '127.0.0.1', int(port))
+    elif arg == '-unix':
+        i += 1
+        address = arguments[i]
+    elif arg == '-debug':
+        log_level = logging.DEBUG
+    else:
+        print('Unknown argument: ' + arg)
+        sys.exit(1)
+    i += 1
+
+logging.basicConfig(filename='crawl-server.log', filemode='w', level=log_level, format='%(asctime)s:%(levelname)s:%(module)s:%(thread)d:%(message)s')
+
+server = create_server(address)
+print('Serving crawl environments on {}'.format(address))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    pass
+finally:
+    server.server_close()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+'''
+Stand-in for crawl with the state side-channel hook (see gym_crawl/state_channel.py and state_hook.rc), for
+testing the channel without DCSS. Like crawl, it writes a record each time it's ready for a command: it writes
+one, prints the values as a JSON line on stdout, then waits for a line on stdin before writing the next.
+
+Run with crawl's arguments (as $CRAWLDIR/bin/crawl, with -rc), it writes records in the current directory and draws
+a screen whose stats panel shows the same values, taking a key from stdin as the command for each record.
+
+Usage: python3 fake-state-crawl.py DIRECTORY [-records N] [-seed N]
+'''
+import json
+import os
+import random
+import sys
+
+import gym_crawl.state_channel as state_channel
+
+MONSTER_NAMES = ['rat', 'jackal', 'goblin', 'kobold', 'adder', 'Sigmund']
+PLACES = ['D:1', 'D:2', 'D:3', 'Lair:1', 'Orc:2', 'Temple']
+ESC = '\x1b'
+CTRL_Q = '\x11'
+
+
+def make_values(seq, rng):
+    """ Field values for record seq, in the order the hook writes them """
+    max_hp = rng.randint(10, 200)
+    max_mp = rng.randint(0, 50)
+    monsters = []
+    for _ in range(rng.randint(0, 4)):
+        monsters.append((rng.choice(MONSTER_NAMES), rng.randint(-7, 7), rng.randint(-7, 7)))
+    return {
+        'seq': seq,
+        'turn': seq * 10,
+        'time': round(seq * 9.5, 1),
+        'hp': rng.randint(0, max_hp), 'max_hp': max_hp,
+        'mp': rng.randint(0, max_mp), 'max_mp': max_mp,
+        'str': rng.randint(1, 30), 'int': rng.randint(1, 30), 'dex': rng.randint(1, 30),
+        'ac': rng.randint(0, 40), 'ev': rng.randint(0, 40), 'sh': rng.randint(0, 20),
+        'xl': rng.randint(1, 27), 'next': rng.randint(0, 99),
+        'place': rng.choice(PLACES),
+        'inv': ''.join(sorted(rng.sample('abcdefghijklmnopqrstuvwxyz', rng.randint(0, 10)))),
+        'mons': monsters,
+    }
+
+
+
+def cup(row, col):
+    return '{}[{};{}H'.format(ESC, row + 1, col + 1)
+
+
+def draw_screen(values):
+    """ Map with the player in the middle and the stats panel, in the layout crawl uses """
+    parts = [ESC + '[2J']
+    for row in range(17):
+        parts.append(cup(row, 0))
+        parts.append(''.join('@' if (row, col) == (8, 16) else '#' if col in (0, 32) else '.' for col in range(33)))
+    lines = [
+        'Bot the Skirmisher',
+        'Minotaur',
+        'Health: {}/{}    ========'.format(values['hp'], values['max_hp']),
+        'Magic:  {}/{}      ========'.format(values['mp'], values['max_mp']),
+        'AC: {:2}    Str: {:2}'.format(values['ac'], values['str']),
+        'EV: {:2}    Int: {:2}'.format(values['ev'], values['int']),
+        'SH: {:2}    Dex: {:2}'.format(values['sh'], values['dex']),
+        'XL: {:2} Next: {:2}% Place: {}'.format(values['xl'], values['next'], state_channel.panel_place(values['place'])),
+        'Noise:    Time: {:.1f} (1.0)'.format(values['time']),
+    ]
+    for row, line in enumerate(lines):
+        parts.append(cup(row, 37) + line + ESC + '[K')
+    parts.append(cup(8, 16))
+    sys.stdout.write(''.join(parts))
+    sys.stdout.flush()
+
+
+def run_as_crawl(seed):
+    """ Act like crawl: a record and a redraw for each key, until Ctrl-Q or end of input """
+    rng = random.Random(seed)
+    stdin = os.fdopen(sys.stdin.fileno(), 'rb', buffering=0)
+    seq = 0
+    key = ''
+    while key != CTRL_Q:
+        if key != ESC:
+            seq += 1
+            values = make_values(seq, rng)
+            state_channel.write_state_record('.', values)
+            draw_screen(values)
+        key = stdin.read(1).decode()
+        if not key:
+            break
+
+
+if __name__ == '__main__':
+    if '-rc' in sys.argv:
+        run_as_crawl(0)
+        sys.exit(0)
+    if len(sys.argv) < 2 or sys.argv[1].startswith('-'):
+        print(__doc__)
+        sys.exit(1)
+    directory = sys.argv[1]
+    num_records = 10
+    seed = 0
+    arguments = sys.argv[2:]
+    i = 0
+    while i < len(arguments):
+        arg = arguments[i]
+        if arg == '-records':
+            i += 1
+            num_records = int(arguments[i])
+        elif arg == '-seed':
+            i += 1
+            seed = int(arguments[i])
+        else:
+            print(__doc__)
+            sys.exit(1)
+        i += 1
+
+    rng = random.Random(seed)
+    for seq in range(1, num_records + 1):
+        values = make_values(seq, rng)
+        state_channel.write_state_record(directory, values)
+        print(json.dumps(values), flush=True)
+        if not sys.stdin.readline():
+            break
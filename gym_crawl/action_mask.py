@@ -0,0 +1,175 @@
+'''
+Valid action masks, worked out from the screen, game state, map and messages.
+
+An action is masked out when it's known to do nothing but open a prompt or print a refusal:
+stairs keys off the stairs, item commands with no suitable item, and commands the character
+has been told it can't use (e.g. spells when it knows none). Anything unknown is allowed.
+'''
+import re
+
+import numpy as np
+
+import gym_crawl.crawl_defs as defs
+from gym_crawl.macros import Macro
+
+# messages after a key which mean it can't do anything for now
+UNAVAILABLE_MESSAGES = {
+    'a': ["not good enough to have a special ability", "You don't have any abilities"],
+    'z': ["You don't know any spells"],
+    'Z': ["You don't know any spells"],
+    'p': ['not religious'],
+    '>': ["You can't go down here"],
+    '<': ["You can't go up here"],
+}
+
+# words in item names, for commands which need a kind of item
+POTION_WORDS = ['potion']
+SCROLL_WORDS = ['scroll']
+FOOD_WORDS = ['ration', 'chunk', 'bread', 'meat', 'fruit', 'jerky']
+JEWELLERY_WORDS = ['ring of', 'amulet']
+
+# statuses of worn armour and jewellery
+JEWELLERY_STATUSES = ['left hand', 'right hand', 'around neck', 'on left hand', 'on right hand']
+
+_stairs_re = re.compile(r'There is .+ leading (down|up)')
+
+STAIRS_KEYS = ('<', '>')
+
+
+def _has_item(items, words=None, statuses=None, in_use=None):
+    for item in items.values():
+        if words is not None and not any(word in item.name for word in words):
+            continue
+        if statuses is not None and item.status not in statuses:
+            continue
+        if in_use is not None and bool(item.status) != in_use:
+            continue
+        return True
+    return False
+
+
+def item_invalid_keys(items):
+    """ Item command keys which can't do anything with these items (letter -> InventoryItem) """
+    invalid = set()
+    if not items:
+        return set('dqrePRT')
+    if not _has_item(items, POTION_WORDS):
+        invalid.add('q')
+    if not _has_item(items, SCROLL_WORDS):
+        invalid.add('r')
+    if not _has_item(items, FOOD_WORDS):
+        invalid.add('e')
+    if not _has_item(items, JEWELLERY_WORDS, in_use=False):
+        invalid.add('P')
+    if not _has_item(items, JEWELLERY_WORDS, in_use=True):
+        invalid.add('R')
+    if not _has_item(items, statuses=['worn']):
+        invalid.add('T')
+    return invalid
+
+
+def _player_moved(prev_map, game_map):
+    """ Check whether the player moved between two maps, from the terrain around them """
+    if prev_map is game_map:
+        return False
+    if prev_map is None or game_map is None or prev_map.player_pos is None or game_map.player_pos is None:
+        return None
+    if prev_map.player_pos != game_map.player_pos:
+        return True
+    x, y = game_map.player_pos
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            prev_cell = prev_map.cells.get(x + dx, {}).get(y + dy)
+            cell = game_map.cells.get(x + dx, {}).get(y + dy)
+            if prev_cell is None or cell is None:
+                continue
+            # monsters come and go, so only compare terrain and items
+            if prev_cell.glyph in defs.MONSTER_CHARS or cell.glyph in defs.MONSTER_CHARS:
+                continue
+            if prev_cell.glyph != cell.glyph:
+                return True
+    return False
+
+
+class ActionMasker:
+    """ Keeps what's been learnt about the current episode and makes a mask for each step.
+        Masks are shared between steps with the same invalid keys, so must not be modified.
+    """
+
+    def __init__(self, action_keys):
+        self.set_action_keys(action_keys)
+        self.reset()
+
+    def set_action_keys(self, action_keys):
+        """ Change the list of actions, keeping what's been learnt """
+        # an action is judged by its first key, e.g. 'er' + ESC needs food
+        self.first_keys = []
+        for keys in action_keys:
+            if isinstance(keys, Macro):
+                keys = keys.keys
+            self.first_keys.append(keys[:1])
+        self.all_valid = self._make_mask(frozenset())
+        self.masks = {}
+
+    def reset(self):
+        self.unavailable = set()
+        self.stairs = '<' # the game starts on the stairs out of the dungeon
+        self.items = None
+        self.item_invalid = set()
+        self.prev_map = None
+        self.xl = None
+        self.place = None
+
+    def _make_mask(self, invalid):
+        mask = np.array([keys not in invalid for keys in self.first_keys], bool)
+        mask.flags.writeable = False
+        return mask
+
+    def update(self, game_state, keys='', items=None):
+        """ Take in the state after sending keys, and return the mask for the next action.
+            items is the known inventory (letter -> InventoryItem) or None if it isn't known.
+        """
+        key = keys[:1]
+        messages = game_state.messages
+
+        # learnt refusals last until something changes which could make the command work
+        if game_state.xl != self.xl or game_state.place != self.place or items is not self.items:
+            self.unavailable = set()
+        refused = False
+        if key in UNAVAILABLE_MESSAGES:
+            for message in messages:
+                if any(text in message for text in UNAVAILABLE_MESSAGES[key]):
+                    refused = True
+                    break
+        if refused and key in STAIRS_KEYS:
+            self.stairs = self.stairs.replace(key, '')
+        elif refused:
+            self.unavailable.add(key)
+
+        # stairs under the player
+        game_map = game_state.map
+        if key in STAIRS_KEYS and self.place is not None and game_state.place != self.place:
+            # arrived on the stairs going the other way
+            self.stairs = '<' if key == '>' else '>'
+        elif _player_moved(self.prev_map, game_map):
+            self.stairs = ''
+        for message in messages:
+            match = _stairs_re.search(message)
+            if match:
+                self.stairs = '>' if match.group(1) == 'down' else '<'
+        self.prev_map = game_map
+        self.xl = game_state.xl
+        self.place = game_state.place
+
+        if items is not self.items:
+            self.items = items
+            self.item_invalid = item_invalid_keys(items) if items is not None else set()
+
+        if not game_state.on_main_screen:
+            return self.all_valid
+        invalid = frozenset(self.unavailable.union(self.item_invalid, set(STAIRS_KEYS) - set(self.stairs)))
+        mask = self.masks.get(invalid)
+        if mask is None:
+            mask = self._make_mask(invalid)
+            self.masks[invalid] = mask
+        return mask
@@ -0,0 +1,109 @@
+'''
+Observations as fixed-size numpy arrays, for batching and sharing between processes
+'''
+import numpy as np
+
+import gym_crawl.terminal_parser as parser
+
+SCREEN_ROWS = 24
+SCREEN_COLS = 80
+MAP_ROWS = parser.MAP_END_ROW - parser.MAP_START_ROW + 1
+MAP_COLS = parser.MAP_END_COL - parser.MAP_START_COL + 1
+
+# game state fields in the stats vector
+STATS_FIELDS = ['on_main_screen', 'started', 'won', 'died', 'escaped', 'has_orb', 'hp', 'max_hp', 'mp', 'max_mp',
+                'str', 'int', 'dex', 'ac', 'ev', 'sh', 'xl', 'pcnt_next_xl', 'noise', 'time', 'turn']
+
+# observation arrays: name -> (shape, dtype)
+OBSERVATION_SPEC = {
+    'screen_glyphs': ((SCREEN_ROWS, SCREEN_COLS), np.uint32),   # unicode code points
+    'screen_styles': ((3, SCREEN_ROWS, SCREEN_COLS), np.uint8), # terminal fg color, bg color, bold
+    'map_glyphs': ((MAP_ROWS, MAP_COLS), np.uint32),            # indexed by y, x
+    'map_colors': ((2, MAP_ROWS, MAP_COLS), np.uint8),          # map.Color values of fg, bg
+    'stats': ((len(STATS_FIELDS),), np.float32),
+    'step': ((), np.int64),
+}
+
+
+# arrays in a buffer start on a multiple of this
+ALIGNMENT = 8
+
+
+def _aligned_size(shape, dtype):
+    size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return (size + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def allocate_observation(buffer=None, offset=0):
+    """ Create the observation arrays, optionally laid out one after another in buffer (e.g. shared memory) """
+    result = {}
+    for name, (shape, dtype) in OBSERVATION_SPEC.items():
+        if buffer is None:
+            result[name] = np.zeros(shape, dtype)
+        else:
+            result[name] = np.ndarray(shape, dtype, buffer=buffer, offset=offset)
+            offset += _aligned_size(shape, dtype)
+    return result
+
+
+def observation_size():
+    """ Number of bytes needed by allocate_observation """
+    return sum(_aligned_size(shape, dtype) for shape, dtype in OBSERVATION_SPEC.values())
+
+
+def write_screen_planes(screen, glyphs, styles, prev_hashes=None):
+    """ Write the screen into glyph and style planes, skipping rows whose hash is in prev_hashes (the row hashes
+        when the planes were last written). Returns the row hashes to pass next time.
+    """
+    for row, row_hash in enumerate(screen.row_hashes):
+        if prev_hashes is not None and prev_hashes[row] == row_hash:
+            continue
+        line = screen.cells[row]
+        glyphs[row] = [ord(cell.glyph) for cell in line]
+        styles[0, row] = [cell.fg_color for cell in line]
+        styles[1, row] = [cell.bg_color for cell in line]
+        styles[2, row] = [cell.bold for cell in line]
+    return list(screen.row_hashes)
+
+
+def stats_vector(game_state, out=None):
+    if out is None:
+        out = np.zeros(len(STATS_FIELDS), np.float32)
+    out[:] = [getattr(game_state, name) for name in STATS_FIELDS]
+    return out
+
+
+class ObservationWriter:
+    """ Writes game states and screens into observation arrays.
+        Only screen rows which changed, and maps which are new, are written.
+    """
+
+    def __init__(self, observation):
+        self.observation = observation
+        self.row_hashes = None
+        self.map = None
+
+    def reset(self):
+        self.row_hashes = None
+        self.map = None
+
+    def write(self, game_state, screen, step):
+        obs = self.observation
+        self.row_hashes = write_screen_planes(screen, obs['screen_glyphs'], obs['screen_styles'], self.row_hashes)
+        if game_state.map is not self.map:
+            # maps are shared by the parse cache, so the same map object means the same contents
+            self._write_map(game_state.map, obs['map_glyphs'], obs['map_colors'])
+            self.map = game_state.map
+        stats_vector(game_state, obs['stats'])
+        obs['step'][...] = step
+
+    @staticmethod
+    def _write_map(game_map, glyphs, colors):
+        if game_map is None:
+            glyphs[...] = 0
+            colors[...] = 0
+            return
+        for x, column in game_map.cells.items():
+            glyphs[:, x] = [ord(column[y].glyph) for y in range(MAP_ROWS)]
+            colors[0, :, x] = [column[y].fg_color.value for y in range(MAP_ROWS)]
+            colors[1, :, x] = [column[y].bg_color.value for y in range(MAP_ROWS)]
@@ -51,6 +51,8 @@ CR = chr(ORD_CR)      # carriage return = ^M
 ENTER = CR
 ESC = chr(ORD_ESC)    # escape = ^[
 DEL = chr(ORD_DEL)    # delete = ^?
+SO = chr(ORD_CTRL_N)  # shift out (switch to the G1 character set) = ^N
+SI = chr(ORD_CTRL_O)  # shift in (switch back to G0) = ^O
 
 CTRL_A = chr(ORD_CTRL_A)
 CTRL_B = chr(ORD_CTRL_B)
@@ -80,37 +82,26 @@ CTRL_Y = chr(ORD_CTRL_Y)
 CTRL_Z = chr(ORD_CTRL_Z)
 
 
+# printable representations of control characters
+PRINTABLE_CONTROL_CHARS = {'\t': '\\t', '\n': '\\n', '\r': '\\r', DEL: 'DEL'}
+
+
 def make_printable(string, max_line_len = None):
     """ Replace non-printable characters with codes """
-    result = ''
+    parts = []
     for ch in string:
-        if ch < ' ':
-            if ch == '\t':
-                result += '\\t'
-            elif ch == '\n':
-                result += '\\n'
-            elif ch == '\r':
-                result += '\\r'
-            else:
-                result += '^' + chr(ord(ch)+ord('@'))
-        elif ch < DEL:
-            result += ch
-        elif ch == DEL:
-            result += 'DEL'
+        if ' ' <= ch < DEL:
+            parts.append(ch)
+        elif ch in PRINTABLE_CONTROL_CHARS:
+            parts.append(PRINTABLE_CONTROL_CHARS[ch])
+        elif ch < ' ':
+            parts.append('^' + chr(ord(ch)+ord('@')))
         else:
-            o = ord(ch)
-            result += "\\x%0.2x" % o
+            parts.append("\\x%0.2x" % ord(ch))
+    result = ''.join(parts)
     
-    if max_line_len is not None and max_line_len > 0:
-        num_chars = len(result)
-        if num_chars > max_line_len:
-            num_lines = math.ceil(num_chars / max_line_len)
-            temp = result
-            result = ''
-            for i in range(num_lines):
-                if i > 0:
-                    result += '\n'
-                result += temp[i*max_line_len : (i+1)*max_line_len]
+    if max_line_len is not None and max_line_len > 0 and len(result) > max_line_len:
+        result = '\n'.join(result[i : i+max_line_len] for i in range(0, len(result), max_line_len))
 
     return result
 
@@ -5,20 +5,40 @@ from subprocess import Popen, PIPE
 from threading import Thread
 import threading 
 from queue import Queue, Empty
+from collections import deque
+import codecs
 import copy
+import cProfile
 import logging
 import os
 import re
 import time
 
 import gym_crawl.terminal_capture as tc
+import gym_crawl.terminal_backend as terminal_backend
+from gym_crawl.action_mask import ActionMasker
 from gym_crawl.chars import *
 from gym_crawl.gamestate import GameState
+import gym_crawl.history as history
+from gym_crawl.instance_dir import InstanceDir
+from gym_crawl.inventory import Inventory, MAX_INVENTORY_PAGES
+from gym_crawl.macros import Macro, MACROS
+import gym_crawl.startup as startup
+import gym_crawl.logging_queue as logging_queue
+from gym_crawl.messages import MessageLog, Tokenizer
+import gym_crawl.state_channel as state_channel
+from gym_crawl.supervisor import ProcessSupervisor
+import gym_crawl.term_profiles as term_profiles
+import gym_crawl.metrics as metrics
 import gym_crawl.terminal_parser as parser
+import gym_crawl.trace as trace
 
 
 LONG_RUNNING_ACTIONS = 'o5'
 
+# actions which can be repeated by default (movement and waiting)
+REPEATABLE_ACTIONS = ['h', 'j', 'k', 'l', 'y', 'u', 'b', 'n', 'H', 'J', 'K', 'L', 'Y', 'U', 'B', 'N', '.', 's']
+
 # Essential commands
 ACTION_KEYS="abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.,<>\t" + ESC + ENTER
 # Long-running actions
@@ -37,18 +57,21 @@ def enqueue_output_old(out, queue):
     out.close()
 
 def enqueue_output(out, queue):
+    # incremental, so multi-byte characters split across reads are decoded correctly
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
     try:
         while not out.closed:
             out.flush()
-            data = out.read1(1024*8).decode('utf-8', errors='replace')
-            queue.put(data)
+            data = decoder.decode(out.read1(1024*8))
+            if data:
+                queue.put(data)
     except:
         pass
     finally:
         logger.debug("enqueue_ouput exiting")
 
 class CrawlEnv(gym.Env):
-    metadata = {'render.modes': ['human']}
+    metadata = {'render.modes': ['human', 'rgb_array']}
     
     # dimensions of screen in characters (not pixels!)
     SCREEN_COLS = 80
@@ -59,11 +82,17 @@ class CrawlEnv(gym.Env):
         self.process = None
         self.queue = None
         self.render_file = None
+        self.rasterizer = None
         self.character_name = 'Bot'
+        self.species = 'Minotaur'
+        self.background = 'Berserker'
+        self.weapon = 'hand axe'
 
         self.crawl_path = os.getenv('CRAWLDIR')
         if self.crawl_path is None:
             raise RuntimeError('You must set the CRAWLDIR environment variable with the location of your DCSS installation.')
+        # absolute, because crawl may be run in an instance directory
+        self.crawl_path = os.path.abspath(self.crawl_path)
         self.crawl_bin_dir = self.crawl_path + '/bin'
         self.crawl_exe = self.crawl_bin_dir + '/crawl'
         if not os.path.exists(self.crawl_exe):
@@ -78,20 +107,74 @@ class CrawlEnv(gym.Env):
         self.steps = 0
         self.stuck_steps = 0
         self.error = False
+        self.error_reason = None
         self.last_sent = ''
         self.ready = False
         self.reward = 0
         self.score = 0
         self.game_state = GameState()
+        self.message_log = MessageLog()
+        self.state_channel = None
+        self.instance_dir = None
+        self.inventory = None
+        self.inventory_auto_refresh = True
+        self.history = None
+        self.history_space = None
+        self.masker = None
+        self.reject_invalid = False
+
+        # action repeat
+        self.action_repeat = 1
+        self.repeatable_actions = set(REPEATABLE_ACTIONS)
+        self.repeat_state = GameState()
+        self.skipped_data = ''
 
         self.player_row = None
         self.player_col = None
 
+        # loop/stall detection
+        self.loop_window = 20
+        self.loop_max_distinct = 3
+        self.loop_action = 'escape'
+        self.loop_escape_keys = ESC + ESC + ESC
+        self.loop_max_escapes = 3
+        self.screen_history = deque(maxlen=self.loop_window)
+        self.loop_escapes = 0
+
         # timing
         self.max_read_time = 0.0
         self.max_ready_time = 0.0
         self.read_timeout = 0.1
+        self.pipelined = False
         self.long_running_read_timeout = 5.0
+        self.streaming = False
+        self.stream_callback = None
+        self.stream_interrupt = None
+        self.stream_settle_time = 0.05
+        self.metrics = metrics.StepMetrics()
+        self.step_hook = None
+
+        # terminal crawl runs in, and the emulator its output is fed to
+        self.use_pty = False
+        self.term_profile = 'inherit'
+        self.terminal_backend = terminal_backend.DEFAULT_BACKEND
+
+        # process supervision
+        self.supervisor = None
+        self.hang_timeout = 30.0
+        self.cpu_affinity = None
+        self.nice = None
+        self.restarts = 0
+
+        # profiling
+        self.profile_interval = 0
+        self.profiler = None
+        self.profile_dir = '.'
+
+        # logging and tracing
+        self.queue_logging = True
+        self.tracer = trace.tracer
+        self.trace_dir = '.'
 
     def __del__(self):
         #self.close() # logging will throw an exception at this point
@@ -103,10 +186,24 @@ class CrawlEnv(gym.Env):
     def get_character_name(self):
         return self.character_name
 
+    def set_character(self, species='Minotaur', background='Berserker', weapon='hand axe'):
+        """ Choose the character. These are passed on crawl's command line, so no menus are needed.
+            weapon can be None for backgrounds which don't get a choice.
+        """
+        self.species = species
+        self.background = background
+        self.weapon = weapon
+
     def set_action_keys(self, keys):
-        """Override the default list of possible actions"""
+        """Override the default list of possible actions.
+           Each action is a string of keys, or a Macro (see add_macro)"""
         self.action_keys = keys
         self.action_space = spaces.Discrete(len(self.action_keys)) 
+        if self.masker is not None:
+            self.masker.set_action_keys(keys)
+            # the mask has to match the new list, or the next step could index past its end
+            if self.game_state.action_mask is not None:
+                self._update_action_mask('')
 
     def get_action_keys(self):
         """Get the current list of possible actions"""
@@ -115,85 +212,497 @@ class CrawlEnv(gym.Env):
     def action_to_keys(self, action):
         """ Translate an action space index (int) into actual key(s)"""
         keys = self.action_keys[action]
+        if isinstance(keys, Macro):
+            return keys.keys
         return keys
 
+    def add_macro(self, macro):
+        """ Add a macro action (a Macro, or the name of one in macros.MACROS). Returns its action index.
+            Its keys are sent in one write, and the step waits for the screen the macro expects.
+        """
+        if not isinstance(macro, Macro):
+            macro = MACROS[macro]
+        self.set_action_keys(list(self.action_keys) + [macro])
+        return len(self.action_keys) - 1
+
+    def set_action_repeat(self, repeat, actions=None):
+        """ Send repeatable actions (default: REPEATABLE_ACTIONS) repeat times per step, and return the summed reward.
+            Only the last frame is fully processed. Repeating stops early if crawl isn't back on the main screen,
+            the player dies or loses health.
+        """
+        self.action_repeat = max(1, repeat)
+        if actions is not None:
+            self.repeatable_actions = set(actions)
+
+    def set_loop_detection(self, window=20, max_distinct=3, action='escape', escape_keys=ESC+ESC+ESC, max_escapes=3):
+        """ Configure detection of steps which are going nowhere.
+            If game time hasn't changed for window steps, and there were no more than max_distinct
+            different screens in that time, the agent is stuck in a loop (or a stall, if only one screen).
+            action is 'end' to end the episode, or 'escape' to send escape_keys. After max_escapes
+            escapes without game time changing, the episode is ended anyway. A window of 0 disables detection.
+        """
+        if action not in ('end', 'escape'):
+            raise ValueError('Unknown loop action: ' + action)
+        self.loop_window = window
+        self.loop_max_distinct = max_distinct
+        self.loop_action = action
+        self.loop_escape_keys = escape_keys
+        self.loop_max_escapes = max_escapes
+        self.screen_history = deque(maxlen=max(window, 1))
+
+    def set_instance_dir(self, enabled, root=None, keep_morgue=10, morgue_quota=None):
+        """ If enabled, crawl runs in a private directory under root (default: /dev/shm, so saves and morgue files
+            stay in RAM), instead of the current directory. Each episode's save is removed on reset, and at most
+            keep_morgue morgue files, taking at most morgue_quota bytes, are kept.
+        """
+        if self.instance_dir is not None:
+            self.instance_dir.remove()
+        self.instance_dir = InstanceDir('./crawlrc', root, keep_morgue, morgue_quota) if enabled else None
+
+    def get_work_dir(self):
+        """ Directory crawl runs in """
+        return self.instance_dir.path if self.instance_dir is not None else '.'
+
+    def set_state_channel(self, enabled):
+        """ If enabled, a Lua hook in crawl writes the game state to a file each turn, which is used
+            instead of parsing the stats panel. Parsing is still used when there's no new record.
+            Takes effect on the next reset.
+        """
+        self.state_channel = state_channel.StateChannel('.') if enabled else None
+
+    def set_inventory_tracking(self, enabled, auto_refresh=True):
+        """ If enabled, the inventory is kept in game_state.inventory. It is read from the inventory screen
+            and then updated from messages. When a message makes the cache invalid, it is read again
+            at the end of the step if auto_refresh is set, otherwise when refresh_inventory is called.
+        """
+        self.inventory = Inventory() if enabled else None
+        self.inventory_auto_refresh = auto_refresh
+
+    def get_inventory(self):
+        """ Get the cached inventory as a dict of letter -> InventoryItem """
+        return self.game_state.inventory
+
+    def refresh_inventory(self):
+        """ Read the inventory screen, paging through it if it has more than one page (costs a read timeout
+            per page, because the end of the menu can't be detected)
+        """
+        if self.inventory is None or self.error:
+            return
+        self.metrics.count('inventory_refreshes')
+        reward = self.reward
+        messages = self.game_state.messages
+        self._send_chars('i')
+        self._read_frame()
+        if not self.error:
+            self.inventory.update_from_screen(self.terminal.screen)
+            for _ in range(MAX_INVENTORY_PAGES - 1):
+                if self.inventory.complete:
+                    break
+                self._send_chars('>')
+                self._read_frame()
+                if self.error or not self.inventory.add_page(self.terminal.screen):
+                    break
+            if not self.inventory.complete:
+                logger.warning('Inventory has more pages than were read')
+            self._send_chars(ESC)
+            self._read_frame()
+        self.reward += reward
+        self.game_state.messages = messages + self.game_state.messages
+        self.game_state.inventory = self.inventory.items
+
+    def set_action_masking(self, enabled, reject_invalid=False):
+        """ Work out which actions can do something each step (see action_mask.py). The mask is a bool array
+            in game_state.action_mask. If reject_invalid, masked actions are not sent to crawl: the step
+            returns the same state with no reward.
+            Item commands are only masked if inventory tracking is on.
+        """
+        self.masker = ActionMasker(self.action_keys) if enabled else None
+        self.reject_invalid = reject_invalid
+
+    def get_action_mask(self):
+        return self.game_state.action_mask
+
+    def _update_action_mask(self, keys):
+        items = self.inventory.items \
+            if self.inventory is not None and self.inventory.valid and self.inventory.complete else None
+        self.game_state.action_mask = self.masker.update(self.game_state, keys, items)
+
+    def set_history(self, depth):
+        """ Keep the last depth frames (map glyph classes, map colours and stats) as arrays, see get_history.
+            depth can also be a space made by history.history_space. 0 turns the history off.
+            The observations returned by reset and step are unchanged. history_space describes get_history's result.
+        """
+        if isinstance(depth, spaces.Dict):
+            depth = history.space_depth(depth)
+        if depth:
+            self.history = history.HistoryBuffer(depth)
+            self.history_space = history.history_space(depth)
+        else:
+            self.history = None
+            self.history_space = None
+
+    def get_history(self, k=None):
+        """ Get views of the last k (default: all) frames, oldest first. They are overwritten by the next step """
+        return self.history.frames(k)
+
+    def set_message_log(self, capacity=1000, tokenize=False):
+        """ Set the number of messages kept, and whether they are also converted to token IDs """
+        self.message_log = MessageLog(capacity, Tokenizer() if tokenize else None)
+
+    def get_messages(self, num=None):
+        """ Get the most recent messages as (step, game time, text), oldest first """
+        return self.message_log.get(num)
+
+    def get_message_tokens(self, num=None):
+        """ Get token IDs of the most recent messages (see set_message_log) """
+        return self.message_log.get_tokens(num)
+
+    def get_metrics(self):
+        """ Get timing histograms (per phase of a step), counters and parse cache hits/misses """
+        result = self.metrics.to_dict()
+        result['parse_cache'] = parser.get_cache_stats()
+        return result
+
+    def reset_metrics(self):
+        self.metrics.reset()
+
+    def set_step_hook(self, hook):
+        """ Set a function to be called at the end of every step, as hook(env, timings)
+            where timings is a dict of phase name to seconds spent in that phase
+        """
+        self.step_hook = hook
+
+    def set_pipelined(self, enabled):
+        """ If enabled, output is fed to the terminal capture as each chunk arrives, while crawl is
+            still drawing, instead of all at once when the frame is complete
+        """
+        self.pipelined = enabled
+
+    def set_terminal(self, use_pty=False, profile='inherit'):
+        """ Run crawl under a pseudo-terminal of the screen size instead of pipes, and/or with a terminal
+            profile from term_profiles.TERM_PROFILES ('inherit' keeps this process's TERM).
+            The profile decides which escape sequences crawl sends, and so the bytes and parse time per step.
+        """
+        if profile not in term_profiles.TERM_PROFILES:
+            raise ValueError('Unknown terminal profile: ' + profile)
+        self.use_pty = use_pty
+        self.term_profile = profile
+
+    def set_streaming(self, enabled, callback=None, interrupt=None, settle_time=0.05):
+        """ Follow long-running actions (explore, rest, travel macros) frame by frame instead of waiting blind.
+            Each intermediate frame with the cursor back on the @ is parsed and passed to callback(env, game_state,
+            elapsed). If interrupt(game_state) returns True (see interrupts.py), ESC is sent to stop the action.
+            The game state passed to callback and interrupt is one object updated for each frame, so copy it to keep it.
+            The action is complete when crawl has been quiet for settle_time seconds after such a frame and game time
+            has stopped advancing: after a frame which moved game time on, it has to be quiet for twice as long.
+        """
+        self.streaming = enabled
+        self.stream_callback = callback
+        self.stream_interrupt = interrupt
+        self.stream_settle_time = settle_time
+
+    def set_terminal_backend(self, name):
+        """ Choose the terminal emulator crawl's output is fed to (see terminal_backend.py), from next reset """
+        if name not in terminal_backend.BACKENDS and name != terminal_backend.DEFAULT_BACKEND:
+            raise ValueError('Unknown terminal backend: ' + name)
+        self.terminal_backend = name
+
+    def set_supervision(self, hang_timeout=30.0, cpu_affinity=None, nice=None):
+        """ Configure supervision of the crawl process: if it gets no output for hang_timeout seconds after
+            sending keys, a redraw is requested (Ctrl-R), and if that gets no output for hang_timeout seconds
+            either, crawl is killed and the episode ends with error_reason set. cpu_affinity (a set of
+            CPU numbers) and nice are applied to crawl when it starts.
+        """
+        self.hang_timeout = hang_timeout
+        self.cpu_affinity = cpu_affinity
+        self.nice = nice
+
+    def get_process_stats(self):
+        """ Get CPU and memory usage of the crawl process, and restarts after errors """
+        result = self.supervisor.sample() if self.supervisor is not None else {}
+        result['restarts'] = self.restarts
+        result['error_reason'] = self.error_reason
+        return result
+
+    def get_stderr(self):
+        """ Get the last lines crawl wrote to stderr """
+        return self.supervisor.get_stderr() if self.supervisor is not None else []
+
+    def set_profiling(self, interval, profiler='cprofile', output_dir='.'):
+        """ Profile one in every interval steps (0 to disable), using cprofile or pyinstrument.
+            Output is written to a file per profiled step in output_dir.
+        """
+        if interval and profiler == 'pyinstrument':
+            try:
+                import pyinstrument
+            except ImportError:
+                raise RuntimeError('pyinstrument is not installed. Try: pip3 install pyinstrument')
+        elif interval and profiler != 'cprofile':
+            raise ValueError('Unknown profiler: ' + profiler)
+        self.profile_interval = interval
+        self.profiler = profiler
+        self.profile_dir = output_dir
+
+    def set_queue_logging(self, enabled):
+        """ If enabled (the default), log handlers are moved onto a background thread on reset """
+        self.queue_logging = enabled
+        if not enabled:
+            logging_queue.stop_queue_logging()
+
+    def set_tracing(self, enabled, capacity=None, output_dir='.'):
+        """ Turn structured tracing of terminal/IO events on or off.
+            When on, the trace is dumped to output_dir if an error occurs.
+        """
+        if enabled:
+            self.tracer.enable(capacity)
+        else:
+            self.tracer.disable()
+        self.trace_dir = output_dir
+
+    def dump_trace(self, filename=None):
+        """ Write the trace buffer to a file and return the filename """
+        if filename is None:
+            filename = os.path.join(self.trace_dir, 'trace-{}-{}.txt'.format(self.episode, self.steps))
+        return self.tracer.dump(filename)
+
+    def _on_error(self, reason):
+        """ End the episode because of a problem with crawl. The next reset starts a new crawl process """
+        self.error = True
+        if self.error_reason is None:
+            self.error_reason = reason
+            logger.error('Step {}: Error: {}'.format(self.steps, reason))
+            self.metrics.count('errors')
+        if self.supervisor is not None:
+            stderr = self.supervisor.get_stderr()
+            if stderr:
+                logger.error('crawl stderr:\n' + '\n'.join(stderr))
+            self.supervisor.kill()
+        if self.tracer.enabled:
+            filename = self.dump_trace()
+            logger.error('Trace written to ' + filename)
+
     def reset(self):
         logger.info('reset')
         self.close()
 
+        if self.queue_logging:
+            logging_queue.start_queue_logging()
+
         self.episode += 1
 
-        self.terminal = tc.TerminalCapture()
+        self.terminal = terminal_backend.create_backend(self.terminal_backend, self.SCREEN_ROWS, self.SCREEN_COLS)
         self.frame_count = 0
         self.steps = 0
         self.stuck_steps = 0
+        self.screen_history.clear()
+        self.loop_escapes = 0
+        if self.error:
+            self.restarts += 1
+            self.metrics.count('restarts')
         self.error = False
-        self.on_main_screen = False
+        self.error_reason = None
         self.game_state = GameState()
+        self.message_log.clear()
+        self.skipped_data = ''
         self.score = 0
 
         self.max_read_time = 0.0
         self.max_ready_time = 0.0
         self.ready = False
+        reset_start_time = time.perf_counter()
 
-        crawl_saves_dir = './saves'
-        crawl_save_file = crawl_saves_dir + '/' + self.character_name + '.cs'
-
-        if os.path.exists(crawl_save_file):
-            os.remove(crawl_save_file)
-
-        cmd = [self.crawl_exe, '-dir', '.', '-rc', './crawlrc', '-name', self.character_name, '-species', 'Minotaur', '-background', 'Berserker']
-        self.process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True, universal_newlines=True)
-
-        # detach process stdout from buffer
-        self.process.stdout = self.process.stdout.detach()
+        # crawl runs in work_dir, so paths in the command line are relative to it
+        work_dir = self.get_work_dir()
+        if self.instance_dir is not None:
+            self.instance_dir.clean_episode(self.character_name)
+        else:
+            crawl_saves_dir = './saves'
+            crawl_save_file = crawl_saves_dir + '/' + self.character_name + '.cs'
+
+            if os.path.exists(crawl_save_file):
+                os.remove(crawl_save_file)
+
+        rc_file = './crawlrc'
+        if self.state_channel is not None:
+            self.state_channel = state_channel.StateChannel(work_dir)
+            self.state_channel.clear()
+            rc_file = './crawlrc-gym'
+            state_channel.write_hook_rc(os.path.join(work_dir, 'crawlrc'), os.path.join(work_dir, rc_file))
+
+        cmd = [self.crawl_exe, '-dir', '.', '-rc', rc_file, '-name', self.character_name]
+        cmd += startup.startup_args(self.species, self.background, self.weapon)
+        popen_env = None
+        if self.use_pty or self.term_profile != 'inherit':
+            popen_env = term_profiles.profile_environment(self.term_profile, self.SCREEN_ROWS, self.SCREEN_COLS)
+        if self.use_pty:
+            master, slave = term_profiles.open_pty(self.SCREEN_ROWS, self.SCREEN_COLS)
+            try:
+                self.process = Popen(cmd, stdin=slave, stdout=slave, stderr=PIPE, close_fds=True, universal_newlines=True,
+                                     cwd=work_dir, env=popen_env, start_new_session=True)
+            finally:
+                os.close(slave)
+            self.process.stdin = open(os.dup(master), 'w', encoding='utf-8', newline='')
+            self.process.stdout = open(master, 'rb')
+        else:
+            self.process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE, close_fds=True, universal_newlines=True,
+                                 cwd=work_dir, env=popen_env)
+            # detach process stdout from buffer
+            self.process.stdout = self.process.stdout.detach()
+        # crawl always answers a redraw request, so it's used to probe for hangs
+        self.supervisor = ProcessSupervisor(self.process, self.hang_timeout, probe=lambda: self._send_chars(CTRL_R))
+        if self.cpu_affinity is not None:
+            self.supervisor.set_affinity(self.cpu_affinity)
+        if self.nice is not None:
+            self.supervisor.set_nice(self.nice)
 
         self.queue = Queue()
         thread = Thread(target=enqueue_output, args=(self.process.stdout, self.queue))
         thread.daemon = True # thread dies with the program
         thread.start()
         
-        weapon_chosen = False
-        game_started = False
+        # normally the game screen is the first frame, but answer any menus which show up
+        machine = startup.StartupMachine(self.species, self.background, self.weapon)
         loop_count = 0
-        while not game_started:
+        while not machine.is_started() and not self.error:
             loop_count += 1
-            if loop_count >= 30:
+            if loop_count >= 30 or machine.error is not None:
                 logger.error("Failed to start episode. Screen dump:" + self.terminal.screen.to_string())
-                self.error = True
+                self._on_error(machine.error or 'failed to start episode')
                 break
-            self._read_frame();
-            screen_contents = self.terminal.screen.to_string()
-            if 'Found a staircase leading out of the dungeon' in screen_contents:
-                game_started = True
-            elif not weapon_chosen and 'You have a choice of weapons' in screen_contents:  
-                self._send_chars('c') # choose axe
-                weapon_chosen = True
+            self._read_frame()
+            keys = machine.update(self.terminal.screen)
+            if keys:
+                self._send_chars(keys)
+        for state, seconds in machine.timings:
+            self.metrics.add_sample('startup_' + state, seconds)
+        self.metrics.count('startup_frames', loop_count)
+
+        if self.inventory is not None:
+            self.inventory = Inventory()
+            self.refresh_inventory()
+
+        if self.masker is not None:
+            self.masker.reset()
+            self._update_action_mask('')
+
+        if self.history is not None:
+            self.history.reset()
+            self.history.push(self.game_state)
+
+        # phases of the startup frames are not step timings
+        self.metrics.start_step()
+        self.metrics.add_sample('reset', time.perf_counter() - reset_start_time)
 
         done = (self.game_state.is_finished() or self.error)
         return self.game_state, self.reward, done, self.terminal.screen
 
     def step(self, action):
         self.steps += 1
-        logger.debug("Step {} start: self.ready={}, screen:\n".format(self.steps, self.ready) + self.terminal.screen.to_string())
+        self.metrics.start_step()
+        step_start_time = time.perf_counter()
+
+        if self.profile_interval and self.steps % self.profile_interval == 0:
+            result = self._profiled_step(action)
+        else:
+            result = self._step(action)
+
+        self.metrics.lap(metrics.PHASE_STEP, step_start_time)
+        timings = self.metrics.end_step()
+        self.metrics.count('steps')
+        if self.step_hook is not None:
+            self.step_hook(self, timings)
+        return result
+
+    def _profiled_step(self, action):
+        filename = os.path.join(self.profile_dir, 'profile-{}-{}'.format(self.episode, self.steps))
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                return self._step(action)
+            finally:
+                # also keep the profile of a step which failed
+                profiler.stop()
+                with open(filename + '.txt', 'w') as f:
+                    f.write(profiler.output_text())
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return self._step(action)
+            finally:
+                profiler.disable()
+                profiler.dump_stats(filename + '.prof')
+
+    def _step(self, action):
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Step {} start: self.ready={}, screen:\n".format(self.steps, self.ready) + self.terminal.screen.to_string())
 
         prev_time = self.game_state.time
 
+        # a rejected action isn't sent, but still counts as a step which made no progress
+        mask = self.game_state.action_mask
+        rejected = self.reject_invalid and mask is not None and not mask[action] and not self.error
+        if rejected:
+            self.metrics.count('rejected_actions')
+            self.reward = 0
+            # the same state, but a new object without the last step's messages
+            self.game_state = copy.deepcopy(self.game_state)
+
         # perform action
+        macro = self.action_keys[action]
+        if isinstance(macro, Macro):
+            self.metrics.count('macros')
+        else:
+            macro = None
         keys = self.action_to_keys(action)
-        self._send_chars(keys)
+        repeats = 1
+        if self.action_repeat > 1 and macro is None and keys in self.repeatable_actions:
+            repeats = self.action_repeat
+
+        # all but the last repeat only capture the screen and check it's OK to carry on
+        stopped = False
+        for _ in range(0 if rejected else repeats - 1):
+            send_start_time = time.perf_counter()
+            self._send_chars(keys)
+            self.metrics.lap(metrics.PHASE_SEND, send_start_time)
+            if self.error:
+                break
+            self.metrics.count('repeats')
+            self._read_frame(macro, capture_only=True)
+            if not self._can_repeat():
+                stopped = True
+                break
 
-        if not self.error:
-            self._read_frame();
+        if rejected:
+            keys = ''
+        elif stopped:
+            self._process_data('', True)
+        elif not self.error:
+            send_start_time = time.perf_counter()
+            self._send_chars(keys)
+            self.metrics.lap(metrics.PHASE_SEND, send_start_time)
+            if not self.error:
+                self._read_frame(macro)
 
         if self.game_state.time == prev_time:
             self.stuck_steps += 1
         else:
             self.stuck_steps = 0
+            self.loop_escapes = 0
+
+        done = self.error or self.game_state.is_finished()
+        if not done and self.loop_window and self._is_looping():
+            done = self._handle_loop()
+
+        if not done and self.inventory is not None and self.inventory_auto_refresh and not self.inventory.valid \
+                and self.ready and self.game_state.on_main_screen:
+            self.refresh_inventory()
+            done = self.error or self.game_state.is_finished()
 
         self.score += self.reward
 
-        done = self.error or self.game_state.is_finished()
         if not done and self.stuck_steps >= 1000:
             logger.info('Stuck for 1000 steps. Giving up. Screen dump:\n' + self.terminal.screen.to_string())
             done = True
@@ -201,14 +710,54 @@ class CrawlEnv(gym.Env):
         if self.steps % 100 == 0:
             logger.info('Step {}: Game Time={}'.format(self.steps, self.game_state.time))
 
+        if self.masker is not None:
+            self._update_action_mask(keys)
+
+        if self.history is not None:
+            self.history.push(self.game_state)
+
         return self.game_state, self.reward, done, self.terminal.screen
 
+    def _can_repeat(self):
+        """ Check the screen captured after a repeated action """
+        if self.error or not self.ready or 'You die' in self.skipped_data:
+            return False
+        state = self.repeat_state
+        parser.update_stats(self.terminal.screen, state)
+        return state.on_main_screen and state.hp >= self.game_state.hp
+
+    def _is_looping(self):
+        """ Check recent screens and game times for a loop or stall """
+        history = self.screen_history
+        history.append((self.terminal.screen.hash(), self.game_state.time))
+        if len(history) < self.loop_window:
+            return False
+        first_time = history[0][1]
+        for _, game_time in history:
+            if game_time != first_time:
+                return False
+        return len(set(screen_hash for screen_hash, _ in history)) <= self.loop_max_distinct
+
+    def _handle_loop(self):
+        """ Try to get out of a loop. Returns True if the episode should end """
+        self.metrics.count('loops')
+        self.screen_history.clear()
+        if self.loop_action == 'end' or self.loop_escapes >= self.loop_max_escapes:
+            logger.info('Step {}: Stuck in a loop. Giving up. Screen dump:\n'.format(self.steps) + self.terminal.screen.to_string())
+            return True
+        logger.info('Step {}: Stuck in a loop. Sending escape'.format(self.steps))
+        self.loop_escapes += 1
+        reward = self.reward
+        self._send_chars(self.loop_escape_keys)
+        if not self.error:
+            self._read_frame()
+        self.reward += reward
+        return self.error or self.game_state.is_finished()
+
     def _render_to_file(self, mode='human'):
         if self.render_file is None:
             self.render_file = open("render.txt", "w")
-        for line in self.terminal.screen.cells:
-            self.render_file.write(line)
-            self.render_file.write('\n')
+        self.render_file.write(self.terminal.screen.to_string())
         self.render_file.write('\n------------ END FRAME ({} lines) -----------\n'.format(self.terminal.screen.rows))
 
     def _render_to_screen(self, mode='human'):
@@ -217,7 +766,15 @@ class CrawlEnv(gym.Env):
             action = tc.make_printable(self.last_sent)
             print('Episode: {}  Step: {:<6d}  Action: {:<5}  Reward: {:<7d}  Cumulative score: {:<10d}'.format(self.episode, self.steps, action, self.reward, self.score))
 
+    def _render_to_rgb_array(self):
+        if self.rasterizer is None:
+            from gym_crawl.rasterizer import Rasterizer
+            self.rasterizer = Rasterizer()
+        return self.rasterizer.render_screen(self.terminal.screen)
+
     def render(self, mode='human'):
+        if mode == 'rgb_array':
+            return self._render_to_rgb_array()
         self._render_to_screen(mode)
 
     def close(self):
@@ -230,6 +787,11 @@ class CrawlEnv(gym.Env):
                 self.process.kill() # die horribly
         if self.process is not None:
             self.process.stdout.close() # cause reading thread to end
+            if self.use_pty:
+                try:
+                    self.process.stdin.close()
+                except OSError:
+                    pass
         if self.render_file is not None:
             self.render_file.close()
         logger.debug("Thread count: {}".format(threading.active_count()))
@@ -237,15 +799,20 @@ class CrawlEnv(gym.Env):
     def _send_chars(self, chars):
         """ Send characters to the crawl process
         """
-        logger.debug('Sending: ' + tc.make_printable(chars))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Sending: ' + tc.make_printable(chars))
+        if self.tracer.enabled:
+            self.tracer.event(trace.EVENT_SEND, len(chars), ord(chars[0]) if chars else 0)
         self.last_sent = chars
+        if self.supervisor is not None:
+            self.supervisor.note_input()
         try:
             self.process.stdin.write(chars)
             self.process.stdin.flush()
         except Exception as e:
             logger.error(str(e))
             logger.error("I think I overran crawl's input buffer. This is where I was:\n" + self.terminal.screen.to_string())
-            self.error = True
+            self._on_error('failed to send keys: ' + str(e))
 
     def _read_data_chunk(self, read_timeout):
         try:
@@ -258,11 +825,15 @@ class CrawlEnv(gym.Env):
             return data_chunk
     
 
-    def _is_ready(self, data):
+    def _is_ready(self, data, macro=None):
 
         # remove newlines because they mess with regular expression matching
         data = data.replace('\n', '')
 
+        # a macro knows which screen it ends on
+        if macro is not None and not macro.is_main_screen():
+            return macro.matches(data)
+
         # when drawing main screen, cursor is left at @ position
         if self.player_row is None or self.player_col is None:
             self._find_player_symbol()
@@ -271,30 +842,9 @@ class CrawlEnv(gym.Env):
                 return True
 
         # check for known end of screen strings
-        
-        # abilities screen
-        if "to toggle between ability selection and description." in data:
-            return True
-
-        # religion screen
-        if "Powers|Wrath" in data:
-            return True
-
-        # skills screen
-        if "costs|targets" in data:
-            return True
-
-        # spells (M) screen
-        if "Describe|Hide|Show" in data:
-            return True
-
-        # cast spell (z/Z) screen
-        if "to toggle spell view." in data:
-            return True
-
-        # character description screen
-        if re.search(r'HPRegen .*MPRegen .*@: .*A: ', data):
-            return True
+        for pattern in parser.SCREEN_END_SIGNATURES.values():
+            if pattern.search(data):
+                return True
 
         # monster description screen when monster has spell
         if "shown in red if you are in range." in data:
@@ -303,7 +853,7 @@ class CrawlEnv(gym.Env):
         return False
 
 
-    def _read_frame(self):
+    def _read_frame(self, macro=None, capture_only=False):
         self.reward = 0
         data = ''
         got_data = False
@@ -311,14 +861,29 @@ class CrawlEnv(gym.Env):
         ready = False
         prev_ready = self.ready
         loop_count = 0
-        chars = tc.make_printable(self.last_sent)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        tracer = self.tracer
+        pipelined = self.pipelined
 
         long_running_action = False
         read_timeout = self.read_timeout
-        if self.on_main_screen and prev_ready and self.last_sent in LONG_RUNNING_ACTIONS:
+        if macro is not None and macro.timeout is not None:
+            long_running_action = True
+            read_timeout = macro.timeout
+        elif self.game_state.on_main_screen and prev_ready and self.last_sent in LONG_RUNNING_ACTIONS:
             long_running_action = True
             read_timeout = self.long_running_read_timeout
-            logger.debug("Step {}: Starting long running operation: {}".format(self.steps, chars))
+            if debug:
+                logger.debug("Step {}: Starting long running operation: {}".format(self.steps, tc.make_printable(self.last_sent)))
+
+        # streamed frames are parsed as they arrive, so the screen has to be kept up to date
+        streaming = long_running_action and self.streaming and not capture_only
+        if streaming:
+            pipelined = True
+            stream_state = copy.deepcopy(self.game_state)
+        settle_start = None # when the cursor was last seen back on the @
+        settle_time = self.stream_settle_time
+        interrupted = False
 
         read_time = 0.0
         ready_time = None
@@ -328,33 +893,86 @@ class CrawlEnv(gym.Env):
             data_chunk = self._read_data_chunk(0.01)
             elapsed_time = (time.perf_counter() - start_time)
             if data_chunk is None:
-                if elapsed_time >= read_timeout:
+                if settle_start is not None and time.perf_counter() - settle_start >= settle_time:
+                    # quiet since crawl finished drawing with game time stopped, so the action has finished
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_READY)
+                    ready_time = read_time
+                    ready = True
+                    done = True
+                elif elapsed_time >= read_timeout:
+                    if not got_data and not self.game_state.is_finished():
+                        reason = self.supervisor.check()
+                        if reason is not None:
+                            self._on_error(reason)
+                        elif self.supervisor.probe_sent:
+                            # wait for the answer to the probe, so it isn't taken as the next step's output
+                            continue
                     if long_running_action:
-                        logger.warn("Step {}: Timeout on action '{}': {:.3f} seconds. Screen dump:\n".format(self.steps, chars, elapsed_time) + self.terminal.screen.to_string())
+                        logger.warn("Step {}: Timeout on action '{}': {:.3f} seconds. Screen dump:\n".format(
+                            self.steps, tc.make_printable(self.last_sent), elapsed_time) + self.terminal.screen.to_string())
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_TIMEOUT)
                     done = True
             else:
                 read_time = (time.perf_counter() - start_time)
-                logger.debug('Got {} bytes of data'.format(len(data_chunk)))
+                self.supervisor.note_output(start_time + read_time)
+                if not got_data:
+                    self.metrics.add(metrics.PHASE_FIRST_BYTE, read_time)
+                if debug:
+                    logger.debug('Got {} bytes of data'.format(len(data_chunk)))
+                if tracer.enabled:
+                    tracer.event(trace.EVENT_CHUNK, len(data_chunk))
                 data += data_chunk
                 got_data = True
+                settle_start = None
+                if pipelined:
+                    capture_start_time = time.perf_counter()
+                    self.terminal.feed(data_chunk)
+                    self.metrics.lap(metrics.PHASE_CAPTURE, capture_start_time)
                 # handle prompts, so we don't get stuck
                 if  '--more--' in data_chunk:
                     logger.info('Detected --more-- prompt')
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_MORE)
                     self._send_chars(' ')
                 elif "Inscribe with what?" in data_chunk or "Replace inscription with what?" in data_chunk:
                     # Nip this in the bud because it can crash crawl if too many characters are sent
                     logger.debug('Detected inscriptions prompt')
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_INSCRIBE)
                     self._send_chars(ESC)
                 elif "Drop what? 0/52 slots" in data_chunk:
                     # This can also crash crawl if too many characters are sent
                     logger.debug('Detected drop prompt for empty inventory')
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_DROP_EMPTY)
                     self._send_chars(ESC)
-                elif self._is_ready(data):
+                elif streaming and self._is_ready(data, macro):
+                    settle_start = time.perf_counter()
+                    prev_game_time = stream_state.time
+                    self._stream_progress(stream_state, settle_start - start_time)
+                    # while game time is still moving on, give crawl longer to draw the next frame
+                    settle_time = self.stream_settle_time if stream_state.time == prev_game_time else 2 * self.stream_settle_time
+                    if not interrupted and self.stream_interrupt is not None and self.stream_interrupt(stream_state):
+                        logger.debug('Step {}: Interrupting {}'.format(self.steps, tc.make_printable(self.last_sent)))
+                        interrupted = True
+                        self.metrics.count('interrupts')
+                        self._send_chars(ESC)
+                elif self._is_ready(data, macro):
+                    if tracer.enabled:
+                        tracer.event(trace.EVENT_TRIGGER, trace.TRIGGER_READY)
                     ready_time = read_time
                     ready = True
                     done = True
+        self.metrics.lap(metrics.PHASE_READ, start_time)
+        if ready_time is not None:
+            self.metrics.add(metrics.PHASE_READY, ready_time)
+        else:
+            self.metrics.count('timeouts')
         if got_data:
-            logger.debug('read_loop_count={}'.format(loop_count))
+            if debug:
+                logger.debug('read_loop_count={}'.format(loop_count))
             if self.steps >= 1 and not long_running_action:
                 if read_time > self.max_read_time:
                     self.max_read_time = read_time
@@ -366,21 +984,80 @@ class CrawlEnv(gym.Env):
                     logger.info("Step {}: Max known ready time: {:.3f} seconds, action={}".format(self.steps, self.max_ready_time, action))
 
             self.frame_count += 1
-            self._process_data(data)
+            self.metrics.count('frames')
+            self.metrics.count('chars', len(data))
+            if capture_only:
+                self._capture_data(data, pipelined)
+            else:
+                self._process_data(data, pipelined)
 
         self.ready = ready
 
-    def _process_data(self, data):
+    def _stream_progress(self, state, elapsed):
+        """ Parse an intermediate frame of a long-running action and report it """
+        self.metrics.count('stream_frames')
+        parser.update_stats(self.terminal.screen, state)
+        snapshot = self.terminal.screen.snapshot()
+        state.screen = snapshot
+        parser.update_map(snapshot, state)
+        if self.stream_callback is not None:
+            self.stream_callback(self, state, elapsed)
+
+    def _capture_data(self, data, captured=False):
+        """ Update the screen, leaving the rest of the processing until the next full frame """
+        if not captured:
+            start_time = time.perf_counter()
+            self.terminal.feed(data)
+            self.metrics.lap(metrics.PHASE_CAPTURE, start_time)
+        self.skipped_data += data
+
+    def _process_data(self, data, captured=False):
+        """ Update the game state from a frame of output. captured is True if the terminal has already handled it """
+        step_metrics = self.metrics
+        start_time = time.perf_counter()
+
         # save old game state
         prev_state = self.game_state
         self.game_state = copy.deepcopy(prev_state)
+        start_time = step_metrics.lap(metrics.PHASE_DEEPCOPY, start_time)
         
         # capture screen update
-        self.terminal.handle_output(data)
+        if not captured:
+            self.terminal.feed(data)
+            start_time = step_metrics.lap(metrics.PHASE_CAPTURE, start_time)
 
         # get new state
-        parser.update_game_state(self.terminal.screen, self.game_state)
-        
+        record = self.state_channel.read() if self.state_channel is not None else None
+        if record is not None:
+            # crawl only writes a record when it's waiting for a command on the main screen
+            self.game_state.on_main_screen = True
+            state_channel.apply_state_record(record, self.game_state)
+        else:
+            parser.update_stats(self.terminal.screen, self.game_state)
+        start_time = step_metrics.lap(metrics.PHASE_STATS, start_time)
+        # the map is only extracted if something uses it
+        snapshot = self.terminal.screen.snapshot()
+        self.game_state.screen = snapshot
+        parser.update_map(snapshot, self.game_state)
+        start_time = step_metrics.lap(metrics.PHASE_MAP, start_time)
+        scroll_events = self.terminal.take_scroll_events()
+        if self.game_state.on_main_screen:
+            self.game_state.messages = self.message_log.update(self.terminal.screen, scroll_events, self.steps, self.game_state.time)
+        if self.inventory is not None:
+            self.inventory.update_from_messages(self.game_state.messages)
+            if record is not None and 'inv' in record:
+                self.inventory.check_letters(record['inv'])
+            self.game_state.inventory = self.inventory.items
+        start_time = step_metrics.lap(metrics.PHASE_MESSAGES, start_time)
+
+        # messages in frames which were only captured still count
+        if self.skipped_data:
+            data = self.skipped_data + data
+            self.skipped_data = ''
+        self._update_reward(prev_state, data)
+        step_metrics.lap(metrics.PHASE_REWARD, start_time)
+
+    def _update_reward(self, prev_state, data):
         if not prev_state.started:
             if self.game_state.started:
                 # reward navigation through start menu to actual game
@@ -392,7 +1069,7 @@ class CrawlEnv(gym.Env):
             return
         
         # check for game end
-        if 'You have escaped' in data:
+        if self._saw_message('You have escaped', data):
             if self.game_state.has_orb:
                 self.game_state.won = True
                 logger.debug('Reward for winning: +1e6')
@@ -401,7 +1078,7 @@ class CrawlEnv(gym.Env):
                 self.game_state.escaped = True
                 logger.debug('Reward for leaving without orb: -1e6')
                 self.reward = -1000000
-        elif 'You die' in data:
+        elif self._saw_message('You die', data):
             logger.info("Step {}: Died".format(self.steps))
             self.game_state.died = True
 
@@ -409,7 +1086,7 @@ class CrawlEnv(gym.Env):
             return
 
         if not self.game_state.has_orb:
-            if 'You pick up the Orb of Zot' in data:
+            if self._saw_message('You pick up the Orb of Zot', data):
                 logger.info("Step {}: Picked up the Orb".format(self.steps))
                 self.reward += 10000
                 self.game_state.has_orb = True
@@ -432,6 +1109,17 @@ class CrawlEnv(gym.Env):
             logger.debug('Time: ' + str(self.game_state.time))
 
 
+    def _saw_message(self, text, data):
+        """ Check for a message in the raw data or in the messages extracted from the screen
+            (which catches messages split across reads)
+        """
+        if text in data:
+            return True
+        for message in self.game_state.messages:
+            if text in message:
+                return True
+        return False
+
     def _find_player_symbol(self):
         """Find the @"""
         for row in range(self.terminal.screen.rows):
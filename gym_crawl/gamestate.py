@@ -1,6 +1,9 @@
 '''
 Class representing current game state
 '''
+import copy
+
+import gym_crawl.terminal_parser as parser
 
 class GameState:
     
@@ -15,7 +18,12 @@ class GameState:
         self.has_orb = False
         self.runes = []
         
-        self.map = None
+        self._map = None
+        self._map_screen = None # screen the map will be extracted from when it's first used
+        self.screen = None # snapshot of the screen this state came from
+        self.messages = [] # messages which appeared in the latest frame
+        self.inventory = {} # letter -> InventoryItem, if inventory tracking is on (shared, never modified)
+        self.action_mask = None # valid actions, if action masking is on (shared, never modified)
         
         self.hp = 0
         self.max_hp = 0
@@ -37,6 +45,40 @@ class GameState:
         self.place = '' # place (e.g. Dungeon:1)
         self.time = 0.0
 
+        # only available from the state side-channel
+        self.turn = 0
+        self.inventory_letters = ''
+        self.monsters = [] # (name, x, y) relative to the player
+
+    @property
+    def map(self):
+        if self._map_screen is not None:
+            self._map = parser.extract_map(self._map_screen)
+            self._map_screen = None
+        return self._map
+
+    @map.setter
+    def map(self, value):
+        self._map = value
+        self._map_screen = None
+
+    def set_map_source(self, screen):
+        """ Extract the map from screen (which must not change) when it's first used """
+        self._map_screen = screen
+
+    @property
+    def entities(self):
+        """ Monsters and items on the map (see terminal_parser.extract_entities) """
+        game_map = self.map
+        return parser.extract_entities(game_map) if game_map is not None else None
+
+    def __deepcopy__(self, memo):
+        # the map is shared rather than copied: maps come from the parse cache and are never modified
+        result = copy.copy(self)
+        result.runes = list(self.runes)
+        result.messages = []
+        return result
+
     def is_finished(self):
         return self.won or self.died or self.escaped
     
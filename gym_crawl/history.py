@@ -0,0 +1,125 @@
+'''
+History of recent observations as arrays, for agents which look at a stack of the last few frames
+'''
+import numpy as np
+from gym import spaces
+
+import gym_crawl.arrays as arrays
+import gym_crawl.crawl_defs as defs
+
+# map glyph classes
+CLASS_UNKNOWN = 0   # unexplored or unrecognised
+CLASS_FLOOR = 1
+CLASS_WALL = 2      # and other impassable features
+CLASS_DOOR = 3
+CLASS_STAIRS = 4
+CLASS_FEATURE = 5   # altars, fountains, traps etc.
+CLASS_ITEM = 6
+CLASS_MONSTER = 7
+CLASS_PLAYER = 8
+NUM_CLASSES = 9
+
+GLYPH_CLASSES = {}
+for _chars, _glyph_class in [
+        (defs.MONSTER_CHARS, CLASS_MONSTER),
+        (defs.NORMAL_ITEM_CHARS + defs.QUEST_ITEM_CHARS + defs.UNGETABLE_ITEM_CHARS, CLASS_ITEM),
+        (defs.DCHAR_TRAP + defs.DCHAR_ALTAR + defs.DCHAR_ARCH + defs.DCHAR_FOUNTAIN + defs.DCHAR_TELEPORTER, CLASS_FEATURE),
+        (defs.IMPASSABLE_CHARS, CLASS_WALL),
+        (defs.DCHAR_STAIRS_DOWN + defs.DCHAR_STAIRS_UP, CLASS_STAIRS),
+        (defs.DCHAR_DOOR_OPEN + defs.DCHAR_DOOR_CLOSED, CLASS_DOOR),
+        (defs.DCHAR_FLOOR + defs.DCHAR_FLOOR_MAGIC, CLASS_FLOOR)]:
+    for _char in _chars:
+        GLYPH_CLASSES[_char] = _glyph_class
+
+# history arrays: name -> (shape of one frame, dtype)
+HISTORY_SPEC = {
+    'map_classes': ((arrays.MAP_ROWS, arrays.MAP_COLS), np.uint8),       # glyph classes, indexed by y, x
+    'map_colors': ((2, arrays.MAP_ROWS, arrays.MAP_COLS), np.uint8),     # map.Color values of fg, bg
+    'stats': ((len(arrays.STATS_FIELDS),), np.float32),                  # see arrays.STATS_FIELDS
+}
+
+
+def history_space(depth):
+    """ Observation space for a stack of depth frames (as returned by HistoryBuffer.frames) """
+    result = {}
+    for name, (shape, dtype) in HISTORY_SPEC.items():
+        if np.issubdtype(dtype, np.floating):
+            low, high = -np.inf, np.inf
+        else:
+            low, high = 0, np.iinfo(dtype).max
+        result[name] = spaces.Box(low, high, (depth,) + shape, dtype)
+    return spaces.Dict(result)
+
+
+def space_depth(space):
+    """ Stack depth of an observation space made by history_space """
+    return space['stats'].shape[0]
+
+
+class HistoryBuffer:
+    """ Ring of the last depth frames.
+        Each frame is written twice, depth slots apart, so the last depth frames are always
+        one contiguous slice of the arrays and can be returned as views without copying.
+    """
+
+    def __init__(self, depth):
+        if depth < 1:
+            raise ValueError('History depth must be at least 1')
+        self.depth = depth
+        self.arrays = {name: np.zeros((2 * depth,) + shape, dtype) for name, (shape, dtype) in HISTORY_SPEC.items()}
+        self.index = -1 # slot of the newest frame
+        self.map = None # map in the newest frame
+
+    def reset(self):
+        self.index = -1
+        self.map = None
+
+    def push(self, game_state):
+        """ Add a frame. The first frame after a reset fills the whole history """
+        first = self.index < 0
+        prev = self.index
+        index = (self.index + 1) % self.depth
+        arrs = self.arrays
+        game_map = game_state.map
+        if game_map is not None and game_map is self.map:
+            # maps are shared by the parse cache, so the same map object means the same contents
+            arrs['map_classes'][index] = arrs['map_classes'][prev]
+            arrs['map_colors'][index] = arrs['map_colors'][prev]
+        else:
+            self._write_map(game_map, arrs['map_classes'][index], arrs['map_colors'][index])
+            self.map = game_map
+        arrays.stats_vector(game_state, arrs['stats'][index])
+
+        for array in arrs.values():
+            if first:
+                array[:] = array[index]
+            else:
+                array[index + self.depth] = array[index]
+        self.index = index
+
+    def frames(self, k=None):
+        """ Get views of the last k (default: depth) frames as name -> array of shape (k, ...), oldest first.
+            The views are overwritten by later pushes, so copy them if they need to be kept.
+        """
+        if k is None:
+            k = self.depth
+        elif not 1 <= k <= self.depth:
+            raise ValueError('Can only get 1 to {} frames'.format(self.depth))
+        if self.index < 0:
+            raise RuntimeError('History is empty')
+        end = self.index + self.depth + 1
+        return {name: array[end - k:end] for name, array in self.arrays.items()}
+
+    @staticmethod
+    def _write_map(game_map, classes, colors):
+        if game_map is None:
+            classes[...] = CLASS_UNKNOWN
+            colors[...] = 0
+            return
+        for x, column in game_map.cells.items():
+            classes[:, x] = [GLYPH_CLASSES.get(column[y].glyph, CLASS_UNKNOWN) for y in range(arrays.MAP_ROWS)]
+            colors[0, :, x] = [column[y].fg_color.value for y in range(arrays.MAP_ROWS)]
+            colors[1, :, x] = [column[y].bg_color.value for y in range(arrays.MAP_ROWS)]
+        if game_map.player_pos is not None:
+            x, y = game_map.player_pos
+            classes[y, x] = CLASS_PLAYER
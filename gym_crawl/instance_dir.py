@@ -0,0 +1,68 @@
+'''
+Private working directories for crawl processes, so concurrent envs don't share saves and morgue files
+'''
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+
+logger = logging.getLogger('instance-dir')
+
+# RAM-backed, so saves and morgue files don't hit the disk
+DEFAULT_ROOT = '/dev/shm'
+
+
+def default_root():
+    if os.path.isdir(DEFAULT_ROOT) and os.access(DEFAULT_ROOT, os.W_OK):
+        return DEFAULT_ROOT
+    return tempfile.gettempdir()
+
+
+class InstanceDir:
+    """ A unique directory for one env's crawl process, with crawlrc linked in.
+        Morgue files are rotated: at most keep_morgue files, and at most morgue_quota bytes (None for no limit).
+        The directory is removed when this object is garbage collected, or on remove().
+    """
+
+    def __init__(self, rc_file='./crawlrc', root=None, keep_morgue=10, morgue_quota=None, prefix='crawl-'):
+        self.root = root if root is not None else default_root()
+        self.keep_morgue = keep_morgue
+        self.morgue_quota = morgue_quota
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.path, ignore_errors=True)
+        os.symlink(os.path.abspath(rc_file), os.path.join(self.path, 'crawlrc'))
+        logger.info('Created instance directory ' + self.path)
+
+    def remove(self):
+        self._finalizer()
+
+    def clean_episode(self, character_name):
+        """ Remove the previous episode's save and keep the morgue within its limits """
+        save_file = os.path.join(self.path, 'saves', character_name + '.cs')
+        if os.path.exists(save_file):
+            os.remove(save_file)
+        self.rotate_morgue()
+
+    def rotate_morgue(self):
+        morgue_dir = os.path.join(self.path, 'morgue')
+        if not os.path.isdir(morgue_dir):
+            return
+        files = []
+        for name in os.listdir(morgue_dir):
+            path = os.path.join(morgue_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        files.sort(reverse=True) # newest first
+
+        total = 0
+        for i, (_, size, path) in enumerate(files):
+            total += size
+            if i >= self.keep_morgue or (self.morgue_quota is not None and total > self.morgue_quota):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning('Failed to remove {}: {}'.format(path, e))
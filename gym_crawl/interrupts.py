@@ -0,0 +1,26 @@
+'''
+Predicates for interrupting long-running actions (explore, rest, travel) early, see CrawlEnv.set_streaming.
+Each takes the game state parsed from the latest intermediate frame and returns True to interrupt.
+'''
+
+
+def hp_below(fraction):
+    """ Interrupt when HP falls below a fraction of max HP """
+    def predicate(game_state):
+        return game_state.max_hp > 0 and game_state.hp < fraction * game_state.max_hp
+    return predicate
+
+
+def monster_in_view():
+    """ Interrupt when a monster is on the map """
+    def predicate(game_state):
+        entities = game_state.entities
+        return entities is not None and len(entities['monsters']) > 0
+    return predicate
+
+
+def any_of(*predicates):
+    """ Interrupt when any of the predicates is true """
+    def predicate(game_state):
+        return any(p(game_state) for p in predicates)
+    return predicate
@@ -0,0 +1,149 @@
+'''
+Inventory model, read from the inventory screen once and then kept up to date from game messages
+'''
+import logging
+import re
+
+logger = logging.getLogger('inventory')
+
+# inventory screen line, e.g. " a - a +0 hand axe (weapon)". The separator is '+' or '#' when selected
+_screen_item_re = re.compile(r'^\s*([a-zA-Z]) [-+#] (.+?)\s*$')
+
+# item message, e.g. "b - 2 potions of curing" (pick up, wield, wear, put on, ...)
+_message_item_re = re.compile(r'^([a-zA-Z]) - (.+?)\s*$')
+
+# trailing status, e.g. "(weapon)", "(worn)", "(left hand)"
+_status_re = re.compile(r'^(.*?) \(([^()]+)\)$')
+
+_drop_re = re.compile(r'You drop (.+?)\.')
+
+# bottom of a menu which has more pages, e.g. "-more-" or "(1/2)"
+_more_pages_re = re.compile(r'-more-|page down|\(\d+/\d+\)\s*$', re.MULTILINE)
+
+# most pages to read (52 items at ~18 per page fit in 3)
+MAX_INVENTORY_PAGES = 5
+
+# messages after which the cached inventory can't be trusted (quantities or status changed
+# in a way the messages don't spell out)
+INVALIDATING_MESSAGES = [
+    'You drink', 'You read', 'You eat', 'You throw', 'You take off', 'You finish taking off',
+    'You remove', 'You stop wielding', 'You are empty-handed', 'You have no more',
+    'crumbles', 'is destroyed', 'are destroyed', 'burn!', 'freeze and shatter',
+]
+
+
+class InventoryItem:
+    """ An item in the inventory. Items are shared between game states, so must not be modified """
+    __slots__ = ('letter', 'name', 'status')
+
+    def __init__(self, letter, name, status=''):
+        self.letter = letter
+        self.name = name
+        self.status = status # e.g. 'weapon', 'worn', 'left hand', or '' if not in use
+
+    def __eq__(self, other):
+        return isinstance(other, InventoryItem) and \
+            (self.letter, self.name, self.status) == (other.letter, other.name, other.status)
+
+    def __repr__(self):
+        if self.status:
+            return '{} - {} ({})'.format(self.letter, self.name, self.status)
+        return '{} - {}'.format(self.letter, self.name)
+
+
+def parse_item(letter, text):
+    match = _status_re.match(text)
+    if match:
+        return InventoryItem(letter, match.group(1), match.group(2))
+    return InventoryItem(letter, text)
+
+
+def parse_inventory_screen(screen):
+    """ Get the items listed on the inventory screen, as a dict of letter -> InventoryItem """
+    items = {}
+    for row in range(screen.rows):
+        match = _screen_item_re.match(screen.to_string(row, 0, row, screen.cols - 1))
+        if match:
+            items[match.group(1)] = parse_item(match.group(1), match.group(2))
+    return items
+
+
+def has_more_pages(screen):
+    """ Check whether the menu on the screen says it has more pages """
+    return _more_pages_re.search(screen.to_string(screen.rows - 2, 0, screen.rows - 1, screen.cols - 1)) is not None
+
+
+class Inventory:
+    """ Cached inventory. items is a dict of letter -> InventoryItem which is replaced rather
+        than modified when the inventory changes, so it can be shared between game states.
+        complete is False if the inventory screen had pages which weren't read, so items may be missing.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.valid = False
+        self.complete = False
+
+    def invalidate(self):
+        self.valid = False
+
+    def update_from_screen(self, screen):
+        """ Replace the cache with the contents of the first page of the inventory screen """
+        self.items = parse_inventory_screen(screen)
+        self.valid = True
+        self.complete = not has_more_pages(screen)
+
+    def add_page(self, screen):
+        """ Add the items on the next page of the inventory screen. Returns True if it had new items.
+            A page without new items means the menu has come back round (or didn't move), so all pages were seen.
+        """
+        items = parse_inventory_screen(screen)
+        if not any(letter not in self.items for letter in items):
+            self.complete = True
+            return False
+        self.items = dict(self.items)
+        self.items.update(items)
+        self.complete = not has_more_pages(screen)
+        return True
+
+    def update_from_messages(self, messages):
+        """ Apply new game messages to the cache. Returns True if the items changed """
+        changed = False
+        for message in messages:
+            match = _message_item_re.match(message)
+            if match:
+                item = parse_item(match.group(1), match.group(2))
+                if self.items.get(item.letter) != item:
+                    self.items = dict(self.items)
+                    self.items[item.letter] = item
+                    changed = True
+                continue
+
+            match = _drop_re.search(message)
+            if match:
+                if self._remove(match.group(1)):
+                    changed = True
+                else:
+                    # part of a stack, or an item we didn't know about
+                    self.invalidate()
+                continue
+
+            for text in INVALIDATING_MESSAGES:
+                if text in message:
+                    logger.debug('Inventory invalidated by message: ' + message)
+                    self.invalidate()
+                    break
+        return changed
+
+    def check_letters(self, letters):
+        """ Invalidate the cache if it doesn't hold exactly these inventory letters """
+        if self.valid and sorted(letters) != sorted(self.items):
+            self.invalidate()
+
+    def _remove(self, name):
+        for letter, item in self.items.items():
+            if item.name == name:
+                self.items = dict(self.items)
+                del self.items[letter]
+                return True
+        return False
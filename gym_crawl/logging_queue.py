@@ -0,0 +1,61 @@
+'''
+Route log records through a queue, so that slow handlers (e.g. file I/O) run on a background thread
+'''
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+
+# envs can be created from several threads (e.g. by the TCP server)
+_lock = threading.Lock()
+_queue_handler = None
+_listener = None
+_logger = None
+
+
+def start_queue_logging(logger=None):
+    """ Move the handlers of logger (default: root logger) behind a QueueHandler serviced by a background thread.
+        Safe to call repeatedly: handlers added since the last call are moved across too.
+    """
+    with _lock:
+        _start_queue_logging(logger)
+
+
+def _start_queue_logging(logger):
+    global _queue_handler, _listener, _logger
+    if logger is None:
+        logger = logging.getLogger()
+    handlers = [handler for handler in logger.handlers if handler is not _queue_handler]
+    if not handlers:
+        # nothing to move (and leaving the logger without handlers keeps the last resort handler working)
+        return
+
+    if _queue_handler is None:
+        log_queue = queue.SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        _listener = logging.handlers.QueueListener(log_queue, respect_handler_level=True)
+        _listener.start()
+        _logger = logger
+        atexit.register(stop_queue_logging)
+
+    for handler in handlers:
+        logger.removeHandler(handler)
+    _listener.handlers = tuple(_listener.handlers) + tuple(handlers)
+    if _queue_handler not in logger.handlers:
+        logger.addHandler(_queue_handler)
+
+
+def stop_queue_logging():
+    """ Flush queued records, stop the background thread and give the handlers back to the logger """
+    global _queue_handler, _listener, _logger
+    with _lock:
+        if _listener is None:
+            return
+        _logger.removeHandler(_queue_handler)
+        _listener.stop()
+        for handler in _listener.handlers:
+            _logger.addHandler(handler)
+        _queue_handler = None
+        _listener = None
+        _logger = None
@@ -0,0 +1,53 @@
+'''
+Macro actions: key sequences sent in one write, which finish on a known screen
+'''
+import re
+
+from gym_crawl.chars import ENTER, ESC
+import gym_crawl.terminal_parser as parser
+
+
+class Macro:
+    """ A composite action.
+        signature is the screen expected when the keys have been handled: one of the terminal_parser.SCREEN_*
+        kinds, or a regular expression to search for in the output, which must match the end of drawing.
+        The main screen is recognised by the cursor being left on the @, other screens by the text drawn last
+        (terminal_parser.SCREEN_END_SIGNATURES), so the env waits for exactly that screen. Screens with no
+        known end, e.g. menus, are read until the read timeout.
+        timeout (seconds) overrides the env's read timeout, for macros which take a while (e.g. travel).
+    """
+
+    def __init__(self, name, keys, signature=parser.SCREEN_MAIN, timeout=None):
+        self.name = name
+        self.keys = keys
+        self.signature = signature
+        self.timeout = timeout
+        self.pattern = None
+        if signature in parser.SCREEN_END_SIGNATURES:
+            self.pattern = parser.SCREEN_END_SIGNATURES[signature]
+        elif signature not in (parser.SCREEN_MAIN, parser.SCREEN_MENU, parser.SCREEN_OTHER):
+            self.pattern = re.compile(signature)
+
+    def is_main_screen(self):
+        return self.signature == parser.SCREEN_MAIN
+
+    def matches(self, data):
+        """ Check output data for the end of the screen (not used for the main screen) """
+        return self.pattern is not None and self.pattern.search(data) is not None
+
+    def __repr__(self):
+        return 'Macro({})'.format(self.name)
+
+
+# some useful macros
+MACROS = {macro.name: macro for macro in [
+    Macro('travel-downstairs', 'G>', timeout=5.0),
+    Macro('travel-upstairs', 'G<', timeout=5.0),
+    Macro('explore', 'o', timeout=5.0),
+    Macro('rest', '5', timeout=5.0),
+    Macro('eat-ration', 'er' + ESC),
+    Macro('pick-up-all', ',' + ENTER + ESC),
+    Macro('inventory', 'i', parser.SCREEN_MENU),
+    Macro('character', '%', parser.SCREEN_CHARACTER),
+    Macro('skills', 'm', parser.SCREEN_SKILLS),
+]}
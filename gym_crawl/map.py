@@ -42,6 +42,7 @@ class Map:
         # array of cells, indexed by x, y
         self.cells = None
         self.player_pos = None
+        self.entities = None # see terminal_parser.extract_entities
 
     def to_string(self):
         """ return map contents as string """
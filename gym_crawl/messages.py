@@ -0,0 +1,112 @@
+'''
+Game message log, extracted incrementally from the message area of the screen
+'''
+import re
+
+# location of message area within terminal
+MESSAGE_START_ROW = 17
+MESSAGE_END_ROW = 23
+
+TOKEN_PAD = 0
+TOKEN_UNKNOWN = 1
+
+_word_re = re.compile(r"[a-z]+|\d+|[^\sa-z\d]")
+
+
+class Tokenizer:
+    """ Maps words to integer IDs for models, adding new words as they are seen.
+        ID 0 is reserved for padding and 1 for unknown words (once the vocabulary is full).
+    """
+
+    def __init__(self, max_vocab=10000):
+        self.max_vocab = max_vocab
+        self.vocab = {}
+
+    def encode(self, text):
+        ids = []
+        vocab = self.vocab
+        for word in _word_re.findall(text.lower()):
+            token = vocab.get(word)
+            if token is None:
+                if len(vocab) + 2 < self.max_vocab:
+                    token = vocab[word] = len(vocab) + 2
+                else:
+                    token = TOKEN_UNKNOWN
+            ids.append(token)
+        return ids
+
+
+class MessageLog:
+    """ Fixed-capacity ring buffer of messages, stamped with the step and game time they appeared """
+
+    def __init__(self, capacity=1000, tokenizer=None):
+        self.capacity = capacity
+        self.tokenizer = tokenizer
+        self.lines = [None] * capacity
+        self.steps = [0] * capacity
+        self.times = [0.0] * capacity
+        self.tokens = [None] * capacity
+        self.count = 0 # total number of messages added (including overwritten ones)
+        self.row_hashes = None # message area row hashes when last updated
+
+    def clear(self):
+        self.count = 0
+        self.row_hashes = None
+
+    def add(self, line, step, game_time):
+        i = self.count % self.capacity
+        self.lines[i] = line
+        self.steps[i] = step
+        self.times[i] = game_time
+        if self.tokenizer is not None:
+            self.tokens[i] = self.tokenizer.encode(line)
+        self.count += 1
+
+    def update(self, screen, scroll_events, step, game_time):
+        """ Add any lines which have appeared in the message area since the last update,
+            and return them. scroll_events are the (start_row, end_row, num_lines) scrolls since then.
+        """
+        # work out how far old lines have moved up
+        shift = 0
+        for start_row, end_row, num in scroll_events:
+            if end_row < MESSAGE_START_ROW or start_row > MESSAGE_END_ROW:
+                continue
+            if num > 0 and start_row <= MESSAGE_START_ROW and end_row >= MESSAGE_END_ROW:
+                shift += num
+            else:
+                # partial or downward scroll - compare by position
+                shift = 0
+                break
+
+        prev_hashes = self.row_hashes
+        row_hashes = screen.row_hashes[MESSAGE_START_ROW:MESSAGE_END_ROW+1]
+        new_lines = []
+        for i, row_hash in enumerate(row_hashes):
+            j = i + shift
+            if prev_hashes is not None and j < len(prev_hashes) and prev_hashes[j] == row_hash:
+                continue
+            row = MESSAGE_START_ROW + i
+            line = screen.to_string(row, 0, row, screen.cols - 1).strip()
+            if line:
+                new_lines.append(line)
+                self.add(line, step, game_time)
+        self.row_hashes = row_hashes
+        return new_lines
+
+    def get(self, num=None):
+        """ Get the most recent num messages (default: all available) as (step, time, line), oldest first """
+        available = min(self.count, self.capacity)
+        if num is None or num > available:
+            num = available
+        result = []
+        for n in range(self.count - num, self.count):
+            i = n % self.capacity
+            result.append((self.steps[i], self.times[i], self.lines[i]))
+        return result
+
+    def get_tokens(self, num=None):
+        """ Get the token IDs of the most recent num messages, oldest first (requires a tokenizer) """
+        available = min(self.count, self.capacity)
+        if num is None or num > available:
+            num = available
+        return [self.tokens[n % self.capacity] for n in range(self.count - num, self.count)]
@@ -0,0 +1,123 @@
+'''
+Low overhead timing counters and histograms for the crawl environment
+'''
+from bisect import bisect_left
+import time
+
+# phases of a step
+PHASE_SEND = 'send'                 # writing keys to crawl
+PHASE_FIRST_BYTE = 'first_byte'     # waiting for the first byte of output
+PHASE_READY = 'ready'               # waiting until the frame is known to be complete
+PHASE_READ = 'read'                 # total time in the read loop (including timeouts)
+PHASE_CAPTURE = 'capture'           # terminal capture (escape sequence handling)
+PHASE_STATS = 'stats'               # parsing the stats panel
+PHASE_MAP = 'map'                   # extracting the map
+PHASE_MESSAGES = 'messages'         # extracting new messages
+PHASE_DEEPCOPY = 'deepcopy'         # copying the previous game state
+PHASE_REWARD = 'reward'             # reward calculation
+PHASE_STEP = 'step'                 # whole step
+
+PHASES = [PHASE_SEND, PHASE_FIRST_BYTE, PHASE_READY, PHASE_READ, PHASE_CAPTURE, PHASE_STATS,
+          PHASE_MAP, PHASE_MESSAGES, PHASE_DEEPCOPY, PHASE_REWARD, PHASE_STEP]
+
+# histogram bucket upper bounds, in seconds (1-2-5 series from 10us to 10s)
+BUCKET_BOUNDS = [m * 10.0 ** e for e in range(-5, 1) for m in (1, 2, 5)] + [10.0]
+
+
+class Histogram:
+    """ Fixed-bucket histogram of durations """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # last bucket is overflow
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def percentile(self, pcnt):
+        """ Approximate percentile (upper bound of the bucket it falls in) """
+        if self.count == 0:
+            return 0.0
+        target = self.count * pcnt / 100.0
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean(),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': list(zip(self.bounds + [float('inf')], self.counts)),
+        }
+
+
+class StepMetrics:
+    """ Per-phase timings for the step in progress, plus histograms and counters over all steps """
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.current = {}
+        self.reset()
+
+    def reset(self):
+        self.histograms = {phase: Histogram() for phase in PHASES}
+        self.counters = {}
+        self.current = {}
+
+    def start_step(self):
+        self.current = {}
+
+    def add(self, phase, elapsed):
+        """ Add time to a phase of the current step """
+        current = self.current
+        current[phase] = current.get(phase, 0.0) + elapsed
+
+    def lap(self, phase, start):
+        """ Add time since start to a phase of the current step, and return the current time """
+        now = time.perf_counter()
+        current = self.current
+        current[phase] = current.get(phase, 0.0) + (now - start)
+        return now
+
+    def end_step(self):
+        """ Fold the current step's timings into the histograms and return them """
+        histograms = self.histograms
+        for phase, elapsed in self.current.items():
+            if phase not in histograms:
+                histograms[phase] = Histogram()
+            histograms[phase].add(elapsed)
+        return self.current
+
+    def add_sample(self, name, value):
+        """ Add a value straight into a histogram, outside of step timing """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].add(value)
+
+    def count(self, name, num=1):
+        self.counters[name] = self.counters.get(name, 0) + num
+
+    def to_dict(self):
+        return {
+            'counters': dict(self.counters),
+            'phases': {name: hist.to_dict() for name, hist in self.histograms.items() if hist.count > 0},
+        }
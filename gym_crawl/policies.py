@@ -0,0 +1,175 @@
+'''
+Policies which can be run inside env worker processes (see SharedMemoryVecEnv.rollout), so a whole batch of
+steps or episodes costs one round trip instead of one per step.
+
+A policy is a picklable object with:
+    setup(action_keys, seed)   called once in the worker, before the first step
+    __call__(game_state)       returns the action index for the next step
+'''
+import time
+
+import numpy as np
+
+import gym_crawl.arrays as arrays
+from gym_crawl.chars import ESC
+
+# directions to an adjacent cell as (dx, dy) -> movement key
+MOVE_KEYS = {(-1, -1): 'y', (0, -1): 'k', (1, -1): 'u', (-1, 0): 'h', (1, 0): 'l', (-1, 1): 'b', (0, 1): 'j', (1, 1): 'n'}
+
+
+class RandomPolicy:
+    """ Chooses actions uniformly at random """
+
+    def __init__(self):
+        self.num_actions = 0
+        self.random = None
+
+    def setup(self, action_keys, seed):
+        self.num_actions = len(action_keys)
+        self.random = np.random.default_rng(seed)
+
+    def __call__(self, game_state):
+        return int(self.random.integers(self.num_actions))
+
+
+class ExplorePolicy:
+    """ Scripted baseline: attacks adjacent monsters, otherwise explores with 'o' and goes down stairs
+        when exploration is done. Makes a random move if an action it needs isn't in the action keys.
+    """
+
+    def __init__(self, random_prob=0.05):
+        self.random_prob = random_prob
+        self.actions = {}
+        self.fallback = RandomPolicy()
+        self.random = None
+
+    def setup(self, action_keys, seed):
+        self.actions = {keys: index for index, keys in enumerate(action_keys) if isinstance(keys, str)}
+        self.fallback.setup(action_keys, seed)
+        self.random = np.random.default_rng(seed)
+
+    def __call__(self, game_state):
+        if not game_state.on_main_screen:
+            return self._action(ESC)
+        if self.random.random() < self.random_prob:
+            return self.fallback(game_state)
+        game_map = game_state.map
+        if game_map is not None and game_map.player_pos is not None:
+            player_x, player_y = game_map.player_pos
+            for _, x, y in game_state.entities['monsters']:
+                key = MOVE_KEYS.get((x - player_x, y - player_y))
+                if key is not None:
+                    return self._action(key)
+        if any('Done exploring' in message for message in game_state.messages):
+            return self._action('>')
+        return self._action('o')
+
+    def _action(self, keys):
+        index = self.actions.get(keys)
+        return index if index is not None else self.fallback(None)
+
+
+class LinearPolicy:
+    """ Chooses the action with the highest score, where the scores are weights (actions x stats) times the
+        stats vector (see arrays.STATS_FIELDS) plus bias. With a temperature, samples from the softmax instead.
+    """
+
+    def __init__(self, weights, bias=None, temperature=0.0):
+        self.weights = np.asarray(weights, np.float32)
+        self.bias = np.zeros(len(self.weights), np.float32) if bias is None else np.asarray(bias, np.float32)
+        self.temperature = temperature
+        self.stats = np.zeros(len(arrays.STATS_FIELDS), np.float32)
+        self.random = None
+
+    def setup(self, action_keys, seed):
+        if self.weights.shape != (len(action_keys), len(arrays.STATS_FIELDS)):
+            raise ValueError('Weights should have shape {}'.format((len(action_keys), len(arrays.STATS_FIELDS))))
+        self.random = np.random.default_rng(seed)
+
+    def __call__(self, game_state):
+        scores = self.weights @ arrays.stats_vector(game_state, self.stats) + self.bias
+        if not self.temperature:
+            return int(np.argmax(scores))
+        probs = np.exp((scores - scores.max()) / self.temperature)
+        return int(self.random.choice(len(probs), p=probs / probs.sum()))
+
+
+class Rollout:
+    """ Runs a policy in an env for a number of steps and/or episodes, carrying on from where the last
+        rollout stopped. Episodes which end are reset automatically.
+    """
+
+    def __init__(self, env, policy=None, seed=None):
+        self.env = env
+        self.policy = None
+        self.game_state = None
+        self.screen = None
+        self.done = True
+        self.episode_score = 0
+        self.episode_steps = 0
+        if policy is not None:
+            self.set_policy(policy, seed)
+
+    def set_policy(self, policy, seed=None):
+        policy.setup(self.env.get_action_keys(), seed)
+        self.policy = policy
+
+    def observe(self, game_state, screen, done, reward=0, reset=False):
+        """ Carry on from a reset or step made outside the rollout """
+        if reset:
+            self.episode_score = 0
+            self.episode_steps = 0
+        else:
+            self.episode_score += reward
+            self.episode_steps += 1
+        self.game_state = game_state
+        self.screen = screen
+        self.done = done
+
+    def run(self, num_steps=None, num_episodes=None):
+        """ Run until num_steps steps have been taken or num_episodes episodes have ended (whichever is first).
+            Returns a trajectory dict: per step arrays actions, rewards, dones and stats (the stats vector
+            before each action), and a summary of episodes which ended, steps and timing.
+        """
+        if num_steps is None and num_episodes is None:
+            raise ValueError('Give num_steps and/or num_episodes')
+        start_time = time.perf_counter()
+        actions = []
+        rewards = []
+        dones = []
+        stats = []
+        episode_scores = []
+        episode_steps = []
+        while (num_steps is None or len(actions) < num_steps) and \
+                (num_episodes is None or len(episode_scores) < num_episodes):
+            if self.done:
+                self.game_state, _, self.done, self.screen = self.env.reset()
+                self.episode_score = 0
+                self.episode_steps = 0
+                if self.done:
+                    # crawl failed to start; the error is in the env's process stats
+                    break
+            action = self.policy(self.game_state)
+            stats.append(arrays.stats_vector(self.game_state))
+            self.game_state, reward, self.done, self.screen = self.env.step(action)
+            actions.append(action)
+            rewards.append(reward)
+            dones.append(self.done)
+            self.episode_score += reward
+            self.episode_steps += 1
+            if self.done:
+                episode_scores.append(self.episode_score)
+                episode_steps.append(self.episode_steps)
+
+        seconds = time.perf_counter() - start_time
+        return {
+            'actions': np.array(actions, np.int64),
+            'rewards': np.array(rewards, np.int64),
+            'dones': np.array(dones, bool),
+            'stats': np.array(stats, np.float32).reshape(len(stats), len(arrays.STATS_FIELDS)),
+            'episode_scores': episode_scores,
+            'episode_steps': episode_steps,
+            'steps': len(actions),
+            'seconds': seconds,
+            'steps_per_second': len(actions) / seconds if seconds else 0.0,
+        }
@@ -0,0 +1,238 @@
+'''
+Compact binary protocol for running crawl environments in another process or on another host.
+
+Every message is a frame: payload length (uint32), message type (uint8), payload. All integers are
+little-endian. Screens are delta coded: only runs of cells which changed since the last observation
+sent for that environment are included, and the client applies them to its own copy of the screen.
+'''
+import struct
+
+from gym_crawl.gamestate import GameState
+import gym_crawl.terminal as term
+
+# requests
+MSG_MAKE = 1            # character name, action keys -> MSG_MADE
+MSG_RESET = 2           # env id -> MSG_OBSERVATION
+MSG_STEP = 3            # env id, action -> MSG_OBSERVATION
+MSG_CLOSE = 4           # env id -> MSG_OK
+
+# responses
+MSG_MADE = 64           # env id, number of actions
+MSG_OBSERVATION = 65    # reward, done, game state, screen delta
+MSG_OK = 66
+MSG_ERROR = 67          # error text
+
+_header = struct.Struct('<IB')
+_uint32 = struct.Struct('<I')
+_env_action = struct.Struct('<II')
+_made = struct.Struct('<II')
+_reward_done = struct.Struct('<qB')
+_string_length = struct.Struct('<H')
+_delta_header = struct.Struct('<BH')    # flags, number of runs
+_run_header = struct.Struct('<BBB')     # row, col, number of cells
+_cell = struct.Struct('<IBBB')          # glyph, fg color, bg color, bold
+
+# game state: flags, then integer stats, then time
+_STATE_FLAGS = ['on_main_screen', 'started', 'won', 'died', 'escaped', 'has_orb']
+_STATE_INTS = ['hp', 'max_hp', 'mp', 'max_mp', 'str', 'int', 'dex', 'ac', 'ev', 'sh', 'xl', 'pcnt_next_xl',
+               'noise', 'turn']
+_state = struct.Struct('<B{}id'.format(len(_STATE_INTS)))
+
+DELTA_CLEAR = 1         # clear the screen before applying the runs
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def write_message(f, msg_type, payload=b''):
+    f.write(_header.pack(len(payload), msg_type) + payload)
+    f.flush()
+
+
+def read_message(f):
+    """ Read a frame from a binary file object, returning (message type, payload) """
+    header = f.read(_header.size)
+    if len(header) < _header.size:
+        raise EOFError('Connection closed')
+    length, msg_type = _header.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        raise EOFError('Connection closed')
+    return msg_type, payload
+
+
+def pack_string(text):
+    data = text.encode('utf-8')
+    return _string_length.pack(len(data)) + data
+
+
+def unpack_string(payload, offset):
+    length, = _string_length.unpack_from(payload, offset)
+    offset += _string_length.size
+    return payload[offset:offset+length].decode('utf-8'), offset + length
+
+
+def pack_make(character_name, action_keys):
+    parts = [pack_string(character_name), _uint32.pack(len(action_keys))]
+    parts.extend(pack_string(keys) for keys in action_keys)
+    return b''.join(parts)
+
+
+def unpack_make(payload):
+    character_name, offset = unpack_string(payload, 0)
+    num_actions, = _uint32.unpack_from(payload, offset)
+    offset += _uint32.size
+    action_keys = []
+    for _ in range(num_actions):
+        keys, offset = unpack_string(payload, offset)
+        action_keys.append(keys)
+    return character_name, action_keys
+
+
+def pack_env_id(env_id):
+    return _uint32.pack(env_id)
+
+
+def unpack_env_id(payload):
+    return _uint32.unpack_from(payload, 0)[0]
+
+
+def pack_step(env_id, action):
+    return _env_action.pack(env_id, action)
+
+
+def unpack_step(payload):
+    return _env_action.unpack(payload)
+
+
+def pack_made(env_id, num_actions):
+    return _made.pack(env_id, num_actions)
+
+
+def unpack_made(payload):
+    return _made.unpack(payload)
+
+
+def pack_game_state(game_state):
+    flags = 0
+    for bit, name in enumerate(_STATE_FLAGS):
+        if getattr(game_state, name):
+            flags |= 1 << bit
+    parts = [_state.pack(flags, *[getattr(game_state, name) for name in _STATE_INTS], game_state.time),
+             pack_string(game_state.place),
+             pack_string(game_state.inventory_letters),
+             _string_length.pack(len(game_state.messages))]
+    parts.extend(pack_string(message) for message in game_state.messages)
+    return b''.join(parts)
+
+
+def unpack_game_state(payload, offset, game_state):
+    """ Fill in game_state from the payload. Returns the offset after the game state """
+    values = _state.unpack_from(payload, offset)
+    offset += _state.size
+    flags = values[0]
+    for bit, name in enumerate(_STATE_FLAGS):
+        setattr(game_state, name, bool(flags & (1 << bit)))
+    for name, value in zip(_STATE_INTS, values[1:]):
+        setattr(game_state, name, value)
+    game_state.time = values[-1]
+    game_state.place, offset = unpack_string(payload, offset)
+    game_state.inventory_letters, offset = unpack_string(payload, offset)
+    num_messages, = _string_length.unpack_from(payload, offset)
+    offset += _string_length.size
+    messages = []
+    for _ in range(num_messages):
+        message, offset = unpack_string(payload, offset)
+        messages.append(message)
+    game_state.messages = messages
+    return offset
+
+
+class ScreenEncoder:
+    """ Encodes the changes to a screen since the last call to encode """
+
+    def __init__(self, rows=24, cols=80):
+        self.rows = rows
+        self.cols = cols
+        self.reset()
+
+    def reset(self):
+        """ Forget what was sent. The next delta tells the client to clear its screen first """
+        blank_line = [term.BLANK_CELL] * self.cols
+        self.cells = [blank_line] * self.rows
+        self.row_hashes = [term.Screen.line_hash(blank_line)] * self.rows
+        self.clear = True
+
+    def encode(self, screen):
+        runs = []
+        num_runs = 0
+        prev_hashes = self.row_hashes
+        row_hashes = screen.row_hashes
+        for row in range(self.rows):
+            if row_hashes[row] == prev_hashes[row]:
+                continue
+            line = screen.cells[row]
+            prev_line = self.cells[row]
+            col = 0
+            while col < self.cols:
+                if line[col].key == prev_line[col].key:
+                    col += 1
+                    continue
+                start_col = col
+                while col < self.cols and line[col].key != prev_line[col].key:
+                    col += 1
+                runs.append(_run_header.pack(row, start_col, col - start_col))
+                for cell in line[start_col:col]:
+                    runs.append(_cell.pack(ord(cell.glyph), cell.fg_color, cell.bg_color, cell.bold))
+                num_runs += 1
+            # lines are modified in place by the terminal, so keep a copy
+            self.cells[row] = list(line)
+        self.row_hashes = list(row_hashes)
+        flags = DELTA_CLEAR if self.clear else 0
+        self.clear = False
+        return _delta_header.pack(flags, num_runs) + b''.join(runs)
+
+
+class ScreenDecoder:
+    """ Applies deltas from a ScreenEncoder to a local screen """
+
+    def __init__(self, rows=24, cols=80):
+        self.screen = term.Screen(rows, cols)
+        self.cell_cache = {}
+
+    def decode(self, payload, offset):
+        """ Apply the delta at offset in payload. Returns the offset after the delta """
+        screen = self.screen
+        cell_cache = self.cell_cache
+        flags, num_runs = _delta_header.unpack_from(payload, offset)
+        offset += _delta_header.size
+        if flags & DELTA_CLEAR:
+            screen.clear()
+        cell_size = _cell.size
+        for _ in range(num_runs):
+            row, col, count = _run_header.unpack_from(payload, offset)
+            offset += _run_header.size
+            for i in range(count):
+                data = payload[offset:offset+cell_size]
+                cell = cell_cache.get(data)
+                if cell is None:
+                    glyph, fg_color, bg_color, bold = _cell.unpack(data)
+                    cell = cell_cache[data] = term.Cell(chr(glyph), fg_color, bg_color, bool(bold))
+                screen.set(row, col + i, cell)
+                offset += cell_size
+        return offset
+
+
+def pack_observation(game_state, reward, done, screen_encoder, screen):
+    return _reward_done.pack(reward, done) + pack_game_state(game_state) + screen_encoder.encode(screen)
+
+
+def unpack_observation(payload, screen_decoder, game_state=None):
+    """ Returns (game state, reward, done). The screen is applied to screen_decoder.screen """
+    if game_state is None:
+        game_state = GameState()
+    reward, done = _reward_done.unpack_from(payload, 0)
+    offset = unpack_game_state(payload, _reward_done.size, game_state)
+    screen_decoder.decode(payload, offset)
+    return game_state, reward, bool(done)
@@ -0,0 +1,191 @@
+'''
+Render screens to RGB images by copying glyphs from a pre-rendered atlas, and turn recordings into animations.
+
+Needs Pillow to render the glyph atlas and write GIFs.
+'''
+import logging
+import os
+
+import numpy as np
+
+import gym_crawl.arrays as arrays
+import gym_crawl.terminal as term
+
+logger = logging.getLogger('rasterizer')
+
+DEFAULT_FONT_PATHS = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/TTF/DejaVuSansMono.ttf',
+    '/Library/Fonts/Menlo.ttc',
+    'C:/Windows/Fonts/consola.ttf',
+]
+
+# glyphs outside the Basic Multilingual Plane are drawn as the replacement glyph
+MAX_CODEPOINT = 0x10000
+REPLACEMENT_GLYPH = '?'
+
+# xterm colours
+_COLORS = [(0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0), (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229)]
+_BRIGHT_COLORS = [(127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0), (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)]
+COLOR_RGB = np.array(_COLORS + _BRIGHT_COLORS, np.uint8)
+
+# terminal colour code -> colour number (0-15), so tiles can be indexed by glyph, fg and bg.
+# Default fg is light gray and default bg is black
+NUM_COLORS = 16
+FG_INDEX = np.full(256, 7, np.int64)
+BG_INDEX = np.zeros(256, np.int64)
+for _i in range(8):
+    FG_INDEX[term.FG_COLOR_BLACK + _i] = _i
+    FG_INDEX[term.FG_COLOR_DARK_GRAY + _i] = 8 + _i
+    BG_INDEX[term.BG_COLOR_BLACK + _i] = _i
+    BG_INDEX[term.BG_COLOR_DARK_GRAY + _i] = 8 + _i
+
+
+def _import_pil():
+    try:
+        from PIL import Image, ImageDraw, ImageFont
+    except ImportError:
+        raise RuntimeError('Pillow is not installed. Try: pip3 install Pillow')
+    return Image, ImageDraw, ImageFont
+
+
+class Rasterizer:
+    """ Renders glyph and style planes (see arrays.py) to RGB images.
+        The atlas holds a coloured tile for each combination of glyph, fg and bg colour seen so far. Tiles are made
+        the first time a combination appears; after that a frame is one gather from the atlas.
+    """
+
+    def __init__(self, font_path=None, font_size=14):
+        Image, ImageDraw, ImageFont = _import_pil()
+        self._Image = Image
+        self._ImageDraw = ImageDraw
+        if font_path is None:
+            font_path = next((path for path in DEFAULT_FONT_PATHS if os.path.exists(path)), None)
+        if font_path is not None:
+            self.font = ImageFont.truetype(font_path, font_size)
+        else:
+            logger.warning('No monospace font found, using the Pillow default font')
+            self.font = ImageFont.load_default()
+        self.cell_width = max(1, int(round(self.font.getlength('M'))))
+        if hasattr(self.font, 'getmetrics'):
+            ascent, descent = self.font.getmetrics()
+            self.cell_height = max(1, ascent + descent)
+        else:
+            self.cell_height = max(1, self.font.getbbox('M')[3])
+
+        # codepoint -> glyph mask slot (-1 if not rendered yet)
+        self.slots = np.full(MAX_CODEPOINT, -1, np.int64)
+        self.masks = []
+        # (slot, fg index, bg index) -> tile (-1 if not made yet)
+        self.tile_index = np.zeros(0, np.int64)
+        self.atlas = np.zeros((0, self.cell_height, self.cell_width, 3), np.uint8)
+        self._add_glyphs([ord(REPLACEMENT_GLYPH), ord(' ')])
+
+        # screen planes for render_screen
+        self.glyphs = np.zeros((arrays.SCREEN_ROWS, arrays.SCREEN_COLS), np.uint32)
+        self.styles = np.zeros((3, arrays.SCREEN_ROWS, arrays.SCREEN_COLS), np.uint8)
+        self.row_hashes = None
+
+    def _render_glyph(self, codepoint):
+        image = self._Image.new('L', (self.cell_width, self.cell_height), 0)
+        self._ImageDraw.Draw(image).text((0, 0), chr(codepoint), font=self.font, fill=255)
+        return np.asarray(image) >= 128
+
+    def _add_glyphs(self, codepoints):
+        for codepoint in codepoints:
+            self.slots[codepoint] = len(self.masks)
+            self.masks.append(self._render_glyph(codepoint))
+        tile_index = np.full(len(self.masks) * NUM_COLORS * NUM_COLORS, -1, np.int64)
+        tile_index[:len(self.tile_index)] = self.tile_index
+        self.tile_index = tile_index
+
+    def _add_tiles(self, combos):
+        tiles = []
+        for combo in combos:
+            slot, colors = divmod(combo, NUM_COLORS * NUM_COLORS)
+            fg, bg = divmod(colors, NUM_COLORS)
+            self.tile_index[combo] = len(self.atlas) + len(tiles)
+            tiles.append(np.where(self.masks[slot][..., None], COLOR_RGB[fg], COLOR_RGB[bg]))
+        self.atlas = np.concatenate([self.atlas, np.stack(tiles)])
+
+    def render(self, glyphs, styles):
+        """ Render glyph planes (..., rows, cols) and style planes (..., 3, rows, cols) to RGB images
+            of shape (..., rows * cell height, cols * cell width, 3)
+        """
+        codepoints = np.asarray(glyphs, np.int64)
+        codepoints = np.where(codepoints < MAX_CODEPOINT, codepoints, ord(REPLACEMENT_GLYPH))
+        slots = self.slots[codepoints]
+        if (slots < 0).any():
+            self._add_glyphs(np.unique(codepoints[slots < 0]).tolist())
+            slots = self.slots[codepoints]
+
+        styles = np.asarray(styles)
+        fg = FG_INDEX[styles[..., 0, :, :]]
+        bg = BG_INDEX[styles[..., 1, :, :]]
+        # bold makes the normal intensity colours bright
+        fg = np.where(styles[..., 2, :, :].astype(bool) & (fg < 8), fg + 8, fg)
+
+        combos = (slots * NUM_COLORS + fg) * NUM_COLORS + bg
+        tiles = self.tile_index[combos]
+        if (tiles < 0).any():
+            self._add_tiles(np.unique(combos[tiles < 0]).tolist())
+            tiles = self.tile_index[combos]
+        pixels = self.atlas[tiles]                        # (..., rows, cols, h, w, 3)
+
+        # interleave to (..., rows, h, cols, w, 3)
+        batch = pixels.shape[:-5]
+        rows, cols, height, width = pixels.shape[-5:-1]
+        pixels = np.moveaxis(pixels, -3, -4)
+        return pixels.reshape(batch + (rows * height, cols * width, 3))
+
+    def render_screen(self, screen):
+        """ Render a terminal.Screen, only re-reading rows which changed since the last call """
+        self.row_hashes = arrays.write_screen_planes(screen, self.glyphs, self.styles, self.row_hashes)
+        return self.render(self.glyphs, self.styles)
+
+
+def write_gif(frames, filename, fps=10):
+    """ Write a sequence of RGB images to an animated GIF """
+    Image, _, _ = _import_pil()
+    images = [Image.fromarray(frame) for frame in frames]
+    if not images:
+        raise ValueError('No frames')
+    images[0].save(filename, save_all=True, append_images=images[1:], duration=int(1000 / fps), loop=0)
+
+
+def write_video(frames, filename, fps=10):
+    """ Write a sequence of RGB images to a video file such as MP4 (needs imageio with ffmpeg) """
+    try:
+        import imageio
+    except ImportError:
+        raise RuntimeError('imageio is not installed. Try: pip3 install imageio imageio-ffmpeg')
+    imageio.mimwrite(filename, list(frames), fps=fps)
+
+
+def render_recording(directory, filename, fps=10, max_frames=None, rasterizer=None, batch_size=256):
+    """ Render the screens of a recording (see recorder.py) to a GIF, or a video if filename doesn't end in .gif.
+        Returns the number of frames.
+    """
+    from gym_crawl.recorder import read_shards
+
+    if rasterizer is None:
+        rasterizer = Rasterizer()
+    frames = []
+    for columns in read_shards(directory):
+        glyphs = columns['screen_glyphs']
+        styles = columns['screen_styles']
+        for start in range(0, len(glyphs), batch_size):
+            if max_frames is not None and len(frames) >= max_frames:
+                break
+            end = start + batch_size
+            if max_frames is not None:
+                end = min(end, start + max_frames - len(frames))
+            frames.extend(rasterizer.render(glyphs[start:end], styles[start:end]))
+        if max_frames is not None and len(frames) >= max_frames:
+            # stop before the next shard is loaded
+            break
+    if filename.lower().endswith('.gif'):
+        write_gif(frames, filename, fps)
+    else:
+        write_video(frames, filename, fps)
+    return len(frames)
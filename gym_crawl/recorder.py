@@ -0,0 +1,203 @@
+'''
+Record trajectories to disk in shards, and read them back for offline training.
+
+Each shard holds up to shard_size steps as columns: screen glyph and style planes (see arrays.py),
+stats vector, episode, step, action keys, reward, done and game time.
+
+Two formats:
+  npz - one compressed .npz file per shard. Screens are stored as the XOR with the previous frame
+        in the shard, which is mostly zeros and so compresses very well.
+  npy - one directory per shard with an uncompressed .npy file per column. Screens are stored as is,
+        so shards can be memory-mapped for random access.
+'''
+import logging
+import os
+import queue
+import threading
+import weakref
+
+import gym
+import numpy as np
+
+import gym_crawl.arrays as arrays
+
+logger = logging.getLogger('recorder')
+
+FORMAT_NPZ = 'npz'
+FORMAT_NPY = 'npy'
+
+SCREEN_COLUMNS = ['screen_glyphs', 'screen_styles']
+
+# column -> dtype, for the columns which aren't observation arrays
+STEP_COLUMNS = {
+    'episode': np.int32,
+    'step': np.int64,
+    'action': np.str_,
+    'reward': np.int64,
+    'done': np.bool_,
+    'time': np.float64,
+}
+
+_STOP = None
+
+
+class RecordingEnv(gym.Wrapper):
+    """ Records every reset and step of the wrapped CrawlEnv. Shards are written on a background thread.
+        The last partial shard is written on close, or when the wrapper is garbage collected or the program exits.
+    """
+
+    def __init__(self, env, directory, shard_size=10000, file_format=FORMAT_NPZ, max_queued=1000):
+        super().__init__(env)
+        if file_format not in (FORMAT_NPZ, FORMAT_NPY):
+            raise ValueError('Unknown format: ' + file_format)
+        os.makedirs(directory, exist_ok=True)
+        self.observation = arrays.allocate_observation()
+        self.writer = arrays.ObservationWriter(self.observation)
+        self.shard_writer = ShardWriter(directory, shard_size, file_format)
+        self.queue = queue.Queue(max_queued)
+        # the thread mustn't reference the wrapper, or it would never be collected
+        self.thread = threading.Thread(target=_write_records, args=(self.queue, self.shard_writer))
+        self.thread.daemon = True
+        self.thread.start()
+        self._finalizer = weakref.finalize(self, _stop_writing, self.queue, self.thread)
+        self.episode = 0
+
+    def reset(self, **kwargs):
+        result = self.env.reset(**kwargs)
+        self.episode += 1
+        self.writer.reset()
+        self._record(result, '')
+        return result
+
+    def step(self, action):
+        result = self.env.step(action)
+        self._record(result, self.env.action_to_keys(action))
+        return result
+
+    def close(self):
+        self.env.close()
+        self._finalizer()
+
+    def _record(self, result, keys):
+        game_state, reward, done, screen = result
+        self.writer.write(game_state, screen, self.env.steps)
+        obs = self.observation
+        # copies, because the observation arrays are updated in place
+        self.queue.put((obs['screen_glyphs'].copy(), obs['screen_styles'].copy(), obs['stats'].copy(),
+                        (self.episode, self.env.steps, keys, reward, done, game_state.time)))
+
+
+def _write_records(record_queue, shard_writer):
+    while True:
+        record = record_queue.get()
+        if record is _STOP:
+            break
+        try:
+            shard_writer.add(*record)
+        except Exception:
+            logger.exception('Failed to record step')
+    shard_writer.flush()
+
+
+def _stop_writing(record_queue, thread):
+    """ Write out the steps still queued and the last partial shard """
+    record_queue.put(_STOP)
+    thread.join()
+
+
+class ShardWriter:
+    """ Accumulates steps and writes them out a shard at a time """
+
+    def __init__(self, directory, shard_size=10000, file_format=FORMAT_NPZ):
+        self.directory = directory
+        self.shard_size = shard_size
+        self.file_format = file_format
+        self.num_shards = len(list_shards(directory))
+        self._clear()
+
+    def _clear(self):
+        self.glyphs = []
+        self.styles = []
+        self.stats = []
+        self.steps = []
+
+    def add(self, glyphs, styles, stats, step):
+        self.glyphs.append(glyphs)
+        self.styles.append(styles)
+        self.stats.append(stats)
+        self.steps.append(step)
+        if len(self.steps) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """ Write the steps added so far as a shard """
+        if not self.steps:
+            return
+        columns = {
+            'screen_glyphs': np.stack(self.glyphs),
+            'screen_styles': np.stack(self.styles),
+            'stats': np.stack(self.stats),
+        }
+        for i, (name, dtype) in enumerate(STEP_COLUMNS.items()):
+            columns[name] = np.array([step[i] for step in self.steps], dtype)
+
+        path = os.path.join(self.directory, 'shard-{:05d}'.format(self.num_shards))
+        if self.file_format == FORMAT_NPZ:
+            for name in SCREEN_COLUMNS:
+                columns[name] = delta_encode(columns[name])
+            np.savez_compressed(path + '.tmp.npz', **columns)
+            os.rename(path + '.tmp.npz', path + '.npz')
+        else:
+            os.makedirs(path + '.tmp', exist_ok=True)
+            for name, column in columns.items():
+                np.save(os.path.join(path + '.tmp', name + '.npy'), column)
+            os.rename(path + '.tmp', path)
+        logger.info('Wrote shard {} ({} steps)'.format(path, len(self.steps)))
+        self.num_shards += 1
+        self._clear()
+
+
+def delta_encode(frames):
+    """ XOR each frame with the one before it (the first frame is kept as is) """
+    result = frames.copy()
+    np.bitwise_xor(frames[1:], frames[:-1], out=result[1:])
+    return result
+
+
+def delta_decode(deltas):
+    return np.bitwise_xor.accumulate(deltas, axis=0)
+
+
+def list_shards(directory):
+    """ Paths of the complete shards in directory, in the order they were written """
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if name.startswith('shard-') and '.tmp' not in name)
+    return [os.path.join(directory, name) for name in names]
+
+
+def load_shard(path, mmap=False):
+    """ Load a shard as a dict of column name -> array. npy shards can be memory-mapped """
+    if path.endswith('.npz'):
+        with np.load(path) as data:
+            columns = {name: data[name] for name in data.files}
+        for name in SCREEN_COLUMNS:
+            columns[name] = delta_decode(columns[name])
+        return columns
+    mmap_mode = 'r' if mmap else None
+    return {name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+            for name in os.listdir(path) if name.endswith('.npy')}
+
+
+def read_shards(directory, mmap=False):
+    """ Generate the shards in directory, one at a time """
+    for path in list_shards(directory):
+        yield load_shard(path, mmap)
+
+
+def read_steps(directory):
+    """ Generate the recorded steps one at a time, as dicts of column name -> value """
+    for columns in read_shards(directory, mmap=True):
+        names = list(columns)
+        for i in range(len(columns['step'])):
+            yield {name: columns[name][i] for name in names}
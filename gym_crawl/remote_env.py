@@ -0,0 +1,83 @@
+'''
+Client for a crawl environment hosted by gym_crawl.server
+'''
+import copy
+import logging
+import socket
+
+import gym
+from gym import spaces
+
+from gym_crawl.gamestate import GameState
+import gym_crawl.protocol as protocol
+import gym_crawl.terminal_parser as parser
+
+logger = logging.getLogger('remote-env')
+
+
+class RemoteCrawlEnv(gym.Env):
+    """ Looks like a CrawlEnv, but the game runs in a server process, possibly on another host.
+        Observations are the same (game state, reward, done, screen), except the map is extracted
+        from the screen on the client side, and inventory items and nearby monsters aren't sent.
+    """
+    metadata = {'render.modes': ['human']}
+
+    def __init__(self, address, character_name='', action_keys=None):
+        """ address is a (host, port) tuple for TCP, or a path for a Unix socket.
+            character_name defaults to a name unique to the server.
+        """
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self.file = self.sock.makefile('rwb')
+
+        payload = self._request(protocol.MSG_MAKE, protocol.pack_make(character_name, action_keys or []),
+                                protocol.MSG_MADE)
+        self.env_id, num_actions = protocol.unpack_made(payload)
+        self.action_space = spaces.Discrete(num_actions)
+        self.decoder = protocol.ScreenDecoder()
+        self.game_state = GameState()
+
+    def reset(self):
+        self.game_state = GameState()
+        return self._observe(protocol.MSG_RESET, protocol.pack_env_id(self.env_id))
+
+    def step(self, action):
+        return self._observe(protocol.MSG_STEP, protocol.pack_step(self.env_id, int(action)))
+
+    def render(self, mode='human'):
+        self.decoder.screen.render(1, 1)
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self._request(protocol.MSG_CLOSE, protocol.pack_env_id(self.env_id), protocol.MSG_OK)
+        except (EOFError, ConnectionError, protocol.ProtocolError) as e:
+            logger.info('Error closing remote env: ' + str(e))
+        self.file.close()
+        self.sock.close()
+        self.file = None
+
+    def _observe(self, msg_type, payload):
+        payload = self._request(msg_type, payload, protocol.MSG_OBSERVATION)
+        # the map is only extracted on the main screen, so carry it over from the previous state
+        game_state = copy.deepcopy(self.game_state)
+        game_state, reward, done = protocol.unpack_observation(payload, self.decoder, game_state)
+        screen = self.decoder.screen
+        game_state.screen = screen.snapshot()
+        parser.update_map(game_state.screen, game_state)
+        self.game_state = game_state
+        return game_state, reward, done, screen
+
+    def _request(self, msg_type, payload, reply_type):
+        protocol.write_message(self.file, msg_type, payload)
+        msg_type, payload = protocol.read_message(self.file)
+        if msg_type == protocol.MSG_ERROR:
+            raise protocol.ProtocolError('Server error: ' + protocol.unpack_string(payload, 0)[0])
+        if msg_type != reply_type:
+            raise protocol.ProtocolError('Unexpected reply: {}'.format(msg_type))
+        return payload
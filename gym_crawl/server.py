@@ -0,0 +1,112 @@
+'''
+Server hosting crawl environments for remote agents (see protocol.py and remote_env.py)
+'''
+import logging
+import socket
+import socketserver
+import threading
+
+from gym_crawl.envs.crawl_env import CrawlEnv
+import gym_crawl.protocol as protocol
+
+logger = logging.getLogger('crawl-server')
+
+
+class EnvRequestHandler(socketserver.StreamRequestHandler):
+    """ Serves one connection. Environments made on a connection are closed when it ends """
+
+    def setup(self):
+        super().setup()
+        if self.request.family in (socket.AF_INET, socket.AF_INET6):
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.envs = {} # env id -> (env, screen encoder)
+
+    def handle(self):
+        while True:
+            try:
+                msg_type, payload = protocol.read_message(self.rfile)
+            except (EOFError, ConnectionError):
+                return
+            try:
+                reply_type, reply = self._handle_message(msg_type, payload)
+            except Exception as e:
+                logger.exception('Error handling message {}'.format(msg_type))
+                reply_type, reply = protocol.MSG_ERROR, protocol.pack_string(str(e))
+            protocol.write_message(self.wfile, reply_type, reply)
+
+    def finish(self):
+        for env, _ in self.envs.values():
+            env.close()
+        self.envs = {}
+        super().finish()
+
+    def _handle_message(self, msg_type, payload):
+        if msg_type == protocol.MSG_MAKE:
+            character_name, action_keys = protocol.unpack_make(payload)
+            env_id = self.server.next_env_id()
+            env = CrawlEnv()
+            env.set_character_name(character_name or 'Bot{}'.format(env_id))
+            if action_keys:
+                env.set_action_keys(action_keys)
+            self.envs[env_id] = (env, protocol.ScreenEncoder(env.SCREEN_ROWS, env.SCREEN_COLS))
+            logger.info('Made env {}'.format(env_id))
+            return protocol.MSG_MADE, protocol.pack_made(env_id, env.action_space.n)
+
+        elif msg_type == protocol.MSG_RESET:
+            env, encoder = self._get_env(protocol.unpack_env_id(payload))
+            game_state, reward, done, screen = env.reset()
+            encoder.reset()
+            return protocol.MSG_OBSERVATION, protocol.pack_observation(game_state, reward, done, encoder, screen)
+
+        elif msg_type == protocol.MSG_STEP:
+            env_id, action = protocol.unpack_step(payload)
+            env, encoder = self._get_env(env_id)
+            game_state, reward, done, screen = env.step(action)
+            return protocol.MSG_OBSERVATION, protocol.pack_observation(game_state, reward, done, encoder, screen)
+
+        elif msg_type == protocol.MSG_CLOSE:
+            env_id = protocol.unpack_env_id(payload)
+            env, _ = self._get_env(env_id)
+            env.close()
+            del self.envs[env_id]
+            return protocol.MSG_OK, b''
+
+        raise protocol.ProtocolError('Unknown message type: {}'.format(msg_type))
+
+    def _get_env(self, env_id):
+        if env_id not in self.envs:
+            raise protocol.ProtocolError('Unknown env: {}'.format(env_id))
+        return self.envs[env_id]
+
+
+class _EnvServerMixin:
+    daemon_threads = True
+
+    def next_env_id(self):
+        with self.env_id_lock:
+            self.last_env_id += 1
+            return self.last_env_id
+
+
+class TCPEnvServer(_EnvServerMixin, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class UnixEnvServer(_EnvServerMixin, socketserver.ThreadingUnixStreamServer):
+        pass
+
+
+def create_server(address):
+    """ Create a server listening on address: a (host, port) tuple for TCP, or a path for a Unix socket.
+        Each connection gets its own thread, and environments are stepped on their connection's thread.
+        State shared by envs in the process (parse caches, tracer, queue logging) is locked where it's updated.
+        There is no authentication, so only listen on addresses reachable from trusted machines.
+    """
+    if isinstance(address, str):
+        server = UnixEnvServer(address, EnvRequestHandler)
+    else:
+        server = TCPEnvServer(address, EnvRequestHandler)
+    server.env_id_lock = threading.Lock()
+    server.last_env_id = 0
+    return server
@@ -0,0 +1,83 @@
+'''
+Game startup. Character options are normally given on crawl's command line so no menus appear,
+but any character creation screens which do show up are answered by a state machine keyed on screen signatures.
+'''
+import logging
+import re
+import time
+
+import gym_crawl.terminal_parser as parser
+
+logger = logging.getLogger('startup')
+
+# startup states
+STATE_WAITING = 'waiting'          # nothing recognisable on screen yet
+STATE_SPECIES = 'species'          # species menu
+STATE_BACKGROUND = 'background'    # background menu
+STATE_WEAPON = 'weapon'            # weapon menu
+STATE_STARTED = 'started'          # game screen
+
+# text which identifies a startup screen (checked in order)
+STARTUP_SIGNATURES = [
+    (STATE_STARTED, re.compile(r'Found a staircase leading out of the dungeon')),
+    (STATE_WEAPON, re.compile(r'You have a choice of weapons')),
+    (STATE_BACKGROUND, re.compile(r'Please select your background')),
+    (STATE_SPECIES, re.compile(r'Please select your species')),
+]
+
+
+def find_menu_letter(text, name):
+    """ Find the letter of a menu item (e.g. "c - hand axe") by name, ignoring case """
+    match = re.search(r'\b([a-zA-Z]) - ' + re.escape(name) + r'\b', text, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def startup_args(species, background, weapon):
+    """ crawl command line arguments which choose the character, so no menus appear """
+    args = ['-species', species, '-background', background]
+    if weapon:
+        args += ['-extra-opt-last', 'weapon=' + weapon]
+    return args
+
+
+class StartupMachine:
+    """ Works out what the startup screen is and what to send. Time spent in each state is recorded in timings """
+
+    def __init__(self, species, background, weapon):
+        self.choices = {STATE_SPECIES: species, STATE_BACKGROUND: background, STATE_WEAPON: weapon}
+        self.state = STATE_WAITING
+        self.state_start_time = time.perf_counter()
+        self.timings = [] # (state, seconds)
+        self.answered = None # state whose menu has been answered
+        self.error = None
+
+    def update(self, screen):
+        """ Look at the latest frame. Returns the keys to send (possibly empty) """
+        text = screen.to_string()
+        state = STATE_WAITING
+        for signature_state, pattern in STARTUP_SIGNATURES:
+            if pattern.search(text):
+                state = signature_state
+                break
+        if state == STATE_WAITING and parser.is_main_screen(screen):
+            state = STATE_STARTED
+
+        if state != self.state:
+            now = time.perf_counter()
+            self.timings.append((self.state, now - self.state_start_time))
+            logger.debug('Startup: {} -> {}'.format(self.state, state))
+            self.state = state
+            self.state_start_time = now
+
+        if state in self.choices and state != self.answered:
+            self.answered = state
+            choice = self.choices[state]
+            letter = find_menu_letter(text, choice) if choice else None
+            if letter is None:
+                self.error = 'no {} menu item for {}'.format(state, choice)
+                return ''
+            return letter
+        return ''
+
+    def is_started(self):
+        return self.state == STATE_STARTED
@@ -0,0 +1,181 @@
+'''
+Structured game state side-channel, written by a Lua hook in crawl (see state_hook.rc)
+
+A record is a single line of key=value fields separated by '|', e.g.
+seq=12|turn=40|time=41.5|hp=18|max_hp=18|mp=1|max_mp=1|str=21|int=7|dex=10|ac=3|ev=9|sh=0|xl=1|next=20|place=D:1|inv=abr|mons=rat@1,-2;jackal@0,3
+'''
+import logging
+import os
+
+logger = logging.getLogger('state-channel')
+
+STATE_FILENAME = 'gym-state.txt'
+
+# file containing the Lua hook, to be appended to crawlrc
+HOOK_RC_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state_hook.rc')
+
+# branch abbreviations, as in the hook's place (from you.where()), and the names the stats panel shows instead
+BRANCH_NAMES = {
+    'D': 'Dungeon',
+    'Temple': 'Ecumenical Temple',
+    'Orc': 'Orcish Mines',
+    'Elf': 'Elven Halls',
+    'Lair': 'Lair of Beasts',
+    'Swamp': 'Swamp',
+    'Shoals': 'Shoals',
+    'Snake': 'Snake Pit',
+    'Spider': 'Spider Nest',
+    'Slime': 'Slime Pits',
+    'Vaults': 'Vaults',
+    'Crypt': 'Crypt',
+    'Tomb': 'Tomb of the Ancients',
+    'Depths': 'Depths',
+    'Zot': 'Realm of Zot',
+    'Hell': 'Vestibule of Hell',
+    'Dis': 'Iron City of Dis',
+    'Geh': 'Gehenna',
+    'Coc': 'Cocytus',
+    'Tar': 'Tartarus',
+    'Abyss': 'Abyss',
+    'Pan': 'Pandemonium',
+    'Zig': 'Ziggurat',
+    'Lab': 'Labyrinth',
+    'Bazaar': 'Bazaar',
+    'Trove': 'Treasure Trove',
+    'Sewer': 'Sewer',
+    'Ossuary': 'Ossuary',
+    'Bailey': 'Bailey',
+    'IceCv': 'Ice Cave',
+    'Volcano': 'Volcano',
+    'WizLab': "Wizard's Laboratory",
+    'Desolation': 'Desolation of Salt',
+    'Gauntlet': 'Gauntlet',
+}
+
+
+def panel_place(place):
+    """ Convert a place like D:1 to the form the stats panel shows (Dungeon:1), so it's the same either way """
+    branch, sep, depth = place.partition(':')
+    return BRANCH_NAMES.get(branch, branch) + sep + depth
+
+
+# record fields which map directly to game state attributes: field -> (attribute, conversion)
+GAME_STATE_FIELDS = {
+    'turn': ('turn', int),
+    'time': ('time', float),
+    'hp': ('hp', int),
+    'max_hp': ('max_hp', int),
+    'mp': ('mp', int),
+    'max_mp': ('max_mp', int),
+    'str': ('str', int),
+    'int': ('int', int),
+    'dex': ('dex', int),
+    'ac': ('ac', int),
+    'ev': ('ev', int),
+    'sh': ('sh', int),
+    'xl': ('xl', int),
+    'next': ('pcnt_next_xl', int),
+    'place': ('place', panel_place),
+    'inv': ('inventory_letters', str),
+}
+
+
+def format_state_record(values):
+    """ Format a dict of field values as a record line. monsters is a list of (name, x, y) """
+    fields = []
+    for key, value in values.items():
+        if key == 'mons':
+            value = ';'.join('{}@{},{}'.format(name, x, y) for name, x, y in value)
+        fields.append('{}={}'.format(key, value))
+    return '|'.join(fields) + '\n'
+
+
+def write_state_record(directory, values):
+    """ Write a record the way the Lua hook does (to a temporary file, then renamed), e.g. to stand in for crawl """
+    path = os.path.join(directory, STATE_FILENAME)
+    with open(path + '.tmp', 'w') as f:
+        f.write(format_state_record(values))
+    os.replace(path + '.tmp', path)
+
+
+def parse_state_record(line):
+    """ Parse a record line into a dict of field values, or None if it isn't valid """
+    record = {}
+    for field in line.strip().split('|'):
+        key, sep, value = field.partition('=')
+        if not sep:
+            return None
+        if key == 'mons':
+            monsters = []
+            for monster in value.split(';') if value else []:
+                name, _, pos = monster.partition('@')
+                x, _, y = pos.partition(',')
+                monsters.append((name, int(x), int(y)))
+            record[key] = monsters
+        elif key in GAME_STATE_FIELDS:
+            record[key] = GAME_STATE_FIELDS[key][1](value)
+        else:
+            record[key] = value
+    return record
+
+
+def apply_state_record(record, game_state):
+    """ Update the game state from a record """
+    for key, value in record.items():
+        if key in GAME_STATE_FIELDS:
+            setattr(game_state, GAME_STATE_FIELDS[key][0], value)
+    if 'mons' in record:
+        game_state.monsters = record['mons']
+    if not game_state.started and game_state.max_hp != 0:
+        game_state.started = True
+
+
+def write_hook_rc(base_rc_file, output_file):
+    """ Write an rc file consisting of the base rc file plus the state hook """
+    with open(base_rc_file) as f:
+        base_rc = f.read()
+    with open(HOOK_RC_FILE) as f:
+        hook_rc = f.read()
+    with open(output_file, 'w') as f:
+        f.write(base_rc)
+        f.write('\n')
+        f.write(hook_rc)
+
+
+class StateChannel:
+    """ Reads records written by the crawl Lua hook """
+
+    def __init__(self, directory='.'):
+        self.path = os.path.join(directory, STATE_FILENAME)
+        self.last_file_id = None
+        self.last_seq = None
+
+    def clear(self):
+        """ Remove any record left over from a previous game """
+        self.last_file_id = None
+        self.last_seq = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def read(self):
+        """ Get the latest record, or None if there isn't one newer than the last one read """
+        try:
+            # each record is written to a new file, so this identifies the record
+            stat = os.stat(self.path)
+            file_id = (stat.st_ino, stat.st_mtime_ns)
+            if file_id == self.last_file_id:
+                return None
+            with open(self.path) as f:
+                line = f.readline()
+        except OSError:
+            return None
+        try:
+            record = parse_state_record(line)
+        except ValueError:
+            logger.warning('Invalid state record: ' + line)
+            return None
+        if record is None or record.get('seq') == self.last_seq:
+            return None
+        self.last_file_id = file_id
+        self.last_seq = record.get('seq')
+        return record
@@ -0,0 +1,201 @@
+'''
+Seeded generator of synthetic DCSS-like terminal output, for benchmarking the terminal capture/parser
+'''
+import random
+
+from gym_crawl.chars import ESC
+from gym_crawl.terminal_parser import MAP_END_ROW, MAP_END_COL, STATS_START_COL
+
+# glyphs commonly seen on the DCSS map
+MAP_GLYPHS = '#.......,+\\^<>_8)[/%?=!(:|}$"' + '▓♣≈§†'
+MONSTER_GLYPHS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+FG_CODES = [30, 31, 32, 33, 34, 35, 36, 37, 39, 90, 91, 92, 93, 94, 95, 96, 97]
+BG_CODES = [40, 41, 42, 43, 44, 45, 46, 47, 49]
+
+MESSAGES = [
+    'You hit the rat.',
+    'The jackal bites you.',
+    'You kill the goblin!',
+    'There is a stone staircase leading down here.',
+    'You see here a +0 hand axe.',
+    'Found a staircase leading out of the dungeon.',
+    'You pick up 14 gold pieces.',
+    'You start resting.',
+    'Done exploring.',
+    'r - 2 bread rations',
+]
+
+# first row of message area (0-based)
+MESSAGE_START_ROW = 17
+
+# worst case input kinds
+WORST_CASE_KINDS = ['text', 'sgr', 'cup', 'scroll', 'long-csi', 'long-cup', 'long-region', 'unterminated']
+
+
+def cup(row, col):
+    """ Cursor position escape sequence (0-based row and col) """
+    return '{}[{};{}H'.format(ESC, row+1, col+1)
+
+
+def sgr(*codes):
+    """ Select graphic rendition escape sequence """
+    return '{}[{}m'.format(ESC, ';'.join(str(code) for code in codes))
+
+
+class StreamGenerator:
+    """ Produces realistic DCSS-like output streams from a seeded RNG """
+
+    def __init__(self, seed=0, rows=24, cols=80):
+        self.rng = random.Random(seed)
+        self.rows = rows
+        self.cols = cols
+        self.time = 0.0
+        self.hp = 18
+
+    def _random_sgr(self):
+        rng = self.rng
+        if rng.random() < 0.3:
+            # bold is only combined with the 8 normal intensity colours
+            return sgr(0, 1, rng.randint(30, 37))
+        return sgr(0, rng.choice(FG_CODES), rng.choice(BG_CODES))
+
+    def map_row(self, row):
+        """ One map row with a colour change before most glyphs """
+        rng = self.rng
+        parts = [cup(row, 0)]
+        for col in range(MAP_END_COL + 1):
+            if rng.random() < 0.7:
+                parts.append(self._random_sgr())
+            if rng.random() < 0.05:
+                parts.append(rng.choice(MONSTER_GLYPHS))
+            else:
+                parts.append(rng.choice(MAP_GLYPHS))
+        return ''.join(parts)
+
+    def map_rows(self):
+        """ Redraw of the whole map area """
+        return ''.join(self.map_row(row) for row in range(MAP_END_ROW + 1))
+
+    def stats_panel(self):
+        """ Stats panel in the layout used by DCSS """
+        self.time += self.rng.choice([1.0, 1.0, 1.0, 0.5, 10.0])
+        self.hp = max(1, min(18, self.hp + self.rng.randint(-3, 2)))
+        lines = [
+            'Bot the Skirmisher',
+            'Minotaur',
+            'Health: {}/18    ========'.format(self.hp),
+            'Magic:  1/1      ========',
+            'AC:  3    Str: 21',
+            'EV:  9    Int:  7',
+            'SH:  0    Dex: 10',
+            'XL:  1 Next:  {}% Place: Dungeon:1'.format(self.rng.randint(0, 99)),
+            'Noise: {}   Time: {:.1f} (1.0)'.format('=' * self.rng.randint(0, 9), self.time),
+        ]
+        parts = []
+        for row, line in enumerate(lines):
+            parts.append(cup(row, STATS_START_COL))
+            parts.append(sgr(0, self.rng.choice(FG_CODES)))
+            parts.append(line)
+            parts.append(ESC + '[K')
+        return ''.join(parts)
+
+    def full_redraw(self):
+        """ Clear screen followed by a redraw of map, stats and messages """
+        parts = [sgr(0), ESC + '[2J', self.map_rows(), self.stats_panel()]
+        for row in range(MESSAGE_START_ROW, self.rows):
+            parts.append(cup(row, 0))
+            parts.append(self.rng.choice(MESSAGES))
+        parts.append(cup(MAP_END_ROW // 2, MAP_END_COL // 2))
+        return ''.join(parts)
+
+    def message_spam(self, count=10):
+        """ Messages written to the bottom of a scroll region, scrolling it up """
+        parts = [ESC + '[{};{}r'.format(MESSAGE_START_ROW + 1, self.rows), cup(self.rows - 1, 0)]
+        for _ in range(count):
+            parts.append(sgr(0, self.rng.choice(FG_CODES)))
+            parts.append(self.rng.choice(MESSAGES))
+            parts.append(ESC + '[K\r\n')
+        parts.append(ESC + '[r')
+        return ''.join(parts)
+
+    def cup_storm(self, count=200):
+        """ Lots of single glyph updates at random positions """
+        rng = self.rng
+        parts = []
+        for _ in range(count):
+            parts.append(cup(rng.randrange(self.rows), rng.randrange(self.cols)))
+            if rng.random() < 0.5:
+                parts.append(self._random_sgr())
+            parts.append(rng.choice(MAP_GLYPHS))
+        return ''.join(parts)
+
+    def edits(self, count=50):
+        """ Delete (CSI P) and erase (CSI X) character edits """
+        rng = self.rng
+        parts = []
+        for _ in range(count):
+            parts.append(cup(rng.randrange(self.rows), rng.randrange(self.cols)))
+            parts.append(ESC + '[{}{}'.format(rng.randint(1, 20), rng.choice('PX')))
+            parts.append(rng.choice(MESSAGES)[:rng.randint(1, 20)])
+        return ''.join(parts)
+
+    def frame(self):
+        """ A single step's worth of output, mostly the kind seen after a move """
+        rng = self.rng
+        r = rng.random()
+        if r < 0.05:
+            data = self.full_redraw()
+        elif r < 0.75:
+            data = self.map_rows() + self.stats_panel()
+            if rng.random() < 0.4:
+                data += self.message_spam(rng.randint(1, 3))
+        elif r < 0.85:
+            data = self.message_spam(rng.randint(5, 30))
+        elif r < 0.95:
+            data = self.cup_storm(rng.randint(50, 400))
+        else:
+            data = self.edits(rng.randint(10, 80))
+        # crawl leaves the cursor on the @
+        return data + cup(MAP_END_ROW // 2, MAP_END_COL // 2)
+
+    def frames(self, count):
+        """ Generate count frames, starting with a full redraw """
+        yield self.full_redraw()
+        for _ in range(count - 1):
+            yield self.frame()
+
+    def worst_case(self, kind, size):
+        """ A single pathological chunk of approximately size chars """
+        rng = self.rng
+        if kind == 'text':
+            # one long run of printable chars with line wrap on
+            return ESC + '[=7h' + ''.join(rng.choice(MAP_GLYPHS) for _ in range(size))
+        elif kind == 'sgr':
+            # one SGR with an enormous parameter list
+            return ESC + '[' + ';'.join(str(rng.choice(FG_CODES)) for _ in range(size // 3)) + 'm'
+        elif kind == 'cup':
+            parts = []
+            length = 0
+            while length < size:
+                part = cup(rng.randrange(self.rows), rng.randrange(self.cols)) + 'x'
+                parts.append(part)
+                length += len(part)
+            return ''.join(parts)
+        elif kind == 'scroll':
+            # newlines at the bottom of a scroll region
+            return ESC + '[18;24r' + cup(self.rows - 1, 0) + 'a\n' * (size // 2)
+        elif kind == 'long-csi':
+            # CSI sequence with a huge numeric parameter
+            return ESC + '[' + '9' * (size - 3) + 'C'
+        elif kind == 'long-cup':
+            # cursor position with huge row and column parameters
+            return ESC + '[' + '9' * ((size - 4) // 2) + ';' + '9' * ((size - 4) // 2) + 'H'
+        elif kind == 'long-region':
+            # scroll region with huge top and bottom parameters
+            return ESC + '[' + '9' * ((size - 4) // 2) + ';' + '9' * ((size - 4) // 2) + 'r'
+        elif kind == 'unterminated':
+            # CSI sequence which never gets a final byte
+            return ESC + '[' + '1;' * (size // 2)
+        else:
+            raise ValueError('Unknown worst case kind: ' + kind)
@@ -0,0 +1,133 @@
+'''
+Supervision of a crawl child process: stderr draining, CPU/memory accounting and hang detection
+'''
+from collections import deque
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('supervisor')
+
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = None
+    _PAGE_SIZE = None
+
+
+def read_proc_stats(pid):
+    """ Get (cpu seconds, resident bytes) of a process from /proc, or None if not available """
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            stat = f.read()
+        with open('/proc/{}/statm'.format(pid)) as f:
+            statm = f.read()
+    except OSError:
+        return None
+    # the command name is in brackets and may contain spaces, so split after it
+    fields = stat[stat.rindex(')') + 2:].split()
+    utime = int(fields[11])
+    stime = int(fields[12])
+    rss_pages = int(statm.split()[1])
+    return (utime + stime) / _CLOCK_TICKS, rss_pages * _PAGE_SIZE
+
+
+class ProcessSupervisor:
+    """ Watches a crawl process. Some input (e.g. ESC on the main screen) gets no output from a healthy crawl,
+        so after hang_timeout seconds without output, probe (if given) is called to send input which must be
+        answered, like a redraw request. The process is hung if that gets no output for hang_timeout seconds
+        either (or, with no probe, straight away).
+    """
+
+    def __init__(self, process, hang_timeout=30.0, stderr_lines=100, probe=None):
+        self.process = process
+        self.hang_timeout = hang_timeout
+        self.probe = probe
+        self.probe_sent = False
+        self.stderr_tail = deque(maxlen=stderr_lines)
+        self.last_input_time = None
+        self.last_output_time = time.perf_counter()
+        self.start_time = time.perf_counter()
+        self.last_sample = None # (time, cpu seconds)
+        self.thread = None
+        if process.stderr is not None:
+            self.thread = threading.Thread(target=self._drain_stderr)
+            self.thread.daemon = True # thread dies with the program
+            self.thread.start()
+
+    def _drain_stderr(self):
+        # crawl can block if the stderr pipe fills up, so keep reading it
+        try:
+            for line in iter(self.process.stderr.readline, ''):
+                line = line.rstrip()
+                if line:
+                    logger.debug('crawl stderr: ' + line)
+                    self.stderr_tail.append(line)
+        except (OSError, ValueError):
+            pass
+
+    def set_affinity(self, cpus):
+        """ Restrict the process to a set of CPUs (Linux only) """
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(self.process.pid, cpus)
+        else:
+            logger.warning('CPU affinity is not supported on this platform')
+
+    def set_nice(self, nice):
+        """ Set the scheduling priority of the process """
+        if hasattr(os, 'setpriority'):
+            os.setpriority(os.PRIO_PROCESS, self.process.pid, nice)
+        else:
+            logger.warning('Setting priority is not supported on this platform')
+
+    def note_input(self):
+        # hangs are timed from the first input which hasn't had a response
+        if self.last_input_time is None or self.last_input_time <= self.last_output_time:
+            self.last_input_time = time.perf_counter()
+
+    def note_output(self, now):
+        self.last_output_time = now
+        self.probe_sent = False
+
+    def check(self):
+        """ Get the reason the process is unhealthy, or None if it's OK """
+        code = self.process.poll()
+        if code is not None:
+            return 'crawl exited with code {}'.format(code)
+        if self.last_input_time is not None and self.last_input_time > self.last_output_time:
+            waiting = time.perf_counter() - self.last_input_time
+            if waiting >= self.hang_timeout:
+                if self.probe is None or self.probe_sent:
+                    return 'crawl hung: no output for {:.1f} seconds'.format(time.perf_counter() - self.last_output_time)
+                # the input may not have needed an answer, so time the hang from one which does
+                logger.info('No output for {:.1f} seconds, probing crawl'.format(waiting))
+                self.probe_sent = True
+                self.probe()
+                self.last_input_time = time.perf_counter()
+        return None
+
+    def kill(self):
+        if self.process.poll() is None:
+            logger.info('Killing crawl process {}'.format(self.process.pid))
+            self.process.kill()
+
+    def sample(self):
+        """ Get CPU and memory usage, including CPU percentage since the last sample """
+        result = {'pid': self.process.pid, 'uptime': time.perf_counter() - self.start_time}
+        stats = read_proc_stats(self.process.pid)
+        if stats is not None:
+            now = time.perf_counter()
+            cpu_seconds, rss_bytes = stats
+            result['cpu_seconds'] = cpu_seconds
+            result['rss_bytes'] = rss_bytes
+            if self.last_sample is not None and now > self.last_sample[0]:
+                result['cpu_percent'] = 100.0 * (cpu_seconds - self.last_sample[1]) / (now - self.last_sample[0])
+            self.last_sample = (now, cpu_seconds)
+        return result
+
+    def get_stderr(self):
+        return list(self.stderr_tail)
@@ -0,0 +1,72 @@
+'''
+Terminal profiles for running crawl: which TERM (and terminfo) it draws with, and pseudo-terminal setup.
+
+The TERM decides the escape sequences curses uses, and so the bytes per frame and the parse work.
+The bundled crawl-gym profile only has sequences the terminal capture handles cheaply.
+'''
+import atexit
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+
+TERMINFO_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crawl-gym.terminfo')
+
+# profile name -> TERM (None keeps the parent's TERM)
+TERM_PROFILES = {
+    'inherit': None,
+    'xterm': 'xterm',
+    'linux': 'linux',
+    'crawl-gym': 'crawl-gym', # bundled, see crawl-gym.terminfo
+}
+
+# profiles whose terminfo is bundled rather than installed
+BUNDLED_PROFILES = {'crawl-gym'}
+
+_terminfo_dir = None
+
+
+def compile_terminfo():
+    """ Compile the bundled terminfo (once per process). Returns the directory to use as TERMINFO """
+    global _terminfo_dir
+    if _terminfo_dir is None:
+        if shutil.which('tic') is None:
+            raise RuntimeError('tic is not installed. Try: apt install ncurses-bin')
+        directory = tempfile.mkdtemp(prefix='gym-crawl-terminfo-')
+        atexit.register(shutil.rmtree, directory, True)
+        subprocess.run(['tic', '-x', '-o', directory, TERMINFO_SOURCE], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _terminfo_dir = directory
+    return _terminfo_dir
+
+
+def profile_environment(profile, rows=24, cols=80):
+    """ Environment variables for running crawl with a terminal profile """
+    if profile not in TERM_PROFILES:
+        raise ValueError('Unknown terminal profile: {} (choose from {})'.format(profile, ', '.join(TERM_PROFILES)))
+    env = dict(os.environ)
+    term = TERM_PROFILES[profile]
+    if term is not None:
+        env['TERM'] = term
+    if profile in BUNDLED_PROFILES:
+        env['TERMINFO'] = compile_terminfo()
+    env['LINES'] = str(rows)
+    env['COLUMNS'] = str(cols)
+    return env
+
+
+def open_pty(rows=24, cols=80):
+    """ Open a pseudo-terminal of a fixed size in raw mode (so output isn't translated). Returns (master, slave) fds """
+    # these are Unix only, so the rest of the module can be used without them
+    try:
+        import fcntl
+        import pty
+        import termios
+        import tty
+    except ImportError:
+        raise RuntimeError('Pseudo-terminals are not supported on this platform')
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    fcntl.ioctl(slave, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+    return master, slave
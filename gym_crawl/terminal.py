@@ -1,6 +1,7 @@
 '''
 Representation of ANSI terminal
 '''
+from operator import attrgetter
 import sys
 from gym_crawl.chars import ESC
 
@@ -48,14 +49,51 @@ ESC_FONT_NORMAL = ESC + '[0m'
 ESC_GOTO_NEXT_LINE = ESC + '[E'
 
 
+# Zobrist-style hashing of screen contents.
+# Each cell has a random key derived from its contents. A row's hash is the XOR of its cells' keys,
+# each scrambled by a per-column key, so writing a cell only needs the old and new cell keys.
+# The screen hash combines the row hashes with per-row keys, so scrolling just moves row hashes.
+HASH_MASK = (1 << 64) - 1
+
+def _mix(value):
+    """ splitmix64 finaliser - gives stable pseudo-random 64 bit keys """
+    value = (value + 0x9e3779b97f4a7c15) & HASH_MASK
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & HASH_MASK
+    return value ^ (value >> 31)
+
+# keys are odd so multiplying by them doesn't lose information
+COL_KEYS = [_mix(0x100000 + col) | 1 for col in range(256)]
+ROW_KEYS = [_mix(0x200000 + row) | 1 for row in range(256)]
+BOLD_KEY = _mix(0x300000)
+
+def cell_key(glyph, fg_color, bg_color, bold):
+    """ Hash key for the contents of a cell """
+    key = _mix(ord(glyph)) ^ _mix(0x400000 + fg_color) ^ _mix(0x500000 + bg_color)
+    return key ^ BOLD_KEY if bold else key
+
+
 class Cell:
-    """ Representation of a single location on the terminal screen"""
-    
-    def __init__(self):
-        self.glyph = ' '
-        self.fg_color = FG_COLOR_DEFAULT
-        self.bg_color = BG_COLOR_BLACK
-        self.bold = False
+    """ Representation of a single location on the terminal screen.
+        Cells are shared between screen locations, so must not be modified once they are on a screen.
+    """
+    __slots__ = ('glyph', 'fg_color', 'bg_color', 'bold', 'key')
+
+    def __init__(self, glyph = ' ', fg_color = FG_COLOR_DEFAULT, bg_color = BG_COLOR_BLACK, bold = False):
+        self.glyph = glyph
+        self.fg_color = fg_color
+        self.bg_color = bg_color
+        self.bold = bold
+        self.key = cell_key(glyph, fg_color, bg_color, bold)
+
+
+BLANK_CELL = Cell()
+
+_cell_key = attrgetter('key')
+
+# (row hash, start col, end col) -> hash of that part of the row, see Screen.block_hash
+_part_hashes = {}
+MAX_PART_HASHES = 65536
 
 
 class Screen:
@@ -65,19 +103,115 @@ class Screen:
         self.rows = rows
         self.cols = cols
         self.cells = None
+        self.row_hashes = None
+        self.blank_row_hash = self.line_hash([BLANK_CELL] * cols)
         self.clear()
         
     def clear(self):
-        self.cells = []
-        for row in range(self.rows):
-            self.cells.append([Cell() for _ in range(self.cols)])
+        self.cells = [self.new_line() for _ in range(self.rows)]
+        self.row_hashes = [self.blank_row_hash] * self.rows
 
     def clear_line(self, row):
-        self.cells[row] = [Cell() for _ in range(self.cols)]
+        self.cells[row] = self.new_line()
+        self.row_hashes[row] = self.blank_row_hash
+
+    def new_line(self, cell = BLANK_CELL):
+        return [cell] * self.cols
 
     def get(self, row, col):
         return self.cells[row][col]
 
+    def snapshot(self):
+        """ Copy of the screen which won't change as the terminal is updated (cells are shared, lines are copied) """
+        result = Screen.__new__(Screen)
+        result.rows = self.rows
+        result.cols = self.cols
+        result.blank_row_hash = self.blank_row_hash
+        result.cells = [list(line) for line in self.cells]
+        result.row_hashes = list(self.row_hashes)
+        return result
+
+    def set(self, row, col, cell):
+        """ Put a cell on the screen, keeping the row hash up to date """
+        line = self.cells[row]
+        old = line[col]
+        if old is not cell:
+            line[col] = cell
+            col_key = COL_KEYS[col]
+            self.row_hashes[row] ^= ((col_key * old.key) ^ (col_key * cell.key)) & HASH_MASK
+
+    def set_line(self, row, line):
+        self.cells[row] = line
+        self.row_hashes[row] = self.line_hash(line)
+
+    def scroll(self, start_row, end_row, num = 1):
+        """ Scroll the lines in the region from start_row to end_row (inclusive) up by num lines.
+            Negative num scrolls down. Lines scrolled in are blank.
+        """
+        cells = self.cells
+        row_hashes = self.row_hashes
+        if num > 0:
+            for row in range(start_row, end_row + 1):
+                src = row + num
+                if src <= end_row:
+                    cells[row] = cells[src]
+                    row_hashes[row] = row_hashes[src]
+                else:
+                    cells[row] = self.new_line()
+                    row_hashes[row] = self.blank_row_hash
+        elif num < 0:
+            for row in range(end_row, start_row - 1, -1):
+                src = row + num
+                if src >= start_row:
+                    cells[row] = cells[src]
+                    row_hashes[row] = row_hashes[src]
+                else:
+                    cells[row] = self.new_line()
+                    row_hashes[row] = self.blank_row_hash
+
+    @staticmethod
+    def line_hash(line):
+        """ Calculate the hash of a line of cells from scratch """
+        result = 0
+        for col, cell in enumerate(line):
+            result ^= (COL_KEYS[col] * cell.key) & HASH_MASK
+        return result
+
+    def region_hash(self, start_row = 0, end_row = None):
+        """ Fingerprint of the rows from start_row to end_row (inclusive) """
+        if end_row is None:
+            end_row = self.rows - 1
+        result = 0
+        row_hashes = self.row_hashes
+        for row in range(start_row, end_row + 1):
+            result ^= (ROW_KEYS[row] * row_hashes[row]) & HASH_MASK
+        return result
+
+    def block_hash(self, start_row, end_row, start_col, end_col):
+        """ Fingerprint of the cells in columns start_col to end_col of rows start_row to end_row (inclusive).
+            Only whole rows have hashes kept up to date, so the hash of part of a row is worked out from the cells
+            the first time that row is seen, and remembered by row hash.
+        """
+        if start_col == 0 and end_col == self.cols - 1:
+            return self.region_hash(start_row, end_row)
+        result = 0
+        cells = self.cells
+        row_hashes = self.row_hashes
+        for row in range(start_row, end_row + 1):
+            cache_key = (row_hashes[row], start_col, end_col)
+            part_hash = _part_hashes.get(cache_key)
+            if part_hash is None:
+                if len(_part_hashes) >= MAX_PART_HASHES:
+                    _part_hashes.clear()
+                part_hash = hash(tuple(map(_cell_key, cells[row][start_col:end_col + 1]))) & HASH_MASK
+                _part_hashes[cache_key] = part_hash
+            result ^= (ROW_KEYS[row] * part_hash) & HASH_MASK
+        return result
+
+    def hash(self):
+        """ Fingerprint of the whole screen """
+        return self.region_hash(0, self.rows - 1)
+
     def to_string(self, start_row = 0, start_col = 0, end_row = None, end_col = None):
         """ return screen contents as string """
         if end_row is None:
@@ -0,0 +1,73 @@
+'''
+Interface for terminal emulator backends, so other emulators can be swapped in for TerminalCapture
+and compared on the same input (see check-terminal.py and bench-terminal.py).
+'''
+import importlib
+
+import gym_crawl.arrays as arrays
+
+# backend name -> class, see register_backend
+BACKENDS = {}
+
+DEFAULT_BACKEND = 'capture'
+
+# backends in this package -> the module which registers them, imported when one is first created
+BUILTIN_BACKENDS = {
+    'capture': 'gym_crawl.terminal_capture',
+    'recording': 'gym_crawl.terminal_conformance',
+}
+
+
+class TerminalBackend:
+    """ A terminal emulator which keeps a terminal.Screen up to date from crawl's output.
+        Backends must:
+        - have a screen attribute: a terminal.Screen whose cells are immutable and shared, and whose
+          row_hashes are kept up to date (Screen.set and Screen.set_line do this)
+        - implement feed and cursor
+        Everything else has a default implementation based on the screen.
+    """
+
+    def feed(self, data):
+        """ Handle output (str). An escape sequence may be split across calls """
+        raise NotImplementedError
+
+    def cursor(self):
+        """ Get the cursor position as (row, col), 0-based """
+        raise NotImplementedError
+
+    def take_scroll_events(self):
+        """ Get the (start_row, end_row, num_lines) scrolls since the last call, or [] if the backend
+            doesn't track them (the message log then falls back to comparing the message area)
+        """
+        return []
+
+    def dirty_rows(self, prev_hashes=None):
+        """ Rows which changed since the row hashes were prev_hashes (all rows if None) """
+        if prev_hashes is None:
+            return list(range(self.screen.rows))
+        return [row for row, row_hash in enumerate(self.screen.row_hashes) if row_hash != prev_hashes[row]]
+
+    def read_planes(self, glyphs, styles, prev_hashes=None):
+        """ Write the screen into glyph and style planes (see arrays.write_screen_planes), only updating
+            rows which changed since prev_hashes. Returns the row hashes to pass next time.
+        """
+        return arrays.write_screen_planes(self.screen, glyphs, styles, prev_hashes)
+
+
+def register_backend(name, backend_class):
+    """ Make a backend available by name. backend_class is called with (rows, cols) """
+    BACKENDS[name] = backend_class
+
+
+def import_backends(module_name):
+    """ Import a module which registers backends """
+    importlib.import_module(module_name)
+
+
+def create_backend(name=DEFAULT_BACKEND, rows=24, cols=80):
+    if name in BUILTIN_BACKENDS and name not in BACKENDS:
+        import_backends(BUILTIN_BACKENDS[name])
+    if name not in BACKENDS:
+        names = set(BACKENDS).union(BUILTIN_BACKENDS)
+        raise ValueError('Unknown terminal backend: {} (registered: {})'.format(name, ', '.join(sorted(names))))
+    return BACKENDS[name](rows, cols)
@@ -5,21 +5,45 @@
 import re
 import logging
 
-from gym_crawl.chars import make_printable, ESC, BS, DEL
+from gym_crawl.chars import make_printable, ESC, BS, DEL, SO, SI
 from gym_crawl.terminal import *
+from gym_crawl.terminal_backend import TerminalBackend, register_backend
+import gym_crawl.trace as trace
 
 logger = logging.getLogger('term-capture')
 
 
 CLEAR_SCREEN = ESC_CLEAR_SCREEN[1:]
 
+# an incomplete escape sequence at the end of the data is kept for the next call, up to this length
+MAX_PENDING_ESCAPE = 64
 
+# numeric parameters longer than this are clamped to MAX_PARAMETER
+MAX_PARAMETER_DIGITS = 6
+MAX_PARAMETER = 999999
 
-class TerminalCapture:
+# DEC special graphics character set (ESC(0), used for line drawing
+DEC_SPECIAL_GRAPHICS = {
+    '`': '\u25c6', 'a': '\u2592', 'f': '\u00b0', 'g': '\u00b1', 'j': '\u2518', 'k': '\u2510', 'l': '\u250c',
+    'm': '\u2514', 'n': '\u253c', 'o': '\u23ba', 'p': '\u23bb', 'q': '\u2500', 'r': '\u23bc', 's': '\u23bd',
+    't': '\u251c', 'u': '\u2524', 'v': '\u2534', 'w': '\u252c', 'x': '\u2502', 'y': '\u2264', 'z': '\u2265',
+    '{': '\u03c0', '|': '\u2260', '}': '\u00a3', '~': '\u00b7',
+}
+
+
+def _parameter(digits):
+    """ Convert a numeric parameter, clamping huge ones (int() refuses very long digit strings) """
+    if len(digits) > MAX_PARAMETER_DIGITS:
+        return MAX_PARAMETER
+    return int(digits)
+
+
+class TerminalCapture(TerminalBackend):
 
     def __init__(self, rows = 24, cols = 80):
         logger.debug('__init__')
         self.data = None
+        self.pending = '' # incomplete escape sequence from the end of the last data
         self.screen = Screen(rows, cols)
         self.row = 0
         self.col = 0
@@ -29,13 +53,37 @@ class TerminalCapture:
         self.curr_background_color = BG_COLOR_BLACK
         self.bold = False
         self.line_wrap = False
+        self.insert_mode = False
+        self.charsets = ['B', 'B'] # G0 and G1 character sets
+        self.shifted = False # using G1
+        self.charset_map = None # translation of printed characters for the current character set
+        self.print_special = False # insert mode or a translated character set, so printing takes the slow path
         self.scroll_region_start = 0
         self.scroll_region_end = self.screen.rows - 1
+        self.debug = False
+        self.scroll_events = [] # (start_row, end_row, num_lines) of scrolls since last taken
+        # cells are shared, so cache them by font and glyph
+        self.cell_caches = {}
+        self.cell_cache = None
+        self._update_cell_cache()
+        self.tracer = trace.tracer
+
+    def feed(self, data):
+        self.handle_output(data)
+
+    def cursor(self):
+        return self.row, self.col
 
     def handle_output(self, data):
         # update our internal representation of the screen
         # this is tricky because the raw data contains ASCII control sequences
-        logger.debug('Processing data:\n' + make_printable(data, 80))
+        debug = logger.isEnabledFor(logging.DEBUG)
+        self.debug = debug
+        if debug:
+            logger.debug('Processing data:\n' + make_printable(data, 80))
+        if self.pending:
+            data = self.pending + data
+            self.pending = ''
         self.data = data
         i = 0
         string = ''
@@ -43,16 +91,21 @@ class TerminalCapture:
         string_col = 0
         while i < len(data):
             if data[i] >= ' ' and data[i] != DEL:
-                if logger.isEnabledFor(logging.DEBUG):
+                if debug:
                     if string == '':
                         string_row = self.row
                         string_col = self.col
                     string += data[i]
-                cell = self.screen.get(self.row, self.col)
-                cell.glyph = data[i]
-                cell.fg_color = self.curr_foreground_color
-                cell.bg_color = self.curr_background_color
-                cell.bold = self.bold
+                glyph = data[i]
+                if self.print_special:
+                    if self.charset_map is not None:
+                        glyph = self.charset_map.get(glyph, glyph)
+                    if self.insert_mode:
+                        self._insert_cells(1)
+                cell = self.cell_cache.get(glyph)
+                if cell is None:
+                    cell = self._new_cell(glyph)
+                self.screen.set(self.row, self.col, cell)
                 # move cursor on
                 if self.col == self.screen.cols - 1:
                     if self.line_wrap:
@@ -60,22 +113,33 @@ class TerminalCapture:
                 else:
                     self._set_col(self.col + 1)
             else:
-                if logger.isEnabledFor(logging.DEBUG) and len(string) > 0:
+                if debug and len(string) > 0:
                     logger.debug('Printed "{}" at {:d},{:d}. Cursor now at {:d},{:d}'.format(
                         string, string_row+1, string_col+1, self.row+1, self.col+1))
                     string = ''
             
                 if data[i] == ESC:
                     if i == len(data) - 1:
-                        # ESC is the last char
+                        # ESC is the last char - the rest of the sequence is in the next data
+                        self.pending = ESC
                         break
 
                     # extract the escape sequence
                     j = i + 1
-                    if data[j] == '[' or data[j] == '(':
+                    if data[j] == '(' or data[j] == ')':
+                        # character set designation is always ESC ( X
+                        j += 1
+                        if j >= len(data):
+                            self.pending = data[i:]
+                            break
+                    elif data[j] == '[':
                         j += 1
                         while j < len(data) - 1 and (data[j] < '\x40' or data[j] > '\x7e'):
                             j += 1
+                        if (j >= len(data) or data[j] < '\x40' or data[j] > '\x7e') and len(data) - i <= MAX_PENDING_ESCAPE:
+                            # sequence is split across reads
+                            self.pending = data[i:]
+                            break
                     esc_seq = data[i:j+1]
                     i = j
 
@@ -87,36 +151,44 @@ class TerminalCapture:
                     if self.row < self.scroll_region_end:
                         self.row += 1
                     else:
-                        for row in range(self.scroll_region_start, self.scroll_region_end):
-                            self.screen.cells[row] = self.screen.cells[row+1]
-                        self.screen.cells[self.scroll_region_end] = self._new_line()
-                        logger.debug('LF: Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
-                    logger.debug('LF: Cursor now at {:d},{:d}'.format(self.row+1, self.col+1))
+                        self._scroll(self.scroll_region_start, self.scroll_region_end, 1)
+                        if debug:
+                            logger.debug('LF: Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
+                    if debug:
+                        logger.debug('LF: Cursor now at {:d},{:d}'.format(self.row+1, self.col+1))
                 elif data[i] == '\r':
                     self._set_col(0)
-                    logger.debug('CR: Cursor moved to {:d},{:d}'.format(self.row+1, self.col+1))
+                    if debug:
+                        logger.debug('CR: Cursor moved to {:d},{:d}'.format(self.row+1, self.col+1))
                 elif data[i] == BS:
                     # backspace just moves the cursor left
                     self._set_col(self.col - 1)
-                    logger.debug('BS: Cursor moved to {:d},{:d}'.format(self.row+1, self.col+1))
+                    if debug:
+                        logger.debug('BS: Cursor moved to {:d},{:d}'.format(self.row+1, self.col+1))
+                elif data[i] == SO or data[i] == SI:
+                    self.shifted = data[i] == SO
+                    self._update_charset()
                 else:
                     logger.warn("Unhandled character: " + make_printable(data[i]))
 
             i += 1
 
-        if logger.isEnabledFor(logging.DEBUG):
+        if debug:
             logger.debug("Screen:\n" + self.screen.to_string())
 
     def _handle_escape_sequence(self, esc_seq):
+        debug = self.debug
         old_row = self.row
         old_col = self.col
         esc_seq = esc_seq[1:] # discard ESC character
         if esc_seq == '':
             pass
         elif esc_seq[0] == '(' or esc_seq[0] == ')':
-            # selecting character set
-            logger.debug('ESC{}: Select character set (ignored)'.format(esc_seq))
-            pass
+            # designate the G0 or G1 character set: '0' is DEC special graphics, anything else is treated as ASCII
+            self.charsets[0 if esc_seq[0] == '(' else 1] = esc_seq[1:]
+            self._update_charset()
+            if debug:
+                logger.debug('ESC{}: Select character set'.format(esc_seq))
         elif esc_seq[0] == '[':
             if esc_seq[-1] == 'A':
                 # cursor up
@@ -147,8 +219,8 @@ class TerminalCapture:
                 m = re.search(r'(\d*);(\d*)', esc_seq)
                 if m :
                     # coords are 1-based, so we have to subtract one to convert to 0-based
-                    row = 0 if m.group(1) == '' else int(m.group(1))-1
-                    col = 0 if m.group(2) == '' else int(m.group(2))-1
+                    row = 0 if m.group(1) == '' else _parameter(m.group(1))-1
+                    col = 0 if m.group(2) == '' else _parameter(m.group(2))-1
                 else:
                     row = 0
                     col = 0
@@ -176,43 +248,43 @@ class TerminalCapture:
                 if start == None or end == None:
                     logger.warn('Unknown escape sequence: ESC' + esc_seq)
                 else:
-                    if logger.isEnabledFor(logging.DEBUG):
+                    if debug:
                         logger.debug('ESC{}: Erasing from {:d},{:d} to {:d},{:d}'.format(make_printable(esc_seq), self.row+1, start+1, self.row+1, end+1))
                     
+                    cell = self.cell_cache.get(' ') or self._new_cell(' ')
                     for j in range(start, end+1):
-                        cell = self.screen.cells[self.row][j]
-                        cell.glyph = ' '
-                        cell.fg_color = self.curr_foreground_color
-                        cell.bg_color = self.curr_background_color
-                        cell.bold = self.bold
+                        self.screen.set(self.row, j, cell)
             elif esc_seq[-1] =='M':
                 # delete lines
                 num = self._extract_number(esc_seq, 1)
-                logger.debug('Deleting {:d} lines'.format(num))
-                for dest in range(self.row, self.screen.rows):
-                    src = dest + num
-                    if src < self.screen.rows:
-                        self.screen.cells[dest] = self.screen.cells[src]
-                    else:
-                        self.screen.cells[dest] = self._new_line()
+                if debug:
+                    logger.debug('Deleting {:d} lines'.format(num))
+                self._scroll(self.row, self.screen.rows - 1, num)
             elif esc_seq[-1] == 'P':
                 # CSI Ps P  Delete Ps Character(s) (default = 1) (DCH).
-                num = self._extract_number(esc_seq, 1)
+                # The cells at the end of the line are blanks in the current font
+                num = min(self._extract_number(esc_seq, 1), self.screen.cols - self.col)
                 line = self.screen.cells[self.row]
-                logger.debug('Deleting {} chars at {},{}'.format(num, self.row+1, self.col+1))
-                for dest in range(self.col, self.screen.cols):
-                    src = dest + num
-                    if src < self.screen.cols:
-                        line[dest] = line[src]
-                    else:
-                        line[dest] = Cell()
+                if debug:
+                    logger.debug('Deleting {} chars at {},{}'.format(num, self.row+1, self.col+1))
+                blank = self.cell_cache.get(' ') or self._new_cell(' ')
+                self.screen.set_line(self.row, line[:self.col] + line[self.col+num:] + [blank] * num)
+            elif esc_seq[-1] == '@':
+                # CSI Ps @  Insert Ps (Blank) Character(s) (default = 1) (ICH).
+                num = self._extract_number(esc_seq, 1)
+                if debug:
+                    logger.debug('Inserting {} chars at {},{}'.format(num, self.row+1, self.col+1))
+                self._insert_cells(num)
             elif esc_seq[-1] == 'X':
                 # CSI Ps X  Erase Ps Character(s) (default = 1) (ECH).
                 num = self._extract_number(esc_seq, 1)
-                logger.debug('Erasing {} chars at {},{}'.format(num, self.row+1, self.col+1))
+                if debug:
+                    logger.debug('Erasing {} chars at {},{}'.format(num, self.row+1, self.col+1))
                 line = self.screen.cells[self.row]
                 for dest in range(self.col, min(self.col+num, self.screen.cols)):
-                    line[dest].glyph = ' '
+                    cell = line[dest]
+                    if cell.glyph != ' ':
+                        self.screen.set(self.row, dest, Cell(' ', cell.fg_color, cell.bg_color, cell.bold))
                 self._set_col(self.col + num)
             elif esc_seq[-1] == 'd':
                 # set vertical position
@@ -229,6 +301,9 @@ class TerminalCapture:
                         self.bold = False
                     elif num == 1:
                         self.bold = True
+                    elif num == 22:
+                        # normal intensity
+                        self.bold = False
                     elif num == FG_COLOR_DEFAULT or (num >= 30 and num <= 37) or (num >= 90 and num <=97):
                         self.curr_foreground_color = num 
                     elif num == BG_COLOR_DEFAULT:
@@ -237,27 +312,32 @@ class TerminalCapture:
                         self.curr_background_color = num 
                     elif num >= BG_COLOR_DARK_GRAY and num <= BG_COLOR_WHITE:
                         self.curr_background_color = num 
+                self._update_cell_cache()
             elif esc_seq[-1] == 'r':
                 # set scroll region
                 m = re.search(r'(\d*);(\d*)', esc_seq)
                 if m :
                     # coords are 1-based, so we have to subtract one to convert to 0-based
-                    self.scroll_region_start = 0 if m.group(1) == '' else int(m.group(1))-1
+                    self.scroll_region_start = 0 if m.group(1) == '' else _parameter(m.group(1))-1
                     if self.scroll_region_start < 0:
                         self.scroll_region_start = 0
-                    self.scroll_region_end = self.screen.rows-1 if m.group(2) == '' else int(m.group(2))-1
+                    if self.scroll_region_start > self.screen.rows-1:
+                        self.scroll_region_start = self.screen.rows-1
+                    self.scroll_region_end = self.screen.rows-1 if m.group(2) == '' else _parameter(m.group(2))-1
                     if self.scroll_region_end > self.screen.rows-1:
                         self.scroll_region_end = self.screen.rows-1
                 else:
                     self.scroll_region_start = 0
                     self.scroll_region_end = self.screen.rows-1
-                logger.debug('Set scroll region to {},{}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
+                if debug:
+                    logger.debug('Set scroll region to {},{}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
             elif esc_seq[-1] == 'h':
                 # Set mode
                 if esc_seq == '[4h':
                     # Insert Mode (IRM)
-                    logger.debug('Insert mode (ignored)')
-                    pass
+                    logger.debug('Insert mode')
+                    self.insert_mode = True
+                    self._update_charset()
                 elif esc_seq == '[=7h':
                     logger.debug('Turning line wrap on')
                     self.line_wrap = True
@@ -265,8 +345,9 @@ class TerminalCapture:
                 # Reset mode (inverse of control codes ending in h)
                 if esc_seq == '[4l':
                     # Replace Mode (IRM)
-                    logger.debug('Replace mode (ignored)')
-                    pass
+                    logger.debug('Replace mode')
+                    self.insert_mode = False
+                    self._update_charset()
                 elif esc_seq == '[=7l':
                     logger.debug('Turning line wrap off')
                     self.line_wrap = False
@@ -280,41 +361,40 @@ class TerminalCapture:
             # save cursor position
             self.saved_row = self.row
             self.saved_col = self.col
-            logger.debug('Saved cursor position {:d},{:d}'.format(self.row+1, self.col+1))
+            if debug:
+                logger.debug('Saved cursor position {:d},{:d}'.format(self.row+1, self.col+1))
         elif esc_seq == '8':
             # restore cursor position
             if self.saved_row is not None and self.saved_col is not None:
                 self.row = self.saved_row
                 self.col = self.saved_col
-                logger.debug('Restored cursor position {:d},{:d}'.format(self.row+1, self.col+1))
+                if debug:
+                    logger.debug('Restored cursor position {:d},{:d}'.format(self.row+1, self.col+1))
         elif esc_seq == 'M':
             # Moves cursor up one line in same column. If cursor is at top margin, screen performs a scroll-down.
             if self.row > self.scroll_region_start:
                 self.row -= 1
             else:
-                for row in range(self.scroll_region_end, self.scroll_region_start, -1):
-                    self.screen.cells[row] = self.screen.cells[row-1]
-                self.screen.cells[self.scroll_region_start] = self._new_line()
-                logger.debug('Scrolled down region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
+                self._scroll(self.scroll_region_start, self.scroll_region_end, -1)
+                if debug:
+                    logger.debug('Scrolled down region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
         elif esc_seq == 'D':
             # Moves cursor down one line in same column. If cursor is at bottom margin, screen performs a scroll-up.
             if self.row < self.scroll_region_end:
                 self.row += 1
             else:
-                for row in range(self.scroll_region_start, self.scroll_region_end):
-                    self.screen.cells[row] = self.screen.cells[row+1]
-                self.screen.cells[self.scroll_region_end] = self._new_line()
-                logger.debug('Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
+                self._scroll(self.scroll_region_start, self.scroll_region_end, 1)
+                if debug:
+                    logger.debug('Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
         elif esc_seq == 'E':
             # Moves cursor to first position on next line. If cursor is at bottom margin, screen performs a scroll-up.
             self.col = 0
             if self.row < self.scroll_region_end:
                 self.row += 1
             else:
-                for row in range(self.scroll_region_start, self.scroll_region_end):
-                    self.screen.cells[row] = self.screen.cells[row+1]
-                self.screen.cells[self.scroll_region_end] = self._new_line()
-                logger.debug('Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
+                self._scroll(self.scroll_region_start, self.scroll_region_end, 1)
+                if debug:
+                    logger.debug('Scrolled up region {:d},{:d}'.format(self.scroll_region_start+1, self.scroll_region_end+1))
         elif esc_seq == '=':
             # Enter alternate keypad mode (numlock off?)
             logger.debug('Turn numlock off (ignored)')
@@ -326,7 +406,13 @@ class TerminalCapture:
         else:
             logger.warn('Unknown escape sequence: ESC' + esc_seq)
 
-        if logger.isEnabledFor(logging.DEBUG):
+        tracer = self.tracer
+        if tracer.enabled:
+            tracer.event(trace.EVENT_ESCAPE, ord(esc_seq[-1]) if esc_seq else 0, len(esc_seq))
+            if self.row != old_row or self.col != old_col:
+                tracer.event(trace.EVENT_CURSOR, self.row, self.col)
+
+        if debug:
             esc_seq = 'ESC' + make_printable(esc_seq)
             if self.row != old_row or self.col != old_col:
                 logger.debug(esc_seq + ': Cursor moved to {:d},{:d}'.format(self.row+1, self.col+1))
@@ -339,10 +425,27 @@ class TerminalCapture:
                 logger.debug(esc_seq + ': handled')
 
 
+    def take_scroll_events(self):
+        """ Get the (start_row, end_row, num_lines) scrolls since the last call. Negative num_lines is a scroll down. """
+        events = self.scroll_events
+        self.scroll_events = []
+        return events
+
+    def _scroll(self, start_row, end_row, num):
+        self.screen.scroll(start_row, end_row, num)
+        events = self.scroll_events
+        if events:
+            # merge with the previous scroll if it was of the same region in the same direction
+            last_start, last_end, last_num = events[-1]
+            if last_start == start_row and last_end == end_row and (last_num > 0) == (num > 0):
+                events[-1] = (start_row, end_row, last_num + num)
+                return
+        events.append((start_row, end_row, num))
+
     def _extract_number(self, string, default):
         m = re.search(r'(\d+)', string)
         if m and m.group(1) != '':
-            return int(m.group(1))
+            return _parameter(m.group(1))
         else:
             return default
 
@@ -350,7 +453,7 @@ class TerminalCapture:
         strings = re.findall(r'(\d+)', string)
         results = []
         for string in strings:
-            results.append(int(string))
+            results.append(_parameter(string))
         if len(results) == 0 and default != None:
             results.append(default)
         return results
@@ -360,8 +463,32 @@ class TerminalCapture:
         self.row = 0
         self.col = 0
 
-    def _new_line(self):
-        return [Cell() for _ in range(self.screen.cols)]
+    def _update_cell_cache(self):
+        """ Switch to the cache of cells for the current font """
+        font = (self.curr_foreground_color, self.curr_background_color, self.bold)
+        cell_cache = self.cell_caches.get(font)
+        if cell_cache is None:
+            cell_cache = self.cell_caches[font] = {}
+        self.cell_cache = cell_cache
+
+    def _update_charset(self):
+        """ Work out how characters are printed after a change of character set or insert mode """
+        charset = self.charsets[1 if self.shifted else 0]
+        self.charset_map = DEC_SPECIAL_GRAPHICS if charset == '0' else None
+        self.print_special = self.charset_map is not None or self.insert_mode
+
+    def _insert_cells(self, num):
+        """ Shift the rest of the line right, inserting blanks in the current font at the cursor """
+        num = min(num, self.screen.cols - self.col)
+        line = self.screen.cells[self.row]
+        blank = self.cell_cache.get(' ') or self._new_cell(' ')
+        self.screen.set_line(self.row, line[:self.col] + [blank] * num + line[self.col:self.screen.cols-num])
+
+    def _new_cell(self, glyph):
+        """ Create a cell in the current font, and cache it """
+        cell = Cell(glyph, self.curr_foreground_color, self.curr_background_color, self.bold)
+        self.cell_cache[glyph] = cell
+        return cell
 
     def _set_row(self, val, base = 0):
         val -= base
@@ -383,3 +510,5 @@ class TerminalCapture:
         self._set_row(row, base)
         self._set_col(col, base)
 
+
+register_backend('capture', TerminalCapture)
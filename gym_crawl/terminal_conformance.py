@@ -0,0 +1,119 @@
+'''
+Conformance corpus for terminal backends (see terminal_backend.py).
+
+The corpus is a JSON lines file of cases. Each case is a list of output chunks to feed (split as they
+were read, so escape sequences can be split between chunks), and checkpoints of what the screen should
+look like after a given chunk:
+    {"name": ..., "source": "handwritten" | "synthetic" | "recorded", "chunks": [str, ...],
+     "checkpoints": [{"chunk": index, "lines": {row: text}, "runs": {row: runs}, "cursor": [row, col]}]}
+lines are compared without trailing spaces. runs are [text, fg, bg, bold] from column 0, and the rest
+of the row must be default blanks. Every part of a checkpoint is optional.
+
+Only handwritten cases have expectations worked out independently. The expected screens of synthetic and
+recorded cases are whatever TerminalCapture made of the output when they were recorded, not ground truth:
+they catch regressions and disagreements with capture, including its known quirks (e.g. ECH moves the cursor).
+'''
+import json
+
+from gym_crawl.terminal import BLANK_CELL
+import gym_crawl.terminal_backend as terminal_backend
+from gym_crawl.terminal_capture import TerminalCapture
+
+
+def screen_runs(screen, row):
+    """ Describe a row as runs of [text, fg, bg, bold], leaving out trailing default blanks """
+    line = screen.cells[row]
+    end = len(line)
+    while end > 0 and line[end - 1].key == BLANK_CELL.key:
+        end -= 1
+    runs = []
+    for cell in line[:end]:
+        if runs and runs[-1][1:] == [cell.fg_color, cell.bg_color, cell.bold]:
+            runs[-1][0] += cell.glyph
+        else:
+            runs.append([cell.glyph, cell.fg_color, cell.bg_color, cell.bold])
+    return runs
+
+
+def make_checkpoint(backend, chunk):
+    """ Checkpoint of everything on the backend's screen after chunk """
+    screen = backend.screen
+    runs = {}
+    for row in range(screen.rows):
+        row_runs = screen_runs(screen, row)
+        if row_runs:
+            runs[str(row)] = row_runs
+    return {'chunk': chunk, 'runs': runs, 'cursor': list(backend.cursor())}
+
+
+def make_case(name, source, chunks, num_checkpoints=2, backend_name=terminal_backend.DEFAULT_BACKEND):
+    """ Make a case by replaying chunks through a backend (capture by default), with checkpoints spread through it.
+        The checkpoints are that backend's output, so the case only checks agreement with it.
+    """
+    backend = terminal_backend.create_backend(backend_name)
+    every = max(1, (len(chunks) + num_checkpoints - 1) // num_checkpoints)
+    checkpoints = []
+    for index, chunk in enumerate(chunks):
+        backend.feed(chunk)
+        if (index + 1) % every == 0 or index == len(chunks) - 1:
+            checkpoints.append(make_checkpoint(backend, index))
+    return {'name': name, 'source': source, 'chunks': chunks, 'checkpoints': checkpoints}
+
+
+def check_case(backend, case):
+    """ Feed a case to a new backend. Returns a list of failure descriptions (empty if it passed) """
+    failures = []
+    checkpoints = {checkpoint['chunk']: checkpoint for checkpoint in case['checkpoints']}
+    for index, chunk in enumerate(case['chunks']):
+        try:
+            backend.feed(chunk)
+        except Exception as e:
+            return failures + ['chunk {}: {}: {}'.format(index, type(e).__name__, e)]
+        checkpoint = checkpoints.get(index)
+        if checkpoint is None:
+            continue
+        screen = backend.screen
+        for row, text in checkpoint.get('lines', {}).items():
+            actual = screen.to_string(int(row), 0, int(row), screen.cols - 1).rstrip()
+            if actual != text.rstrip():
+                failures.append('chunk {} row {}: expected {!r}, got {!r}'.format(index, row, text.rstrip(), actual))
+        if 'runs' in checkpoint:
+            expected_runs = checkpoint['runs']
+            for row in range(screen.rows):
+                expected = expected_runs.get(str(row), [])
+                actual = screen_runs(screen, row)
+                if actual != expected:
+                    failures.append('chunk {} row {}: expected runs {}, got {}'.format(index, row, expected, actual))
+        if 'cursor' in checkpoint and list(backend.cursor()) != checkpoint['cursor']:
+            failures.append('chunk {}: expected cursor {}, got {}'.format(index, checkpoint['cursor'], list(backend.cursor())))
+    return failures
+
+
+def load_corpus(filename):
+    with open(filename, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_case(filename, case):
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(case) + '\n')
+
+
+def run_corpus(backend_name, cases):
+    """ Check every case with a new backend each. Returns a list of (case name, failures) """
+    return [(case['name'], check_case(terminal_backend.create_backend(backend_name), case)) for case in cases]
+
+
+class RecordingCapture(TerminalCapture):
+    """ TerminalCapture which keeps the chunks it's fed, for recording cases from crawl sessions """
+
+    def __init__(self, rows=24, cols=80):
+        super().__init__(rows, cols)
+        self.chunks = []
+
+    def feed(self, data):
+        self.chunks.append(data)
+        super().feed(data)
+
+
+terminal_backend.register_backend('recording', RecordingCapture)
@@ -1,9 +1,12 @@
 '''
 Extract data from terminal
 '''
+from collections import OrderedDict
 import logging
 import re
+import threading
 
+import gym_crawl.crawl_defs as defs
 import gym_crawl.terminal as term
 from gym_crawl.map import Color, Cell, Map
 
@@ -21,18 +24,156 @@ STATS_END_ROW = 8
 STATS_START_COL = 37
 STATS_END_COL = 79
 
+# screen classifications
+SCREEN_MAIN = 'main'
+SCREEN_ABILITIES = 'abilities'
+SCREEN_RELIGION = 'religion'
+SCREEN_SKILLS = 'skills'
+SCREEN_SPELLS = 'spells'
+SCREEN_CAST = 'cast'
+SCREEN_CHARACTER = 'character'
+SCREEN_MENU = 'menu'
+SCREEN_OTHER = 'other'
+
+# text which identifies a screen (checked in order)
+SCREEN_SIGNATURES = [
+    (SCREEN_ABILITIES, re.compile(r'to toggle between ability selection and description')),
+    (SCREEN_RELIGION, re.compile(r'Powers\|Wrath')),
+    (SCREEN_SKILLS, re.compile(r'costs\|targets')),
+    (SCREEN_SPELLS, re.compile(r'Describe\|Hide\|Show')),
+    (SCREEN_CAST, re.compile(r'to toggle spell view')),
+    (SCREEN_CHARACTER, re.compile(r'HPRegen .*MPRegen', re.DOTALL)),
+    (SCREEN_MENU, re.compile(r'Inventory:|\d+/52 slots|What do you want to')),
+]
+
+# text drawn last on a screen, so the output is known to be complete (see CrawlEnv._is_ready).
+# Menus don't have any: their title is drawn first, and the end of the list can't be detected
+SCREEN_END_SIGNATURES = {
+    SCREEN_ABILITIES: re.compile(r'to toggle between ability selection and description\.'),
+    SCREEN_RELIGION: re.compile(r'Powers\|Wrath'),
+    SCREEN_SKILLS: re.compile(r'costs\|targets'),
+    SCREEN_SPELLS: re.compile(r'Describe\|Hide\|Show'),
+    SCREEN_CAST: re.compile(r'to toggle spell view\.'),
+    SCREEN_CHARACTER: re.compile(r'HPRegen .*MPRegen .*@: .*A: '),
+}
+
+
+class ParseCache:
+    """ Bounded LRU cache of parse results, keyed by a hash of the screen region they came from.
+        Cached results are shared, so must not be modified.
+        The caches are shared by every env in the process, which may step in different threads (see server.py).
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Get the cached result, or None if there isn't one """
+        with self.lock:
+            result = self.entries.get(key)
+            if result is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        return result
+
+    def put(self, key, result):
+        with self.lock:
+            entries = self.entries
+            entries[key] = result
+            entries.move_to_end(key)
+            self.trim()
+
+    def trim(self):
+        # called with the lock held
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def to_dict(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'capacity': self.capacity}
+
+
+# caches of parsed stats, maps and screen classifications
+PARSE_CACHES = {
+    'stats': ParseCache(),
+    'map': ParseCache(),
+    'screen': ParseCache(),
+}
+
+_stats_cache = PARSE_CACHES['stats']
+_map_cache = PARSE_CACHES['map']
+_screen_cache = PARSE_CACHES['screen']
+
+def get_cache_stats():
+    """ Hit/miss counters for each parse cache """
+    return {name: cache.to_dict() for name, cache in PARSE_CACHES.items()}
+
+def set_cache_size(capacity):
+    for cache in PARSE_CACHES.values():
+        with cache.lock:
+            cache.capacity = capacity
+            cache.trim()
+
+def clear_caches():
+    for cache in PARSE_CACHES.values():
+        cache.clear()
+
 def update_game_state(screen, game_state):
     """ Update the game state from the terminal screen"""
-    _update_stats(screen, game_state)
-    
+    update_stats(screen, game_state)
+    update_map(screen, game_state)
+
+def update_map(screen, game_state):
+    """ Update the map in the game state (only if on the main screen).
+        The map is extracted when it's first used, so the screen must not change after this (see Screen.snapshot).
+    """
     if game_state.on_main_screen:
-        game_state.map = extract_map(screen)
+        game_state.set_map_source(screen)
 
 def is_main_screen(screen):
-    return _extract_stats_panel(screen) is not None
+    return _get_stats(screen) is not False
+
+def classify_screen(screen):
+    """ Work out what kind of screen is being displayed (one of the SCREEN_* values) """
+    key = screen.hash()
+    result = _screen_cache.get(key)
+    if result is None:
+        if is_main_screen(screen):
+            result = SCREEN_MAIN
+        else:
+            contents = screen.to_string()
+            result = SCREEN_OTHER
+            for screen_type, pattern in SCREEN_SIGNATURES:
+                if pattern.search(contents):
+                    result = screen_type
+                    break
+        _screen_cache.put(key, result)
+    return result
 
 def extract_map(screen):
-    """ Extract the map from the terminal data """
+    """ Extract the map from the terminal data.
+        Maps are cached, so the result is shared and must not be modified.
+    """
+    key = screen.block_hash(MAP_START_ROW, MAP_END_ROW, MAP_START_COL, MAP_END_COL)
+    result = _map_cache.get(key)
+    if result is None:
+        result = _extract_map(screen)
+        _map_cache.put(key, result)
+    return result
+
+def _extract_map(screen):
     # transform from row-major (row, col) to column-major (x, y)
     result = Map()
     player_x = (MAP_END_COL + MAP_START_COL) // 2
@@ -45,12 +186,34 @@ def extract_map(screen):
         for row in range(MAP_START_ROW, MAP_END_ROW+1):
             y = row - MAP_START_ROW
             term_cell = screen.cells[row][col]
-            map_cell = _term_cell_to_map_cell(term_cell)
+            map_cell = _map_cells.get(term_cell.key)
+            if map_cell is None:
+                map_cell = _map_cells[term_cell.key] = _term_cell_to_map_cell(term_cell)
             result.cells[x][y] = map_cell
     if logger.isEnabledFor(logging.DEBUG):
         logger.debug("Map:\n" + result.to_string())
     return result
                 
+def extract_entities(game_map):
+    """ Get the monsters and items on the map as {'monsters': [(glyph, x, y)], 'items': [(glyph, x, y)]}.
+        The result is kept on the map (which is shared), so must not be modified.
+    """
+    if game_map.entities is None:
+        monsters = []
+        items = []
+        for x, column in game_map.cells.items():
+            for y, cell in column.items():
+                glyph = cell.glyph
+                if glyph in defs.MONSTER_CHARS:
+                    if (x, y) != game_map.player_pos:
+                        monsters.append((glyph, x, y))
+                elif glyph in ITEM_CHARS:
+                    items.append((glyph, x, y))
+        game_map.entities = {'monsters': monsters, 'items': items}
+    return game_map.entities
+
+ITEM_CHARS = defs.NORMAL_ITEM_CHARS + defs.QUEST_ITEM_CHARS + defs.UNGETABLE_ITEM_CHARS
+
 # convert terminal foreground colours to map colours           
 TERM_FG_COLOR_TO_MAP_COLOR = {
     term.FG_COLOR_BLACK: Color.BLACK,
@@ -93,6 +256,9 @@ TERM_BG_COLOR_TO_MAP_COLOR = {
     term.BG_COLOR_WHITE: Color.WHITE
 }
 
+# map cells are shared between maps, keyed by the terminal cell key
+_map_cells = {}
+
 def _term_cell_to_map_cell(term_cell):
     map_cell = Cell()
     
@@ -119,81 +285,102 @@ def _extract_stats_panel(screen):
         return stats
     else:
         return None
-    
-def _update_stats(screen, game_state):
-    stats = _extract_stats_panel(screen)
+
+def _get_stats(screen):
+    """ Get the stats panel values as a dict, or False if the stats panel isn't displayed """
+    key = screen.block_hash(STATS_START_ROW, STATS_END_ROW, STATS_START_COL, STATS_END_COL)
+    stats = _stats_cache.get(key)
     if stats is None:
+        stats = _parse_stats(_extract_stats_panel(screen))
+        _stats_cache.put(key, stats)
+    return stats
+
+def update_stats(screen, game_state):
+    """ Update the game state from the stats panel """
+    stats = _get_stats(screen)
+    if stats is False:
         game_state.on_main_screen = False
         return
     
     game_state.on_main_screen = True
+    for name, value in stats.items():
+        setattr(game_state, name, value)
+    _update_started(game_state)
 
+def _parse_stats(stats):
+    """ Parse the stats panel text into a dict of game state values (False if there's no stats panel) """
+    if stats is None:
+        return False
+
+    result = {}
+    # place names can have spaces, so it's read from its own line
+    m = re.search(r'Place: *(.*\S)', stats)
+    if m:
+        result['place'] = m.group(1)
     stats = stats.replace('\n', '')
     
     # update hp/max_hp
     m = re.search(r'Health: *(\d+)\/(\d+)', stats)
     if m:
         if m.group(1):
-            game_state.hp = int(m.group(1))
+            result['hp'] = int(m.group(1))
         if m.group(2):
-            game_state.max_hp = int(m.group(2))
+            result['max_hp'] = int(m.group(2))
 
     # update mp/max_mp
     m = re.search(r'Magic: *(\d+)/(\d+)', stats)
     if m:
         if m.group(1):
-            game_state.mp = int(m.group(1))
+            result['mp'] = int(m.group(1))
         if m.group(2):
-            game_state.max_mp = int(m.group(1))
+            result['max_mp'] = int(m.group(2))
 
     # update experience level
     m = re.search(r'XL: *(\d+) *Next: *(\d+)', stats)
     if m and m.group(1) and m.group(2):
-        game_state.xl = int(m.group(1))
-        game_state.pcnt_next_xl = int(m.group(2))
+        result['xl'] = int(m.group(1))
+        result['pcnt_next_xl'] = int(m.group(2))
 
     # update character stats
     m = re.search(r'AC: *(\d+)', stats)
     if m and m.group(1):
-        game_state.ac = int(m.group(1))
+        result['ac'] = int(m.group(1))
     
     m = re.search(r'EV: *(\d+)', stats)
     if m and m.group(1):
-        game_state.ev = int(m.group(1))
+        result['ev'] = int(m.group(1))
 
     m = re.search(r'SH: *(\d+)', stats)
     if m and m.group(1):
-        game_state.sh = int(m.group(1))
+        result['sh'] = int(m.group(1))
 
     m = re.search(r'Str: *(\d+)', stats)
     if m and m.group(1):
-        game_state.str = int(m.group(1))
+        result['str'] = int(m.group(1))
     
     m = re.search(r'Int: *(\d+)', stats)
     if m and m.group(1):
-        game_state.int = int(m.group(1))
+        result['int'] = int(m.group(1))
 
     m = re.search(r'Dex: *(\d+)', stats)
     if m and m.group(1):
-        game_state.dex = int(m.group(1))
+        result['dex'] = int(m.group(1))
 
     # Update time
-    m = re.search(r'Time: *([\d\.]+)', stats)
+    m = re.search(r'Time: *(\d+(?:\.\d+)?)', stats)
     if m and m.group(1):
-        game_state.time = float(m.group(1))
-
-    # Update place
-    m = re.search(r'Place: *([A-Za-z0-9\:]+)', stats)
-    if m and m.group(1):
-        game_state.place = m.group(1)
+        result['time'] = float(m.group(1))
 
     # Update noise
     m = re.search(r'Noise: *(\=*)', stats)
     if m and m.group(1):
-        game_state.noise = len(m.group(1))
+        result['noise'] = len(m.group(1))
     else:
-        game_state.noise = 0
+        result['noise'] = 0
+
+    return result
 
+def _update_started(game_state):
     if not game_state.started:
         # check if game has started now
         if game_state.max_hp != 0:
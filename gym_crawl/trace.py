@@ -0,0 +1,128 @@
+'''
+Structured tracing of hot-path events into a preallocated ring buffer.
+
+Call sites check tracer.enabled before recording, so tracing costs one attribute lookup when it is off.
+Events are only formatted when the buffer is dumped.
+'''
+from array import array
+import threading
+import time
+
+from gym_crawl.chars import make_printable
+
+# event types
+EVENT_CHUNK = 1         # a = number of chars received
+EVENT_ESCAPE = 2        # a = final char of escape sequence (as ordinal), b = length of sequence
+EVENT_CURSOR = 3        # a = row, b = col (0-based)
+EVENT_TRIGGER = 4       # a = trigger type
+EVENT_SEND = 5          # a = number of chars sent, b = first char (as ordinal)
+
+EVENT_NAMES = {
+    EVENT_CHUNK: 'chunk',
+    EVENT_ESCAPE: 'escape',
+    EVENT_CURSOR: 'cursor',
+    EVENT_TRIGGER: 'trigger',
+    EVENT_SEND: 'send',
+}
+
+# trigger types
+TRIGGER_READY = 1
+TRIGGER_MORE = 2
+TRIGGER_INSCRIBE = 3
+TRIGGER_DROP_EMPTY = 4
+TRIGGER_TIMEOUT = 5
+
+TRIGGER_NAMES = {
+    TRIGGER_READY: 'ready',
+    TRIGGER_MORE: 'more',
+    TRIGGER_INSCRIBE: 'inscribe',
+    TRIGGER_DROP_EMPTY: 'drop-empty',
+    TRIGGER_TIMEOUT: 'timeout',
+}
+
+# number of slots per event: timestamp, type, a, b
+EVENT_SIZE = 4
+
+
+class Tracer:
+    """ Fixed-capacity ring buffer of binary events.
+        The buffer is allocated when tracing is first enabled.
+        Envs in several threads (see server.py) share the tracer, so recording takes a lock (only when enabled).
+    """
+
+    def __init__(self, capacity=65536):
+        self.enabled = False
+        self.capacity = capacity
+        self.buffer = None
+        self.count = 0 # total number of events recorded (including overwritten ones)
+        self.lock = threading.Lock()
+
+    def enable(self, capacity=None):
+        with self.lock:
+            if capacity is not None and capacity != self.capacity:
+                self.capacity = capacity
+                self.buffer = None
+            if self.buffer is None:
+                self.buffer = array('q', bytes(8 * EVENT_SIZE * self.capacity))
+                self.count = 0
+            self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self.lock:
+            self.count = 0
+
+    def event(self, event_type, a=0, b=0):
+        with self.lock:
+            i = (self.count % self.capacity) * EVENT_SIZE
+            buffer = self.buffer
+            buffer[i] = time.perf_counter_ns()
+            buffer[i+1] = event_type
+            buffer[i+2] = a
+            buffer[i+3] = b
+            self.count += 1
+
+    def events(self):
+        """ Generate the buffered events as (timestamp_ns, type, a, b), oldest first """
+        with self.lock:
+            if self.buffer is None:
+                return
+            buffer = array('q', self.buffer)
+            count = self.count
+            capacity = self.capacity
+        num_events = min(count, capacity)
+        first = count - num_events
+        for n in range(first, count):
+            i = (n % capacity) * EVENT_SIZE
+            yield buffer[i], buffer[i+1], buffer[i+2], buffer[i+3]
+
+    def dump(self, filename):
+        """ Write the buffered events to a text file """
+        with open(filename, 'w') as f:
+            start = None
+            for timestamp, event_type, a, b in self.events():
+                if start is None:
+                    start = timestamp
+                f.write('{:12.6f} {}\n'.format((timestamp - start) / 1e9, format_event(event_type, a, b)))
+        return filename
+
+
+def format_event(event_type, a, b):
+    if event_type == EVENT_CHUNK:
+        return 'chunk len={}'.format(a)
+    elif event_type == EVENT_ESCAPE:
+        return 'escape final={} len={}'.format(make_printable(chr(a)) if a else '', b)
+    elif event_type == EVENT_CURSOR:
+        return 'cursor {},{}'.format(a+1, b+1)
+    elif event_type == EVENT_TRIGGER:
+        return 'trigger {}'.format(TRIGGER_NAMES.get(a, a))
+    elif event_type == EVENT_SEND:
+        return 'send len={} first={}'.format(a, make_printable(chr(b)) if b else '')
+    else:
+        return '{} {} {}'.format(EVENT_NAMES.get(event_type, event_type), a, b)
+
+
+# tracer shared by the terminal capture and the environment
+tracer = Tracer()
@@ -0,0 +1,154 @@
+'''
+Multi-process crawl environments which write observations straight into shared memory.
+
+Each env slot runs a CrawlEnv in a worker process and owns a shared memory block holding its
+observation arrays (see arrays.py). Only actions, rewards and done flags go through the pipes.
+Policies can also be sent to the workers to run many steps without a round trip each (see rollout).
+'''
+import logging
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import gym_crawl.arrays as arrays
+from gym_crawl.policies import Rollout
+
+logger = logging.getLogger('vec-env')
+
+CMD_RESET = 1
+CMD_STEP = 2
+CMD_CLOSE = 3
+CMD_ROLLOUT = 4
+
+
+def _worker(index, pipe, shm, character_name, action_keys, auto_reset):
+    # imported here so the parent doesn't need gym to be importable before forking
+    from gym_crawl.envs.crawl_env import CrawlEnv
+
+    observation = arrays.allocate_observation(shm.buf)
+    writer = arrays.ObservationWriter(observation)
+    env = CrawlEnv()
+    env.set_character_name('{}{}'.format(character_name, index))
+    if action_keys is not None:
+        env.set_action_keys(action_keys)
+    rollout = Rollout(env)
+    rollouts = 0
+    try:
+        while True:
+            cmd, action = pipe.recv()
+            if cmd == CMD_RESET:
+                game_state, reward, done, screen = env.reset()
+                rollout.observe(game_state, screen, done, reset=True)
+                writer.reset()
+                writer.write(game_state, screen, env.steps)
+                pipe.send((reward, done))
+            elif cmd == CMD_STEP:
+                game_state, reward, done, screen = env.step(action)
+                rollout.observe(game_state, screen, done, reward)
+                if done and auto_reset:
+                    # the observation is the first one of the next episode, but done is reported for the step
+                    game_state, _, reset_done, screen = env.reset()
+                    rollout.observe(game_state, screen, reset_done, reset=True)
+                    writer.reset()
+                writer.write(game_state, screen, env.steps)
+                pipe.send((reward, done))
+            elif cmd == CMD_ROLLOUT:
+                policy, num_steps, num_episodes, seed = action
+                rollouts += 1
+                rollout.set_policy(policy, None if seed is None else (seed, index, rollouts))
+                trajectory = rollout.run(num_steps, num_episodes)
+                if rollout.game_state is not None:
+                    writer.reset()
+                    writer.write(rollout.game_state, rollout.screen, env.steps)
+                pipe.send(trajectory)
+            elif cmd == CMD_CLOSE:
+                break
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        env.close()
+        del observation, writer
+        pipe.close()
+
+
+class SharedMemoryVecEnv:
+    """ A batch of crawl environments in worker processes.
+        observations is a list (one per env) of dicts of numpy arrays in shared memory, which are updated in place
+        by reset and step. Copy them if they need to be kept.
+    """
+
+    def __init__(self, num_envs, character_name='Bot', action_keys=None, auto_reset=True):
+        self.num_envs = num_envs
+        self.shms = []
+        self.observations = []
+        self.pipes = []
+        self.processes = []
+        self.closed = False
+
+        # fork, so workers inherit the shared memory mappings rather than attaching by name
+        context = multiprocessing.get_context('fork')
+        size = arrays.observation_size()
+        for index in range(num_envs):
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shms.append(shm)
+            self.observations.append(arrays.allocate_observation(shm.buf))
+            parent_pipe, child_pipe = context.Pipe()
+            process = context.Process(target=_worker, args=(index, child_pipe, shm, character_name, action_keys, auto_reset))
+            process.daemon = True
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+
+    def reset(self):
+        """ Reset all envs. Returns the observations """
+        for pipe in self.pipes:
+            pipe.send((CMD_RESET, None))
+        for pipe in self.pipes:
+            pipe.recv()
+        return self.observations
+
+    def step(self, actions):
+        """ Step each env with its action. Returns (observations, rewards, dones) """
+        for pipe, action in zip(self.pipes, actions):
+            pipe.send((CMD_STEP, int(action)))
+        rewards = np.zeros(self.num_envs, np.int64)
+        dones = np.zeros(self.num_envs, bool)
+        for i, pipe in enumerate(self.pipes):
+            rewards[i], dones[i] = pipe.recv()
+        return self.observations, rewards, dones
+
+    def rollout(self, policy, num_steps=None, num_episodes=None, seed=None):
+        """ Run policy (see policies.py) in every env until num_steps steps have been taken or num_episodes
+            episodes have ended, carrying on from the current observations. Returns a trajectory dict per env
+            (see policies.Rollout.run), and the observations are left at the last step.
+            Each env gets its own random seed derived from seed.
+        """
+        for pipe in self.pipes:
+            pipe.send((CMD_ROLLOUT, (policy, num_steps, num_episodes, seed)))
+        return [pipe.recv() for pipe in self.pipes]
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for pipe in self.pipes:
+            try:
+                pipe.send((CMD_CLOSE, None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                logger.info('Killing worker {}'.format(process.pid))
+                process.kill()
+        # views must be released before the shared memory can be closed
+        self.observations = []
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+    def __del__(self):
+        self.close()
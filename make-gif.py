@@ -0,0 +1,42 @@
+'''
+Render a recording (see gym_crawl/recorder.py) to an animated GIF, or a video if the output isn't .gif
+
+Usage: python3 make-gif.py RECORDING_DIR OUTPUT [-fps N] [-max-frames N] [-font PATH] [-font-size N]
+'''
+import sys
+import time
+
+from gym_crawl.rasterizer import Rasterizer, render_recording
+
+fps = 10
+max_frames = None
+font_path = None
+font_size = 14
+positional = []
+arguments = sys.argv[1:]
+i = 0
+while i < len(arguments):
+    arg = arguments[i]
+    if arg == '-fps':
+        i += 1
+        fps = float(arguments[i])
+    elif arg == '-max-frames':
+        i += 1
+        max_frames = int(arguments[i])
+    elif arg == '-font':
+        i += 1
+        font_path = arguments[i]
+    elif arg == '-font-size':
+        i += 1
+        font_size = int(arguments[i])
+    else:
+        positional.append(arg)
+    i += 1
+
+if len(positional) != 2:
+    print(__doc__)
+    sys.exit(1)
+
+start_time = time.perf_counter()
+num_frames = render_recording(positional[0], positional[1], fps, max_frames, Rasterizer(font_path, font_size))
+print('Wrote {} frames to {} in {:.1f} seconds'.format(num_frames, positional[1], time.perf_counter() - start_time))
@@ -2,5 +2,5 @@ from setuptools import setup
 
 setup(name='gym_crawl',
       version='0.0.1',
-      install_requires=['gym']
+      install_requires=['gym', 'numpy']
 )
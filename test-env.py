@@ -31,6 +31,9 @@ for arg in arguments:
         logging.getLogger('crawl-env').setLevel(logging.DEBUG)
     elif arg == '-debug-term-capture':
         logging.getLogger('term-capture').setLevel(logging.DEBUG)
+    elif arg == '-trace':
+        # record terminal/IO events, dumped to a file on error
+        env.set_tracing(True)
 
 logging.basicConfig(filename='test-env.log', filemode='w', level=log_level, format='%(asctime)s:%(levelname)s:%(module)s:%(message)s')
 